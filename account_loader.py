@@ -0,0 +1,150 @@
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from system_reader import CSVLastRowExtractor
+
+BALANCE_COLUMNS = ['account_id', 'currency', 'balance', 'timestamp_end']
+
+
+def account_transactions_filename(account_id: int):
+    return f"{account_id}_transactions.csv"
+
+
+def _read_latest_balances(file_paths, read_last_row=None):
+    """
+    Read the latest balance columns of several account transaction files.
+
+    A top-level function so that it can be sent to a process pool.
+    """
+    if read_last_row is None:
+        return CSVLastRowExtractor.extract_last_rows_many(file_paths, BALANCE_COLUMNS)
+    return [read_last_row(file_path, BALANCE_COLUMNS) for file_path in file_paths]
+
+
+class AccountLoader:
+    """
+    Loads account profiles and their latest balances at startup.
+
+    system_accounts.csv is read once, then the tail of every {account_id}_transactions.csv
+    is read on a thread pool, or on a process pool for very large account sets. Each
+    tail read memory-maps the file once, and the header is parsed once per file schema.
+    Progress and timings are reported as a metrics dictionary instead of prints.
+    """
+    def __init__(self, max_workers: int = None, use_processes: bool = None, process_threshold: int = 200_000,
+                 chunk_size: int = 256, progress_callback=None) -> None:
+        """
+        Initialize the AccountLoader.
+
+        :param max_workers: Number of pool workers (default is the executor's own default)
+        :param use_processes: True for a process pool, False for a thread pool, None to pick
+                              a process pool only when there are at least process_threshold accounts
+        :param process_threshold: Number of accounts from which a process pool is used when use_processes is None
+        :param chunk_size: Number of account files read by one pool task
+        :param progress_callback: Callable receiving a metrics dictionary after each completed chunk
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1.")
+        self.max_workers = max_workers
+        self.use_processes = use_processes
+        self.process_threshold = process_threshold
+        self.chunk_size = chunk_size
+        self.progress_callback = progress_callback
+
+    def read_profiles(self, system_accounts_filename):
+        """
+        Read the account profiles, skipping duplicate usernames and account_ids.
+
+        :param system_accounts_filename: Path of system_accounts.csv
+        :return: Tuple of a list of (account_id, user_name) to load, a list of skipped
+                 (account_id, user_name, reason) and the largest account_id seen
+        """
+        profiles = []
+        skipped = []
+        seen_names = set()
+        seen_ids = set()
+        last_account_id = None
+        with open(system_accounts_filename, 'r', newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            next(reader, None)
+            for row in reader:
+                if not row:
+                    continue
+                account_id, user_name = int(row[0]), row[1]
+                if last_account_id is None or account_id > last_account_id:
+                    last_account_id = account_id
+
+                if user_name in seen_names:
+                    skipped.append((account_id, user_name, 'user_name'))
+                elif account_id in seen_ids:
+                    skipped.append((account_id, user_name, 'account_id'))
+                else:
+                    seen_names.add(user_name)
+                    seen_ids.add(account_id)
+                    profiles.append((account_id, user_name))
+        return profiles, skipped, last_account_id
+
+    def load(self, system_accounts_filename, file_path_for=account_transactions_filename, read_last_row=None):
+        """
+        Load every account profile with its latest currency and balance.
+
+        :param system_accounts_filename: Path of system_accounts.csv
+        :param file_path_for: Callable mapping an account_id to its transaction file path
+        :param read_last_row: Callable taking a file path and column names and returning the last row's values,
+                              for transaction files that are not plain CSV; it always runs on a thread pool
+                              (default is CSVLastRowExtractor.extract_last_rows)
+        :return: Tuple of a list of (account_id, user_name, currency, balance, timestamp_end),
+                 the list of skipped duplicates and a metrics dictionary
+        """
+        start_time = time.perf_counter()
+        profiles, skipped, last_account_id = self.read_profiles(system_accounts_filename)
+        profiles_seconds = time.perf_counter() - start_time
+
+        total = len(profiles)
+        use_processes = self.use_processes
+        if use_processes is None:
+            use_processes = total >= self.process_threshold
+        if read_last_row is not None:
+            # A custom reader is usually a bound method of a live journal, which cannot be sent to another process
+            use_processes = False
+
+        metrics = {
+            'accounts_total': total,
+            'accounts_loaded': 0,
+            'duplicates_skipped': len(skipped),
+            'last_account_id': last_account_id,
+            'executor': 'process' if use_processes else 'thread',
+            'profiles_seconds': profiles_seconds,
+            'balances_seconds': 0.0,
+            'elapsed_seconds': profiles_seconds,
+        }
+
+        paths = [file_path_for(account_id) for account_id, _ in profiles]
+        chunks = [paths[i:i + self.chunk_size] for i in range(0, total, self.chunk_size)]
+        balances = []
+        if chunks:
+            executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+            balances_start = time.perf_counter()
+            with executor_class(max_workers=self.max_workers) as executor:
+                for chunk_result in executor.map(_read_latest_balances, chunks, [read_last_row] * len(chunks)):
+                    balances.extend(chunk_result)
+                    metrics['accounts_loaded'] = len(balances)
+                    metrics['balances_seconds'] = time.perf_counter() - balances_start
+                    metrics['elapsed_seconds'] = time.perf_counter() - start_time
+                    if self.progress_callback is not None:
+                        self.progress_callback(dict(metrics))
+
+        accounts = [
+            (int(account_id), user_name, currency, float(balance), timestamp_end)
+            for (_, user_name), (account_id, currency, balance, timestamp_end) in zip(profiles, balances)
+        ]
+        metrics['elapsed_seconds'] = time.perf_counter() - start_time
+        if total:
+            metrics['accounts_per_second'] = total / metrics['elapsed_seconds'] if metrics['elapsed_seconds'] else float('inf')
+        return accounts, skipped, metrics
+
+
+if __name__ == "__main__":
+    if os.path.isfile('system_accounts.csv'):
+        accounts, skipped, metrics = AccountLoader().load('system_accounts.csv')
+        print(f"Load metrics: {metrics}")
@@ -0,0 +1,322 @@
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from money import from_minor
+
+KEY_USER_NAME = 'user_name'
+KEY_ACCOUNT_ID = 'account_id'
+
+
+class AccountRegistry(Mapping):
+    """
+    A username-keyed mapping of accounts with a second index by account_id.
+
+    Behaves like the plain {user_name: BankAccount} dict it replaces, and adds
+    constant-time lookups by account_id plus bulk lookups for both key types.
+    Both indexes are only changed together, through add() and remove(), which
+    also move the balances of registered accounts in and out of the optional BalanceBook.
+    """
+    def __init__(self, balance_book=None) -> None:
+        """
+        Initialize the AccountRegistry.
+
+        :param balance_book: BalanceBook storing the balances of registered accounts (default is None)
+        """
+        self._by_name = {}
+        self._by_id = {}
+        self.balance_book = balance_book
+
+    def __getitem__(self, user_name):
+        return self._by_name[user_name]
+
+    def __iter__(self):
+        return iter(self._by_name)
+
+    def __len__(self):
+        return len(self._by_name)
+
+    def __contains__(self, user_name):
+        return user_name in self._by_name
+
+    def add(self, account):
+        """
+        Register an account under both its username and its account_id.
+
+        :param account: BankAccount instance
+        :raise ValueError: If the username or the account_id is already registered
+        """
+        if account.user_name in self._by_name:
+            raise ValueError(f"Account with username '{account.user_name}' already exists.")
+        if account.account_id in self._by_id:
+            raise ValueError(f"Account with account_id {account.account_id} already exists.")
+        self._by_name[account.user_name] = account
+        self._by_id[account.account_id] = account
+        if self.balance_book is not None:
+            self.balance_book.track(account)
+
+    def remove(self, account):
+        """
+        Remove an account from both indexes.
+
+        :param account: BankAccount instance
+        """
+        self._by_name.pop(account.user_name, None)
+        if self._by_id.pop(account.account_id, None) is not None and self.balance_book is not None:
+            self.balance_book.untrack(account)
+
+    def get_by_name(self, user_name, default=None):
+        return self._by_name.get(user_name, default)
+
+    def get_by_id(self, account_id: int, default=None):
+        return self._by_id.get(account_id, default)
+
+    def contains_id(self, account_id: int):
+        return account_id in self._by_id
+
+    def get_many(self, keys, key: str = KEY_USER_NAME):
+        """
+        Look up several accounts at once.
+
+        :param keys: Iterable of usernames or account_ids
+        :param key: 'user_name' or 'account_id' (default is 'user_name')
+        :return: List of BankAccount instances in the order of keys, None where no account is found
+        :raise ValueError: If key is not a supported key type
+        """
+        if key == KEY_USER_NAME:
+            index = self._by_name
+        elif key == KEY_ACCOUNT_ID:
+            index = self._by_id
+        else:
+            raise ValueError(f"key must be '{KEY_USER_NAME}' or '{KEY_ACCOUNT_ID}', got '{key}'.")
+        get = index.get
+        return [get(k) for k in keys]
+
+    def account_ids(self):
+        return self._by_id.keys()
+
+    @property
+    def last_account_id(self):
+        """
+        The largest registered account_id, or None if the registry is empty.
+        """
+        return max(self._by_id) if self._by_id else None
+
+    @property
+    def resident_count(self):
+        """
+        Number of BankAccount instances held in memory.
+        """
+        return len(self._by_id)
+
+    def iter_balances(self):
+        """
+        Iterate over the balance of every registered account without hydrating any.
+
+        :return: Generator yielding (account_id, user_name, currency, balance) tuples
+        """
+        for account in list(self._by_name.values()):
+            yield account.account_id, account.user_name, account.currency, account.balance
+
+    def pin(self, account):
+        """
+        Keep an account resident while it has uncommitted transactions. Every account is resident here.
+        """
+
+    def unpin(self, account):
+        """
+        Release one pin() of an account once its transaction is journaled.
+        """
+
+
+class LazyAccountRegistry(AccountRegistry):
+    """
+    An AccountRegistry backed by a directory of account_id and username pairs, hydrating accounts on first use.
+
+    Only the directory is loaded up front. The first lookup of an account builds its
+    BankAccount, reading the balance from the tail of its transaction file, and at most
+    max_resident accounts stay in memory, the least recently used being evicted first.
+    Accounts pinned by in-flight transactions are never evicted, so every lookup returns
+    the instance the pipeline is committing. An evicted account's balance stays in the
+    BalanceBook, which keeps the totals of every account seen so far and lets it be
+    hydrated again without reading its file. Lengths, iteration, membership tests and
+    iter_balances() use the directory and the BalanceBook and hydrate nothing; values()
+    and items() hydrate every account in turn.
+    """
+    def __init__(self, balance_book, account_factory, read_balance, max_resident: int = 10_000) -> None:
+        """
+        Initialize the LazyAccountRegistry.
+
+        :param balance_book: BalanceBook storing the balances of hydrated accounts
+        :param account_factory: Callable building an account from (account_id, user_name[, balance, currency])
+        :param read_balance: Callable returning the (currency, balance) of an account_id from its transaction file
+        :param max_resident: Maximum number of unpinned accounts kept in memory (default is 10,000)
+        :raise ValueError: If max_resident is not positive
+        """
+        if max_resident < 1:
+            raise ValueError("max_resident must be at least 1.")
+        super().__init__(balance_book)
+        # Resident accounts, least recently used first
+        self._by_id = OrderedDict()
+        self._ids_by_name = {}
+        self._names_by_id = {}
+        self._pins = {}
+        self._account_factory = account_factory
+        self._read_balance = read_balance
+        self.max_resident = max_resident
+        self.hydrations = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+
+    def __getitem__(self, user_name):
+        account = self.get_by_name(user_name)
+        if account is None:
+            raise KeyError(user_name)
+        return account
+
+    def __iter__(self):
+        return iter(self._ids_by_name)
+
+    def __len__(self):
+        return len(self._ids_by_name)
+
+    def __contains__(self, user_name):
+        return user_name in self._ids_by_name
+
+    def add_profile(self, account_id: int, user_name: str):
+        """
+        Add an existing account to the directory without hydrating it.
+        """
+        with self._lock:
+            self._ids_by_name[user_name] = account_id
+            self._names_by_id[account_id] = user_name
+
+    def add(self, account):
+        """
+        Register a new account in the directory and keep it resident.
+
+        :param account: BankAccount instance
+        :raise ValueError: If the username or the account_id is already registered
+        """
+        with self._lock:
+            if account.user_name in self._ids_by_name:
+                raise ValueError(f"Account with username '{account.user_name}' already exists.")
+            if account.account_id in self._names_by_id:
+                raise ValueError(f"Account with account_id {account.account_id} already exists.")
+            self.add_profile(account.account_id, account.user_name)
+            self.balance_book.track(account)
+            self._make_resident(account)
+
+    def remove(self, account):
+        """
+        Remove an account from the directory, the resident set and the BalanceBook.
+
+        :param account: BankAccount instance
+        """
+        with self._lock:
+            if self._names_by_id.pop(account.account_id, None) is None:
+                return
+            self._ids_by_name.pop(account.user_name, None)
+            self._by_name.pop(account.user_name, None)
+            self._by_id.pop(account.account_id, None)
+            self._pins.pop(account.account_id, None)
+            if account._book is not None:
+                self.balance_book.untrack(account)
+
+    def get_by_name(self, user_name, default=None):
+        account_id = self._ids_by_name.get(user_name)
+        return default if account_id is None else self._get_resident(account_id, user_name)
+
+    def get_by_id(self, account_id: int, default=None):
+        user_name = self._names_by_id.get(account_id)
+        return default if user_name is None else self._get_resident(account_id, user_name)
+
+    def contains_id(self, account_id: int):
+        return account_id in self._names_by_id
+
+    def get_many(self, keys, key: str = KEY_USER_NAME):
+        if key == KEY_USER_NAME:
+            get = self.get_by_name
+        elif key == KEY_ACCOUNT_ID:
+            get = self.get_by_id
+        else:
+            raise ValueError(f"key must be '{KEY_USER_NAME}' or '{KEY_ACCOUNT_ID}', got '{key}'.")
+        return [get(k) for k in keys]
+
+    def account_ids(self):
+        return self._names_by_id.keys()
+
+    @property
+    def last_account_id(self):
+        return max(self._names_by_id) if self._names_by_id else None
+
+    def iter_balances(self):
+        with self._lock:
+            directory = list(self._names_by_id.items())
+        for account_id, user_name in directory:
+            account = self._by_id.get(account_id)
+            if account is not None:
+                yield account_id, user_name, account.currency, account.balance
+                continue
+            stored = self.balance_book.balance_of(account_id)
+            if stored is None:
+                account = self._get_resident(account_id, user_name)
+                yield account_id, user_name, account.currency, account.balance
+            else:
+                currency, units = stored
+                yield account_id, user_name, currency, from_minor(units, currency)
+
+    def _get_resident(self, account_id, user_name):
+        with self._lock:
+            account = self._by_id.get(account_id)
+            if account is not None:
+                self._by_id.move_to_end(account_id)
+                return account
+            account = self._account_factory(account_id, user_name)
+            if not self.balance_book.attach(account):
+                currency, balance = self._read_balance(account_id)
+                account = self._account_factory(account_id, user_name, balance, currency)
+                self.balance_book.track(account)
+            self.hydrations += 1
+            self._make_resident(account)
+            return account
+
+    def _make_resident(self, account):
+        self._by_id[account.account_id] = account
+        self._by_name[account.user_name] = account
+        self._evict_locked()
+
+    def _evict_locked(self):
+        excess = len(self._by_id) - self.max_resident
+        if excess <= 0:
+            return
+        victims = []
+        for account_id in self._by_id:
+            if len(victims) == excess:
+                break
+            if account_id not in self._pins:
+                victims.append(account_id)
+        for account_id in victims:
+            account = self._by_id.pop(account_id)
+            del self._by_name[account.user_name]
+        self.evictions += len(victims)
+
+    def pin(self, account):
+        """
+        Keep an account resident until the matching unpin(), making it resident again if it was evicted.
+        """
+        with self._lock:
+            account_id = account.account_id
+            self._pins[account_id] = self._pins.get(account_id, 0) + 1
+            if account_id not in self._by_id and account_id in self._names_by_id:
+                self._make_resident(account)
+
+    def unpin(self, account):
+        with self._lock:
+            pins = self._pins.get(account.account_id)
+            if pins is None:
+                return
+            if pins > 1:
+                self._pins[account.account_id] = pins - 1
+            else:
+                del self._pins[account.account_id]
+                self._evict_locked()
@@ -0,0 +1,194 @@
+import math
+import operator
+import threading
+from bisect import bisect_right
+from money import from_minor
+
+DEFAULT_BUCKET_EDGES = (0, 100, 1_000, 10_000, 100_000, 1_000_000)
+
+
+class BalanceAggregates:
+    """
+    Running totals over every tracked account's balance, updated on each balance change instead of recomputed per read.
+
+    Maintains the account count, the total balance, per-currency totals and counts,
+    a balance histogram and the minimum and maximum balances. Totals are kept as
+    exact integer minor units per currency, so they never drift. Nothing is stored
+    per account: the minimum and maximum are cached and only recomputed, with one
+    scan of the BalanceBook, after the account holding one of them moves inwards.
+    Every read is O(1) apart from those rescans.
+    """
+    def __init__(self, bucket_edges=DEFAULT_BUCKET_EDGES, scan_extremes=None) -> None:
+        """
+        Initialize the BalanceAggregates.
+
+        :param bucket_edges: Increasing lower edges of the histogram buckets; balances below the first edge
+                             go to an extra first bucket (default is 0, 100, 1,000, 10,000, 100,000 and 1,000,000)
+        :param scan_extremes: Callable returning the current ((account_id, balance) minimum, maximum) pair,
+                              used to refresh a stale minimum or maximum (BalanceBook sets it)
+        :raise ValueError: If the bucket edges are empty or not increasing
+        """
+        bucket_edges = tuple(bucket_edges)
+        if not bucket_edges or any(low >= high for low, high in zip(bucket_edges, bucket_edges[1:])):
+            raise ValueError("bucket_edges must be a non-empty increasing sequence.")
+        self.bucket_edges = bucket_edges
+        self._lock = threading.Lock()
+        self._currency_totals = {}  # currency -> total in minor units
+        self._currency_counts = {}
+        self._histogram = [0] * (len(bucket_edges) + 1)
+        self._count = 0
+        self.scan_extremes = scan_extremes
+        # (account_id, balance) of the lowest and highest balances, None when unknown
+        self._min = None
+        self._max = None
+        self._extremes_stale = False
+
+    def _bucket(self, balance):
+        return bisect_right(self.bucket_edges, balance)
+
+    def _apply(self, currency, units, balance, sign):
+        self._currency_totals[currency] = self._currency_totals.get(currency, 0) + sign * units
+        self._currency_counts[currency] = self._currency_counts.get(currency, 0) + sign
+        self._histogram[self._bucket(balance)] += sign
+
+    def _observe(self, account_id, balance):
+        """
+        Keep the cached minimum and maximum current after an account's balance changed to balance.
+        """
+        if self._extremes_stale:
+            return
+        for attribute, outwards in (('_min', operator.lt), ('_max', operator.gt)):
+            extreme = getattr(self, attribute)
+            if extreme is None or outwards(balance, extreme[1]) or (extreme[0] == account_id and balance == extreme[1]):
+                setattr(self, attribute, (account_id, balance))
+            elif extreme[0] == account_id:
+                # The holder moved inwards, so another account may hold the extreme now
+                self._extremes_stale = True
+
+    def track(self, account_id, currency, units):
+        """
+        Start counting an account's balance.
+
+        :param account_id: Unique identifier for the account
+        :param currency: Currency of the account
+        :param units: Balance in minor units
+        """
+        balance = from_minor(units, currency)
+        with self._lock:
+            self._count += 1
+            self._apply(currency, units, balance, 1)
+            self._observe(account_id, balance)
+
+    def untrack(self, account_id, currency, units):
+        """
+        Stop counting an account's balance.
+
+        :param account_id: Unique identifier for the account
+        :param currency: Currency of the account
+        :param units: Balance in minor units
+        """
+        with self._lock:
+            self._count -= 1
+            self._apply(currency, units, from_minor(units, currency), -1)
+            if (self._min is not None and self._min[0] == account_id) or (self._max is not None and self._max[0] == account_id):
+                self._extremes_stale = True
+
+    def update(self, account_id, currency, old_units, new_units):
+        """
+        Record a balance change of a tracked account. Called by BalanceBook on every balance write.
+
+        :param account_id: Unique identifier for the account
+        :param currency: Currency of the account
+        :param old_units: Balance before the change, in minor units
+        :param new_units: Balance after the change, in minor units
+        """
+        old_balance = from_minor(old_units, currency)
+        new_balance = from_minor(new_units, currency)
+        with self._lock:
+            self._apply(currency, old_units, old_balance, -1)
+            self._apply(currency, new_units, new_balance, 1)
+            self._observe(account_id, new_balance)
+
+    @property
+    def count(self):
+        return self._count
+
+    def _total_locked(self):
+        return math.fsum(from_minor(units, currency) for currency, units in self._currency_totals.items())
+
+    @property
+    def total(self):
+        with self._lock:
+            return self._total_locked()
+
+    @property
+    def average(self):
+        with self._lock:
+            return self._total_locked() / self._count if self._count else 0
+
+    def currency_totals(self):
+        """
+        Return the total balance and the number of accounts of each currency.
+
+        :return: Dictionary mapping currency to a (total, count) tuple
+        """
+        with self._lock:
+            return {currency: (from_minor(units, currency), self._currency_counts[currency])
+                    for currency, units in self._currency_totals.items() if self._currency_counts[currency]}
+
+    def currency_totals_units(self):
+        """
+        Return the exact total balance in minor units and the number of accounts of each currency.
+
+        :return: Dictionary mapping currency to a (total_units, count) tuple
+        """
+        with self._lock:
+            return {currency: (units, self._currency_counts[currency])
+                    for currency, units in self._currency_totals.items() if self._currency_counts[currency]}
+
+    def histogram(self):
+        """
+        Return the number of accounts per balance bucket.
+
+        :return: List of ((low, high), count) tuples, where low is inclusive, high exclusive and None is unbounded
+        """
+        edges = (None,) + self.bucket_edges + (None,)
+        with self._lock:
+            return [((edges[i], edges[i + 1]), count) for i, count in enumerate(self._histogram)]
+
+    def _refresh_extremes(self):
+        if self._extremes_stale and self.scan_extremes is not None:
+            self._min, self._max = self.scan_extremes()
+            self._extremes_stale = False
+
+    def min(self):
+        """
+        Return the account_id and balance of the lowest balance, or None if no account is tracked.
+        """
+        with self._lock:
+            self._refresh_extremes()
+            return self._min if self._count else None
+
+    def max(self):
+        """
+        Return the account_id and balance of the highest balance, or None if no account is tracked.
+        """
+        with self._lock:
+            self._refresh_extremes()
+            return self._max if self._count else None
+
+    def snapshot(self):
+        """
+        Return every aggregate at once.
+
+        :return: Dictionary with count, total, average, min, max, currencies and histogram
+        """
+        return {
+            'count': self.count,
+            'total': self.total,
+            'average': self.average,
+            'min': self.min(),
+            'max': self.max(),
+            'currencies': self.currency_totals(),
+            'histogram': self.histogram(),
+        }
@@ -0,0 +1,274 @@
+import threading
+from array import array
+from balance_aggregates import BalanceAggregates
+from money import from_minor, rate_ratio, round_half_even_div
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, the pure Python paths give the same results
+    np = None
+
+NO_CURRENCY = -1
+# Products above this would overflow int64, so the exact integer path is used instead of numpy
+_INT64_SAFE = 2 ** 62
+
+
+class BalanceBook:
+    """
+    Every account balance, in integer minor units, in one contiguous int64 array indexed by account_id.
+
+    Registered BankAccounts read and write their balance here instead of holding a
+    float of their own, so balances are exact and whole-book computations such as
+    per-currency totals, interest accrual and fee selection are vectorized over
+    the array (with numpy when it is installed, plain loops over the array otherwise).
+    A parallel int16 array holds each account's currency code, -1 for unused ids.
+    Balance changes are forwarded to a BalanceAggregates for O(1) totals. numpy
+    views of the arrays only live while the lock is held, since an array cannot
+    grow while a view of it exists.
+    """
+    def __init__(self, aggregates=None, initial_capacity: int = 1024) -> None:
+        """
+        Initialize the BalanceBook.
+
+        :param aggregates: BalanceAggregates fed with every balance change (default is a new BalanceAggregates)
+        :param initial_capacity: Number of account_id slots allocated up front (default is 1024)
+        """
+        self.aggregates = aggregates if aggregates is not None else BalanceAggregates()
+        self.aggregates.scan_extremes = self.scan_extremes
+        self._units = array('q', bytes(8 * max(initial_capacity, 1)))
+        self._codes = array('h', [NO_CURRENCY]) * max(initial_capacity, 1)
+        self._currencies = []
+        self._currency_codes = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.aggregates.count
+
+    def _ensure_capacity(self, account_id):
+        capacity = len(self._units)
+        if account_id < capacity:
+            return
+        extra = max(capacity, account_id + 1 - capacity)
+        self._units.extend(array('q', bytes(8 * extra)))
+        self._codes.extend(array('h', [NO_CURRENCY]) * extra)
+
+    def _currency_code(self, currency):
+        code = self._currency_codes.get(currency)
+        if code is None:
+            code = self._currency_codes[currency] = len(self._currencies)
+            self._currencies.append(currency)
+        return code
+
+    def track(self, account):
+        """
+        Move an account's balance into the book. The account then reads and writes its balance here.
+
+        :param account: BankAccount instance
+        """
+        units = account._units
+        with self._lock:
+            self._ensure_capacity(account.account_id)
+            self._units[account.account_id] = units
+            self._codes[account.account_id] = self._currency_code(account.currency)
+        self.aggregates.track(account.account_id, account.currency, units)
+        account._book = self
+
+    def attach(self, account):
+        """
+        Point an account at the balance already stored for its account_id, e.g. when it is hydrated again.
+
+        :param account: BankAccount instance; its currency is set from the book
+        :return: True if the book holds a balance for the account_id, False otherwise
+        """
+        account_id = account.account_id
+        with self._lock:
+            if account_id >= len(self._codes) or self._codes[account_id] == NO_CURRENCY:
+                return False
+            account.currency = self._currencies[self._codes[account_id]]
+        account._book = self
+        return True
+
+    def load(self, account_id, currency, units):
+        """
+        Store the balance of an account that has no BankAccount instance, e.g. one not hydrated yet in lazy mode.
+
+        A later track() or attach() of the account_id takes the balance over.
+
+        :param account_id: Unique identifier for the account
+        :param currency: Currency of the account
+        :param units: Balance in minor units
+        """
+        with self._lock:
+            self._ensure_capacity(account_id)
+            old_code = self._codes[account_id]
+            old_units = self._units[account_id]
+            self._units[account_id] = units
+            self._codes[account_id] = self._currency_code(currency)
+        if old_code == NO_CURRENCY:
+            self.aggregates.track(account_id, currency, units)
+        else:
+            self.aggregates.update(account_id, currency, old_units, units)
+
+    def balance_of(self, account_id):
+        """
+        Return the currency and the balance in minor units stored for an account_id, None if there is none.
+        """
+        with self._lock:
+            if account_id >= len(self._codes) or self._codes[account_id] == NO_CURRENCY:
+                return None
+            return self._currencies[self._codes[account_id]], self._units[account_id]
+
+    def untrack(self, account):
+        """
+        Hand an account's balance back to the account and free its slot.
+
+        :param account: BankAccount instance
+        """
+        with self._lock:
+            units = self._units[account.account_id]
+            account._units = units
+            account._book = None
+            self._units[account.account_id] = 0
+            self._codes[account.account_id] = NO_CURRENCY
+        self.aggregates.untrack(account.account_id, account.currency, units)
+
+    def get(self, account_id):
+        return self._units[account_id]
+
+    def set(self, account, units):
+        """
+        Store a new balance of a tracked account. Callers hold the account's lock.
+        """
+        old_units = self._units[account.account_id]
+        self._units[account.account_id] = units
+        self.aggregates.update(account.account_id, account.currency, old_units, units)
+
+    def currency_totals(self):
+        """
+        Recompute the exact total balance, in minor units, and the account count of each currency from the array.
+
+        :return: Dictionary mapping currency to a (total_units, count) tuple
+        """
+        with self._lock:
+            if np is not None:
+                units = np.frombuffer(self._units, dtype=np.int64)
+                codes = np.frombuffer(self._codes, dtype=np.int16)
+                totals = {}
+                for code, currency in enumerate(self._currencies):
+                    mask = codes == code
+                    count = int(mask.sum())
+                    if count:
+                        totals[currency] = (int(units[mask].sum(dtype=np.int64)), count)
+                del units, codes
+                return totals
+            sums = [0] * len(self._currencies)
+            counts = [0] * len(self._currencies)
+            for units, code in zip(self._units, self._codes):
+                if code != NO_CURRENCY:
+                    sums[code] += units
+                    counts[code] += 1
+            return {currency: (sums[code], counts[code]) for code, currency in enumerate(self._currencies) if counts[code]}
+
+    def scan_extremes(self):
+        """
+        Find the lowest and the highest balance of the whole book in one pass.
+
+        :return: Tuple of the (account_id, balance) minimum and maximum, (None, None) for an empty book
+        """
+        with self._lock:
+            # Lowest and highest (units, account_id) of each currency code
+            per_code = {}
+            if np is not None:
+                units = np.frombuffer(self._units, dtype=np.int64)
+                codes = np.frombuffer(self._codes, dtype=np.int16)
+                for code in range(len(self._currencies)):
+                    account_ids = np.nonzero(codes == code)[0]
+                    if len(account_ids):
+                        selected = units[account_ids]
+                        low, high = int(selected.argmin()), int(selected.argmax())
+                        per_code[code] = ((int(selected[low]), int(account_ids[low])),
+                                          (int(selected[high]), int(account_ids[high])))
+                del units, codes
+            else:
+                for account_id, (units, code) in enumerate(zip(self._units, self._codes)):
+                    if code == NO_CURRENCY:
+                        continue
+                    extremes = per_code.get(code)
+                    if extremes is None:
+                        per_code[code] = ((units, account_id), (units, account_id))
+                    elif units < extremes[0][0]:
+                        per_code[code] = ((units, account_id), extremes[1])
+                    elif units > extremes[1][0]:
+                        per_code[code] = (extremes[0], (units, account_id))
+            lowest = highest = None
+            for code, ((low_units, low_id), (high_units, high_id)) in per_code.items():
+                low = (low_id, from_minor(low_units, self._currencies[code]))
+                high = (high_id, from_minor(high_units, self._currencies[code]))
+                if lowest is None or low[1] < lowest[1]:
+                    lowest = low
+                if highest is None or high[1] > highest[1]:
+                    highest = high
+            return lowest, highest
+
+    def accrue_interest(self, rate, currency):
+        """
+        Compute the interest on every positive balance of a currency, rounded half to even to whole minor units.
+
+        :param rate: Interest rate for the period, e.g. 0.0125 or Decimal('0.0125')
+        :param currency: Currency of the accounts to accrue interest on
+        :return: List of (account_id, interest_units) for accounts earning at least one minor unit
+        :raise ValueError: If the rate is not positive
+        """
+        numerator, denominator = rate_ratio(rate)
+        if numerator <= 0:
+            raise ValueError("Interest rate must be positive.")
+        with self._lock:
+            code = self._currency_codes.get(currency)
+            if code is None:
+                return []
+            if np is not None:
+                units = np.frombuffer(self._units, dtype=np.int64)
+                codes = np.frombuffer(self._codes, dtype=np.int16)
+                account_ids = np.nonzero((codes == code) & (units > 0))[0]
+                balances = units[account_ids]
+                del units, codes
+                if not len(balances) or int(balances.max()) * numerator < _INT64_SAFE:
+                    quotients, remainders = np.divmod(balances * numerator, denominator)
+                    twice = 2 * remainders
+                    quotients += (twice > denominator) | ((twice == denominator) & (quotients % 2 == 1))
+                    earning = quotients > 0
+                    return list(zip(account_ids[earning].tolist(), quotients[earning].tolist()))
+            result = []
+            for account_id, (units, account_code) in enumerate(zip(self._units, self._codes)):
+                if account_code == code and units > 0:
+                    interest = round_half_even_div(units * numerator, denominator)
+                    if interest > 0:
+                        result.append((account_id, interest))
+            return result
+
+    def fee_targets(self, fee_units, currency, below_units=None):
+        """
+        Select the accounts of a currency that can pay a fee, optionally only those under a balance threshold.
+
+        :param fee_units: Fee in minor units; accounts with a smaller balance are not charged
+        :param currency: Currency of the accounts to charge
+        :param below_units: Only select balances strictly below this many minor units (default is no threshold)
+        :return: List of account_ids
+        """
+        with self._lock:
+            code = self._currency_codes.get(currency)
+            if code is None:
+                return []
+            if np is not None:
+                units = np.frombuffer(self._units, dtype=np.int64)
+                codes = np.frombuffer(self._codes, dtype=np.int16)
+                mask = (codes == code) & (units >= fee_units)
+                if below_units is not None:
+                    mask &= units < below_units
+                account_ids = np.nonzero(mask)[0].tolist()
+                del units, codes
+                return account_ids
+            return [
+                account_id for account_id, (units, account_code) in enumerate(zip(self._units, self._codes))
+                if account_code == code and units >= fee_units and (below_units is None or units < below_units)
+            ]
@@ -0,0 +1,81 @@
+import json
+import os
+import tempfile
+from datetime import datetime
+
+CHECKPOINT_VERSION = 1
+
+
+class BalanceCheckpoint:
+    """
+    A compact, versioned snapshot of every account balance and the id counters.
+
+    The snapshot records the last committed transaction_id and the size of
+    system_transactions.csv when it was taken, so a restart only has to replay
+    the journal rows written after it. Snapshots are written atomically by writing
+    a temporary file in the same directory and renaming it over the old one.
+    """
+    def __init__(self, file_path: str = 'system_checkpoint.json') -> None:
+        """
+        Initialize the BalanceCheckpoint.
+
+        :param file_path: Path of the snapshot file (default is 'system_checkpoint.json')
+        """
+        self.file_path = file_path
+
+    def write(self, accounts, last_transaction_id, journal_offset, next_account_id, next_transaction_id,
+              next_reference_number):
+        """
+        Atomically write a snapshot.
+
+        :param accounts: Iterable of (account_id, user_name, currency, balance) tuples
+        :param last_transaction_id: Largest transaction_id already written to the journal
+        :param journal_offset: Size in bytes of system_transactions.csv at the snapshot
+        :param next_account_id: Next value of the account_id counter
+        :param next_transaction_id: Next value of the transaction_id counter
+        :param next_reference_number: Next value of the reference_number counter
+        """
+        snapshot = {
+            'version': CHECKPOINT_VERSION,
+            'created_time': datetime.now().isoformat(),
+            'last_transaction_id': last_transaction_id,
+            'journal_offset': journal_offset,
+            'next_account_id': next_account_id,
+            'next_transaction_id': next_transaction_id,
+            'next_reference_number': next_reference_number,
+            'accounts': [list(account) for account in accounts],
+        }
+
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        fd, temp_path = tempfile.mkstemp(prefix='.checkpoint-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as temp_file:
+                json.dump(snapshot, temp_file, separators=(',', ':'))
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(temp_path, self.file_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def read(self):
+        """
+        Read the snapshot.
+
+        :return: Snapshot dictionary, or None if there is no usable snapshot
+        """
+        if not os.path.isfile(self.file_path):
+            return None
+        try:
+            with open(self.file_path, 'r') as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(snapshot, dict) or snapshot.get('version') != CHECKPOINT_VERSION:
+            return None
+        return snapshot
+
+    def remove(self):
+        if os.path.isfile(self.file_path):
+            os.remove(self.file_path)
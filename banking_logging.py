@@ -0,0 +1,122 @@
+import json
+import logging
+import queue
+import random
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+ROOT_LOGGER_NAME = 'banking'
+# Below DEBUG, for the per-row journal writes
+TRACE = 5
+logging.addLevelName(TRACE, 'TRACE')
+
+# Off by default: only warnings reach Python's last resort handler, and every
+# disabled event costs a single cached isEnabledFor check
+logging.getLogger(ROOT_LOGGER_NAME).setLevel(logging.WARNING)
+
+_listener = None
+_configure_lock = threading.Lock()
+
+
+def get_logger(module_name):
+    """
+    Return the logger of a module, under the 'banking' logger configured by configure_logging.
+    """
+    return logging.getLogger(f'{ROOT_LOGGER_NAME}.{module_name}')
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Let through a fraction of the records at or below a level, and every record above it.
+
+    Used to turn on tracing of a busy system without writing an event for every transaction.
+    """
+    def __init__(self, rate: float, max_level: int = logging.DEBUG, rng=None) -> None:
+        """
+        Initialize the SamplingFilter.
+
+        :param rate: Fraction of the records at or below max_level to keep, between 0 and 1
+        :param max_level: Highest level that is sampled (default is DEBUG)
+        :param rng: random.Random instance used to sample (default is a new unseeded one)
+        :raise ValueError: If the rate is not between 0 and 1
+        """
+        super().__init__()
+        if not 0 <= rate <= 1:
+            raise ValueError("Sample rate must be between 0 and 1.")
+        self.rate = rate
+        self.max_level = max_level
+        self._random = (rng or random.Random()).random
+
+    def filter(self, record):
+        return record.levelno > self.max_level or self._random() < self.rate
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Format records as one JSON object per line, with the fields passed as extra={'event': ..., ...}.
+    """
+    _STANDARD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self._STANDARD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=logging.INFO, handler=None, queued=False, sample_rate=None, structured=False,
+                      fmt='%(message)s'):
+    """
+    Configure the logging of BankingSystem, BankAccount and the modules they use.
+
+    Calling it again replaces the previous configuration.
+
+    :param level: Lowest level logged: TRACE, DEBUG, INFO, WARNING, ... (default is INFO)
+    :param handler: logging.Handler that writes the records (default is a StreamHandler on stderr)
+    :param queued: Hand records to a queue and write them on a QueueListener thread,
+                   so transactions never wait for the handler's I/O (default is False)
+    :param sample_rate: Fraction of the DEBUG and TRACE records to keep, None keeps all of them (default is None)
+    :param structured: Write JSON lines with the events' fields instead of plain messages (default is False)
+    :param fmt: Format string of plain messages (default is '%(message)s')
+    :return: The 'banking' logger
+    """
+    global _listener
+    with _configure_lock:
+        shutdown_logging()
+        logger = logging.getLogger(ROOT_LOGGER_NAME)
+        for old_handler in list(logger.handlers):
+            logger.removeHandler(old_handler)
+            old_handler.close()
+
+        handler = handler if handler is not None else logging.StreamHandler()
+        handler.setFormatter(StructuredFormatter() if structured else logging.Formatter(fmt))
+        if queued:
+            records = queue.SimpleQueue()
+            _listener = QueueListener(records, handler, respect_handler_level=True)
+            _listener.start()
+            handler = QueueHandler(records)
+        if sample_rate is not None:
+            # On the calling thread's handler, so unsampled records are dropped before they are queued
+            handler.addFilter(SamplingFilter(sample_rate))
+        logger.addHandler(handler)
+        logger.setLevel(level)
+        logger.propagate = False
+        return logger
+
+
+def shutdown_logging():
+    """
+    Write the records still queued by a queued configuration and stop its listener thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
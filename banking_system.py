@@ -1,11 +1,47 @@
+import asyncio
 import csv
+import io
 import os
+import sys
+import threading
 import time
+import weakref
+from collections import OrderedDict
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import itertools
-from system_reader import CSVLastRowExtractor
+import logging
+from account_loader import AccountLoader
+from account_registry import AccountRegistry, LazyAccountRegistry
+from balance_book import BalanceBook
+from balance_checkpoint import BalanceCheckpoint
+from change_feed import ChangeFeed, TransactionTailFollower
+from fx_rates import FXRates
+from idempotency_cache import IdempotencyCache, IDEMPOTENCY_FIELDNAMES
+from metrics import Metrics
+from payment_scheduler import PaymentScheduler
+from transaction_index import TransactionIndex
+from transaction_reports import TransactionReports
+from transaction_rules import RuleEngine
+from transaction_journal import TransactionJournal, TransactionRecord, TRANSACTION_FIELDNAMES, ACCOUNT_PROFILE_FIELDNAMES
+from validation_pipeline import ValidationPipeline
+import money
+from banking_logging import TRACE, configure_logging, get_logger
+
+logger = get_logger(__name__)
+
+# Accounts share a fixed pool of locks rather than holding one each; several locks are always taken in stripe order
+ACCOUNT_LOCK_STRIPES = 4096
+_account_locks = [threading.RLock() for _ in range(ACCOUNT_LOCK_STRIPES)]
+
+def format_account_summary(account_id, user_name, currency, balance):
+    return f"Account no. {account_id} - {user_name}: {currency} ${balance:,.2f}"
 
 class BankAccount:
+    # No per-instance __dict__, which matters with millions of resident accounts
+    __slots__ = ('account_id', 'user_name', 'currency', '_units', '_book')
+
     def __init__(self, account_id: int, user_name: str, balance: float = 0.0, currency: str = 'HKD') -> None:
         """
         Initialize the BankAccount class with account details.
@@ -17,67 +53,156 @@ class BankAccount:
         """
         self.account_id = account_id
         self.user_name = user_name
-        self.balance = balance
         self.currency = currency
-        self._account_transactions_filename = f'{self.account_id}_transactions.csv'
+        # Balances are exact integer minor units, held here until the account is registered in a BalanceBook
+        self._units = money.to_minor(balance, currency)
+        self._book = None
+
+    @property
+    def _lock_stripe(self):
+        return self.account_id % ACCOUNT_LOCK_STRIPES
+
+    @property
+    def _lock(self):
+        return _account_locks[self._lock_stripe]
+
+    @property
+    def _account_transactions_filename(self):
+        # Built on use rather than stored, it is only needed when rows are journaled
+        return f'{self.account_id}_transactions.csv'
+
+    @property
+    def balance_units(self):
+        book = self._book
+        return self._units if book is None else book.get(self.account_id)
+
+    @balance_units.setter
+    def balance_units(self, units):
+        book = self._book
+        if book is None:
+            self._units = units
+        else:
+            book.set(self, units)
+
+    @property
+    def balance(self):
+        return money.from_minor(self.balance_units, self.currency)
+
+    @balance.setter
+    def balance(self, value):
+        self.balance_units = money.to_minor(value, self.currency)
 
     def __str__(self):
-        return f"Account no. {self.account_id} - {self.user_name}: {self.currency} ${self.balance:,.2f}"
+        return format_account_summary(self.account_id, self.user_name, self.currency, self.balance)
 
-    def deposit(self, amount, banking_system):
+    def deposit(self, amount, banking_system, idempotency_key=None):
         """
         Deposit a specified amount into the account.
 
         :param amount: Amount to deposit
         :param banking_system: Instance of the BankingSystem class
+        :param idempotency_key: Key of the request; a retry with the same key returns the first call's
+                                result without moving money again (default is None)
+        :return: TransactionRecord of the committed deposit
         :raise ValueError: If the deposit amount is not positive
         """
+        return banking_system._run_idempotent(idempotency_key, self._deposit, amount, banking_system)
+
+    def _deposit(self, amount, banking_system, idempotency_key):
         if amount > 0:
-            self.balance += amount
-            transaction_id = next(banking_system._transaction_id_counter)
-            reference_number = next(banking_system._reference_number_counter)
-            banking_system.record_transaction(self, 'deposit', amount, transaction_id, reference_number)
-            print(f"{self.user_name} deposited: {self.currency} ${amount:,.2f}")
+            units = money.to_minor(amount, self.currency, exact=True)
+            lock_start = time.perf_counter()
+            with self._lock:
+                banking_system.metrics.observe('account_lock', time.perf_counter() - lock_start)
+                transaction_ids, reference_number = banking_system._allocate_ids(1)
+                self.balance_units += units
+                future = banking_system._submit_allocated(transaction_ids, self, 'deposit', amount, reference_number,
+                                                          idempotency_key=idempotency_key)
+            transaction = banking_system._wait_for(future)[0]
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("%s deposited: %s $%s", self.user_name, self.currency, f"{amount:,.2f}",
+                            extra={'event': 'deposit', 'account_id': self.account_id, 'amount': amount})
+            return transaction
         else:
             raise ValueError("Deposit amount must be positive.")
 
-    def withdraw(self, amount, banking_system):
+    def withdraw(self, amount, banking_system, idempotency_key=None):
         """
         Withdraw a specified amount from the account if sufficient funds exist.
 
         :param amount: Amount to withdraw
         :param banking_system: Instance of the BankingSystem class
+        :param idempotency_key: Key of the request; a retry with the same key returns the first call's
+                                result without moving money again (default is None)
+        :return: TransactionRecord of the committed withdrawal
         :raise ValueError: If the withdrawal amount is invalid or exceeds the balance
         """
-        if 0 < amount <= self.balance:
-            self.balance -= amount
-            transaction_id = next(banking_system._transaction_id_counter)
-            reference_number = next(banking_system._reference_number_counter)
-            banking_system.record_transaction(self, 'withdraw', amount, transaction_id, reference_number)
-            print(f"{self.user_name} withdrew: {self.currency} ${amount:,.2f}")
-        else:
-            raise ValueError("Insufficient funds or invalid withdrawal amount.")
+        return banking_system._run_idempotent(idempotency_key, self._withdraw, amount, banking_system)
+
+    def _withdraw(self, amount, banking_system, idempotency_key):
+        lock_start = time.perf_counter()
+        with self._lock:
+            banking_system.metrics.observe('account_lock', time.perf_counter() - lock_start)
+            if 0 < amount <= self.balance:
+                units = money.to_minor(amount, self.currency, exact=True)
+                transaction_ids, reference_number = banking_system._allocate_ids(1)
+                self.balance_units -= units
+                future = banking_system._submit_allocated(transaction_ids, self, 'withdraw', amount, reference_number,
+                                                          idempotency_key=idempotency_key)
+            else:
+                raise ValueError("Insufficient funds or invalid withdrawal amount.")
+        transaction = banking_system._wait_for(future)[0]
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("%s withdrew: %s $%s", self.user_name, self.currency, f"{amount:,.2f}",
+                        extra={'event': 'withdraw', 'account_id': self.account_id, 'amount': amount})
+        return transaction
 
-    def transfer(self, target_account, amount, banking_system):
+    def transfer(self, target_account, amount, banking_system, idempotency_key=None):
         """
         Transfer a specified amount to another account if sufficient funds exist.
 
+        Both accounts' locks are taken in stripe order, so opposite transfers between the same accounts cannot deadlock.
+        Between accounts of different currencies the amount is converted with the system's FX rates, and
+        each leg records the amount in its own account's currency.
+
         :param target_account: The target BankAccount to transfer funds to
-        :param amount: Amount to transfer
+        :param amount: Amount to transfer, in this account's currency
         :param banking_system: Instance of the BankingSystem class
-        :raise ValueError: If the transfer amount is invalid or exceeds the balance
-        """
-        if 0 < amount <= self.balance:
-            self.balance -= amount
-            target_account.balance += amount
-            transaction_id = next(banking_system._transaction_id_counter)
-            reference_number = next(banking_system._reference_number_counter)
-            banking_system.record_transaction(self, 'transfer_to', amount, transaction_id, reference_number, target_account)
-            target_transaction_id = next(banking_system._transaction_id_counter)          
-            banking_system.record_transaction(target_account, 'receive_from', amount, target_transaction_id, reference_number, self)
-            print(f"{self.user_name} transfered: {self.currency} ${amount:,.2f} to {target_account.user_name}")
-        else:
-            raise ValueError("Insufficient funds or invalid transfer amount.")
+        :param idempotency_key: Key of the request; a retry with the same key returns the first call's
+                                result without moving money again (default is None)
+        :return: TransactionRecord of the committed 'transfer_to' leg
+        :raise ValueError: If the transfer amount is invalid or exceeds the balance, or no FX rate is available
+        """
+        return banking_system._run_idempotent(idempotency_key, self._transfer, target_account, amount, banking_system)
+
+    def _transfer(self, target_account, amount, banking_system, idempotency_key):
+        units = money.to_minor(amount, self.currency, exact=True) if amount > 0 else 0
+        # Converted before taking the locks, as a rate lookup may reload the rate table
+        target_units = banking_system.fx_rates.convert_units(units, self.currency, target_account.currency)
+        if units and not target_units:
+            raise ValueError(f"Transfer amount is too small to convert to {target_account.currency}.")
+        first_account, second_account = sorted((self, target_account), key=lambda account: account._lock_stripe)
+        lock_start = time.perf_counter()
+        with first_account._lock, second_account._lock:
+            banking_system.metrics.observe('account_lock', time.perf_counter() - lock_start)
+            if 0 < amount <= self.balance:
+                transaction_ids, reference_number = banking_system._allocate_ids(2)
+                self.balance_units -= units
+                target_account.balance_units += target_units
+                # A same-currency 'receive_from' leg records the amount as given, like its 'transfer_to' leg
+                target_amount = (amount if target_account.currency == self.currency
+                                 else money.from_minor(target_units, target_account.currency))
+                futures = banking_system._submit_allocated(transaction_ids, self, 'transfer_to', amount, reference_number,
+                                                           target_account, idempotency_key, target_amount)
+            else:
+                raise ValueError("Insufficient funds or invalid transfer amount.")
+        transaction = banking_system._wait_for(*futures)[0]
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("%s transfered: %s $%s to %s", self.user_name, self.currency, f"{amount:,.2f}",
+                        target_account.user_name,
+                        extra={'event': 'transfer', 'account_id': self.account_id,
+                               'target_id': target_account.account_id, 'amount': amount})
+        return transaction
     
     def view_transactions(self, banking_system):
         """
@@ -95,69 +220,321 @@ class BankAccount:
         """
         return self.balance
 
+BATCH_OPERATION_TYPES = ('deposit', 'withdraw', 'transfer', 'interest', 'fee')
+BATCH_LEG_TYPES = {'deposit': 'deposit', 'withdraw': 'withdraw', 'transfer': 'transfer_to', 'interest': 'interest', 'fee': 'fee'}
+BATCH_CREDIT_TYPES = ('deposit', 'interest')
+# Transaction types that add to the account's balance
+CREDIT_TRANSACTION_TYPES = ('create_account', 'deposit', 'receive_from', 'interest')
+
+class TransactionBatch:
+    """
+    The rows of an apply_batch call, committed through the validation pipeline as one item.
+    """
+    def __init__(self, transactions):
+        self.transactions = transactions
+
 class BankingSystem:
-    def __init__(self):
-        self.accounts = {}
+    def __init__(self, journal=None, validation_latency=0.1, max_in_flight_validations=64, account_loader=None,
+                 checkpoint_filename=None, checkpoint_interval=None, metrics=None, idempotency_cache=None,
+                 change_feed=None, lazy=False, max_resident_accounts=10_000, fx_rates=None, rule_engine=None):
+        """
+        Initialize the BankingSystem and load any existing accounts and transactions.
+
+        :param journal: TransactionJournal storage backend used to write and read the transaction files
+                        (default is a TransactionJournal with default settings)
+        :param validation_latency: Simulated latency in seconds of check_transaction_validity (default is 0.1)
+        :param max_in_flight_validations: Maximum number of transactions validated concurrently before submit blocks (default is 64)
+        :param account_loader: AccountLoader used to load accounts at startup (default is an AccountLoader with default settings)
+        :param checkpoint_filename: Path of the balance snapshot file, None disables checkpoints (default is None)
+        :param checkpoint_interval: Number of committed transactions between automatic snapshots, None to only
+                                    write them on checkpoint() and close() (default is None)
+        :param metrics: Metrics receiving the per-stage latencies and operation counts (default is a new Metrics)
+        :param idempotency_cache: IdempotencyCache of the recent idempotency keys and their results
+                                  (default is an IdempotencyCache with default settings)
+        :param change_feed: ChangeFeed receiving every committed transaction (default is a ChangeFeed with default settings)
+        :param lazy: Load only the account directory at startup and hydrate accounts on first use (default is False)
+        :param max_resident_accounts: Maximum number of unpinned accounts kept in memory in lazy mode (default is 10,000)
+        :param fx_rates: FXRates used for cross-currency transfers and consolidated totals
+                         (default is FXRates reading 'fx_rates.csv' with an HKD base)
+        :param rule_engine: RuleEngine whose rules every transaction must pass, e.g. velocity and daily limits
+                            (default is a RuleEngine without rules)
+        :raise ValueError: If checkpoints are enabled with a journal that does not store plain CSV files
+        """
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.idempotency_cache = idempotency_cache if idempotency_cache is not None else IdempotencyCache()
+        self.change_feed = change_feed if change_feed is not None else ChangeFeed()
+        self.fx_rates = fx_rates if fx_rates is not None else FXRates()
+        self.rule_engine = rule_engine if rule_engine is not None else RuleEngine()
+        self._rule_reservations = {}  # transaction_id -> rule engine reservation, released if the transaction fails
+        self._failed_credit_legs = set()  # transaction_ids of 'receive_from' legs whose 'transfer_to' leg failed validation
+        # Balance reverts of failed transactions whose account lock was busy at commit
+        self._reverter = ThreadPoolExecutor(max_workers=1, thread_name_prefix='balance-reverter')
+        self._pending_reverts = {}  # transaction_id -> Future of its deferred revert
+        # The pipeline and the lazy registry only hold weak references, so dropping the last reference
+        # to the system still runs __del__
+        system = weakref.proxy(self)
+        self.balance_book = BalanceBook()
+        self.balance_aggregates = self.balance_book.aggregates
+        if lazy:
+            self.accounts = LazyAccountRegistry(self.balance_book, BankAccount,
+                                                lambda account_id: system._load_account_latest_balance(account_id)[1:3],
+                                                max_resident_accounts)
+        else:
+            self.accounts = AccountRegistry(self.balance_book)
+        self.lazy = lazy
+        self.validation_latency = validation_latency
+        self._journal = journal if journal is not None else TransactionJournal()
+        if checkpoint_filename and not self._journal.csv_storage:
+            raise ValueError("Checkpoints replay system_transactions.csv and need a CSV journal.")
+        self._validation_pipeline = ValidationPipeline(lambda item: system._validate_pipeline_item(item),
+                                                       lambda item, valid: system._commit_transaction(item, valid),
+                                                       max_in_flight_validations)
         self._system_accounts_filename = 'system_accounts.csv'
         self._system_transactions_filename = 'system_transactions.csv'
+        self._system_idempotency_filename = 'system_idempotency.csv'
+        self._system_scheduled_orders_filename = 'system_scheduled_orders.csv'
+        self._account_loader = account_loader if account_loader is not None else AccountLoader()
+        self.scheduler = PaymentScheduler(self._journal, lambda operations: system.apply_batch(operations),
+                                          lambda rate, currency: system.apply_interest(rate, currency),
+                                          self._system_scheduled_orders_filename)
+        self.load_metrics = {}
+        self._transaction_indexes = OrderedDict()
+        self.max_cached_indexes = 1024
+        self._transaction_reports = {}
         self._account_id_counter = itertools.count(1)
         self._transaction_id_counter = itertools.count(1)
         self._reference_number_counter = itertools.count(1)
-        self._load_account_profiles_and_balances()
-        self._load_latest_transaction_id_ref()
-        print("Banking system is running now.")
+        self._last_committed_transaction_id = None
+        self._checkpoint = BalanceCheckpoint(checkpoint_filename) if checkpoint_filename else None
+        self.checkpoint_interval = checkpoint_interval
+        self._transactions_since_checkpoint = 0
+        self._checkpoint_due = False
+        self._closed = False
+        # _id_lock makes id allocation atomic, _accounts_lock serializes account creation
+        self._id_lock = threading.RLock()
+        self._accounts_lock = threading.Lock()
+        if not self._load_checkpoint():
+            self._load_account_profiles_and_balances()
+            self._load_latest_transaction_id_ref()
+        self.idempotency_cache.load(self._system_idempotency_filename)
+        self.change_feed.start_after(self._last_committed_transaction_id)
+        logger.info("Banking system is running now.")
     
     def set_system_filenames(self, system_accounts_filename, system_transactions_filename):
         self._system_accounts_filename  = system_accounts_filename 
         self._system_transactions_filename = system_transactions_filename
 
+    def close(self):
+        """
+        Wait for in-flight validations, flush any buffered transaction rows and release the journal's file handles.
+        A final snapshot is written when checkpoints are enabled.
+        """
+        if getattr(self, '_closed', True):
+            return
+        self._closed = True
+        self.scheduler.stop()
+        self._validation_pipeline.close()
+        self._reverter.shutdown(wait=True)
+        self.change_feed.close()
+        if self._checkpoint is not None:
+            self.checkpoint()
+        self._journal.close()
+
+    def flush(self):
+        """
+        Write every buffered transaction row to disk.
+        """
+        self._journal.flush()
+
+    def _peek_counter(self, counter_name):
+        """
+        Return the next value of an itertools.count counter without consuming it.
+        """
+        next_value = next(getattr(self, counter_name))
+        setattr(self, counter_name, itertools.count(next_value))
+        return next_value
+
+    def checkpoint(self):
+        """
+        Write a snapshot of every balance and the id counters, so the next start only replays newer journal rows.
+
+        :raise ValueError: If checkpoints are not enabled
+        """
+        if self._checkpoint is None:
+            raise ValueError("Checkpoints are not enabled, set checkpoint_filename to use them.")
+        # Holding the id lock stops new transactions, and waiting for the pipeline lets the in-flight ones commit,
+        # so every snapshotted balance is already journaled
+        with self._id_lock:
+            self._validation_pipeline.wait_idle()
+            self._journal.flush()
+            journal_offset = 0
+            if os.path.isfile(self._system_transactions_filename):
+                journal_offset = os.path.getsize(self._system_transactions_filename)
+            self._checkpoint.write(self.accounts.iter_balances(), self._last_committed_transaction_id, journal_offset,
+                                   self._peek_counter('_account_id_counter'), self._peek_counter('_transaction_id_counter'),
+                                   self._peek_counter('_reference_number_counter'))
+            self._transactions_since_checkpoint = 0
+            self._checkpoint_due = False
+
+    def _load_checkpoint(self):
+        """
+        Load balances and counters from the snapshot and replay the journal rows written after it.
+
+        :return: True if a snapshot was loaded, False if the full load from the CSV files is needed
+        """
+        if self._checkpoint is None:
+            return False
+        snapshot = self._checkpoint.read()
+        if snapshot is None:
+            return False
+        journal_size = 0
+        if os.path.isfile(self._system_transactions_filename):
+            journal_size = os.path.getsize(self._system_transactions_filename)
+        if journal_size < snapshot['journal_offset']:
+            logger.warning("Checkpoint is newer than the transaction journal. Ignoring the checkpoint.")
+            return False
+
+        start_time = time.perf_counter()
+        logger.info("Loading system's accounts from checkpoint")
+        for account_id, user_name, currency, balance in snapshot['accounts']:
+            self._add_loaded_account(account_id, user_name, currency, balance)
+        self._last_committed_transaction_id = snapshot['last_transaction_id']
+
+        next_account_id = snapshot['next_account_id']
+        next_transaction_id = snapshot['next_transaction_id']
+        next_reference_number = snapshot['next_reference_number']
+        replayed = 0
+        if journal_size > snapshot['journal_offset']:
+            replayed, last_ids = self._replay_journal(snapshot['journal_offset'], snapshot['last_transaction_id'] or 0)
+            last_account_id, last_transaction_id, last_reference_number = last_ids
+            next_account_id = max(next_account_id, last_account_id + 1)
+            next_transaction_id = max(next_transaction_id, last_transaction_id + 1)
+            next_reference_number = max(next_reference_number, last_reference_number + 1)
+            if replayed:
+                self._last_committed_transaction_id = last_transaction_id
+
+        self._account_id_counter = itertools.count(next_account_id)
+        self._transaction_id_counter = itertools.count(next_transaction_id)
+        self._reference_number_counter = itertools.count(next_reference_number)
+        self.load_metrics = {
+            'checkpoint_loaded': True,
+            'accounts_loaded': len(self.accounts),
+            'replayed_transactions': replayed,
+            'elapsed_seconds': time.perf_counter() - start_time,
+        }
+        return True
+
+    def _add_loaded_account(self, account_id, user_name, currency, balance):
+        """
+        Register an account read at startup, or update its balance if it is registered. In lazy mode no BankAccount is built.
+        """
+        if not self.lazy:
+            self.accounts.add(BankAccount(account_id, user_name, balance, currency))
+            return
+        if not self.accounts.contains_id(account_id):
+            self.accounts.add_profile(account_id, user_name)
+        self.balance_book.load(account_id, currency, money.to_minor(balance, currency))
+
+    def _replay_journal(self, offset, last_transaction_id):
+        """
+        Apply the balances of system_transactions.csv rows written after a snapshot.
+
+        :param offset: Byte offset in system_transactions.csv where the snapshot ended
+        :param last_transaction_id: Last transaction_id included in the snapshot
+        :return: Tuple of the number of replayed rows and the largest account_id, transaction_id and reference_number seen
+        """
+        replayed = 0
+        last_account_id = last_reference_number = 0
+        with open(self._system_transactions_filename, 'rb') as raw_file:
+            header = next(csv.reader([raw_file.readline().decode()]))
+            raw_file.seek(max(offset, raw_file.tell()))
+            index = {column: position for position, column in enumerate(header)}
+            for row in csv.reader(io.TextIOWrapper(raw_file, newline='')):
+                if not row:
+                    continue
+                transaction_id = int(row[index['transaction_id']])
+                if transaction_id <= last_transaction_id:
+                    continue
+                account_id = int(row[index['account_id']])
+                balance = float(row[index['balance']])
+                if self.lazy or not self.accounts.contains_id(account_id):
+                    # Nothing is resident yet in lazy mode, so the balance only goes to the BalanceBook
+                    self._add_loaded_account(account_id, row[index['user_name']], row[index['currency']], balance)
+                else:
+                    self.accounts.get_by_id(account_id).balance = balance
+                reference_number = row[index['reference_number']]
+                if reference_number:
+                    last_reference_number = max(last_reference_number, int(reference_number))
+                last_account_id = max(last_account_id, account_id)
+                last_transaction_id = transaction_id
+                replayed += 1
+        return replayed, (last_account_id, last_transaction_id, last_reference_number)
+
     def __del__(self):
-        print("Destructor called.")
-        print("Turned off the BankingSystem.\n")
+        self.close()
+        logger.debug("Destructor called.")
+        logger.info("Turned off the BankingSystem.")
     
     def _load_account_profiles_and_balances(self):
         """
         Load account profiles and their latest balances from the system_accounts.csv and {account_id}_transactions.csv.
+
+        The per-account tail reads are fanned out by the AccountLoader, and its metrics are kept in load_metrics.
+        In lazy mode the balances only go to the BalanceBook, so the totals cover every account, and the
+        BankAccount instances are built when the accounts are first used.
         """
         if os.path.isfile(self._system_accounts_filename):
-            with open(self._system_accounts_filename , 'r') as csvfile:
-                print("Geting system's accounts")
-                reader = csv.reader(csvfile)
-                next(reader)
-                
-                last_account_id = None
-                
-                for row in reader:
-                    account_id, user_name, _ = row
-                    if user_name not in self.accounts:
-                        account_id, currency, balance, timestamp_end = self._load_account_latest_balance(int(account_id))
-                        self.accounts[user_name] = BankAccount(account_id, user_name, balance, currency)
-                    else:
-                        print(f"Duplicate account found for username '{user_name}'. Skipping loading of this account.")
-                
-                if last_account_id is not None:
-                    # Update latest account_id
-                    self._account_id_counter = itertools.count(last_account_id + 1)
+            logger.info("Getting system's accounts")
+            # Other storage backends are read through the journal instead of the loader's CSV tail reader
+            read_last_row = None if self._journal.csv_storage else self._journal.read_last_row
+            accounts, skipped, self.load_metrics = self._account_loader.load(self._system_accounts_filename,
+                                                                             read_last_row=read_last_row)
+            
+            for account_id, user_name, reason in skipped:
+                if reason == 'user_name':
+                    logger.warning("Duplicate account found for username '%s'. Skipping loading of this account.", user_name)
+                else:
+                    logger.warning("Duplicate account found for account_id %s. Skipping loading of this account.", account_id)
+            
+            for account_id, user_name, currency, balance, timestamp_end in accounts:
+                if self.lazy:
+                    self.accounts.add_profile(account_id, user_name)
+                    self.balance_book.load(account_id, currency, money.to_minor(balance, currency))
+                else:
+                    self.accounts.add(BankAccount(account_id, user_name, balance, currency))
+            self.load_metrics['lazy'] = self.lazy
+            
+            last_account_id = self.load_metrics['last_account_id']
+            if last_account_id is not None:
+                # Update latest account_id
+                self._account_id_counter = itertools.count(last_account_id + 1)
         else:
-            print("Banking system is new, no any account information yet.")
+            logger.info("Banking system is new, no any account information yet.")
     
     def _load_latest_transaction_id_ref(self):
         """
         Load the latest transaction and reference numbers from the system_transactions.csv.
         """
-        if os.path.isfile(self._system_transactions_filename):
+        if self._journal.exists(self._system_transactions_filename):
             columns_to_extract = ['transaction_id', 'reference_number']
             
             # Extract the desired columns from the last row
-            extracted_values = CSVLastRowExtractor.extract_last_rows(self._system_transactions_filename, columns_to_extract)
+            extracted_values = self._journal.read_last_row(self._system_transactions_filename, columns_to_extract)
             
             last_transaction_id, last_reference_number = extracted_values
+            if not last_reference_number:
+                # A failed transaction has no reference number, so the last one is found reading backwards
+                last_reference_number = next(
+                    (reference_number for reference_number, in
+                     self._journal.iter_last_rows(self._system_transactions_filename, ['reference_number'])
+                     if reference_number), 0)
                 
             self._transaction_id_counter = itertools.count(int(last_transaction_id) + 1)
+            self._last_committed_transaction_id = int(last_transaction_id)
             self._reference_number_counter = itertools.count(int(last_reference_number) + 1)
             
         else:
-            print("Banking system is new, no any transaction records yet.")
+            logger.info("Banking system is new, no any transaction records yet.")
                     
     def _load_account_latest_balance(self, account_id: int):
         """
@@ -169,8 +546,8 @@ class BankingSystem:
         file_path = f"{account_id}_transactions.csv"
         columns_to_extract = ['account_id', 'currency', 'balance', 'timestamp_end']
         
-        # Extract the desired columns from the last row using CSVLastRowExtractor class method
-        extracted_values = CSVLastRowExtractor.extract_last_rows(file_path, columns_to_extract)
+        # Extract the desired columns from the last row through the journal's storage backend
+        extracted_values = self._journal.read_last_row(file_path, columns_to_extract)
         
         account_id, currency, balance, timestamp_end = extracted_values
             
@@ -184,17 +561,19 @@ class BankingSystem:
         :param starting_balance: Initial balance of the account (default is 0.0)
         :param currency: Currency type of the account (default is 'HKD')
         """
-        if user_name in self.accounts:
-            print(f"Account with username '{user_name}' already exists. Skipping creation.")
-            return
-        
-        account_id = next(self._account_id_counter)
-        new_account = BankAccount(account_id, user_name, starting_balance, currency)
-        self.accounts[user_name] = new_account
-        transaction_id = next(self._transaction_id_counter)
-        reference_number = next(self._reference_number_counter)
-        self.record_transaction(new_account, 'create_account', starting_balance, transaction_id, reference_number)
-        print(f"Created account with username '{user_name}'\n")
+        with self._accounts_lock:
+            if user_name in self.accounts:
+                logger.warning("Account with username '%s' already exists. Skipping creation.", user_name)
+                return
+            
+            with self._id_lock:
+                account_id = next(self._account_id_counter)
+                transaction_ids, reference_number = self._allocate_ids(1)
+            new_account = BankAccount(account_id, user_name, starting_balance, currency)
+            self.accounts.add(new_account)
+            future = self._submit_allocated(transaction_ids, new_account, 'create_account', starting_balance, reference_number)
+        self._wait_for(future)
+        logger.info("Created account with username '%s'", user_name)
     
     def get_account(self, user_name):
         """
@@ -204,40 +583,59 @@ class BankingSystem:
         :return: BankAccount instance
         :raise ValueError: If no account is found with the given username
         """
-        account = self.accounts.get(user_name)
+        account = self.accounts.get_by_name(user_name)
         if not account:
             raise ValueError(f"No account found with user_name: {user_name}")
         return account
 
+    def get_account_by_id(self, account_id: int):
+        """
+        Retrieve an account by account_id.
+
+        :param account_id: Unique identifier for the account
+        :return: BankAccount instance
+        :raise ValueError: If no account is found with the given account_id
+        """
+        account = self.accounts.get_by_id(account_id)
+        if not account:
+            raise ValueError(f"No account found with account_id: {account_id}")
+        return account
+
+    def get_accounts(self, keys, key='user_name'):
+        """
+        Retrieve several accounts at once by username or by account_id.
+
+        :param keys: Iterable of usernames or account_ids
+        :param key: 'user_name' or 'account_id' (default is 'user_name')
+        :return: List of BankAccount instances in the order of keys, None where no account is found
+        """
+        return self.accounts.get_many(keys, key)
+
     def save_account_profiles(self, transaction):
         """
         Save account profiles to the system accounts file.
 
         :param transaction: Transaction details
         """
-        file_exists = os.path.isfile(self._system_accounts_filename)
-        
-        with open(self._system_accounts_filename, 'a', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            if not file_exists:
-                writer.writerow(['account_id', 'user_name', 'account_created_time'])
- 
-            writer.writerow([transaction['account_id'], transaction['user_name'], transaction['timestamp_end']])
+        self._journal.append(self._system_accounts_filename, ACCOUNT_PROFILE_FIELDNAMES,
+                             [transaction.account_id, transaction.user_name, transaction.timestamp_end])
    
-    def check_transaction_validity(self, transaction, latency=0.1):
+    def check_transaction_validity(self, transaction, latency=None):
         """
-        Check the validity of a transaction. Simulated to always be valid.
+        Check the validity of a transaction with the external checks. Simulated to always be valid.
+
+        The rule engine's limits run before this, inline, when the transaction is submitted.
 
         :param transaction: Transaction details
-        :param latency: Simulated latency in seconds (default is 0.1)
+        :param latency: Simulated latency in seconds (default is the system's validation_latency)
         :return: True, indicating the transaction is valid
         """
-        time.sleep(latency)
+        time.sleep(self.validation_latency if latency is None else latency)
         return True
                 
     def record_transaction(self, account, transaction_type, amount, transaction_id: int, reference_number: int, target_account=None):
         """
-        Record a transaction for an account.
+        Record a transaction for an account, blocking until it has been validated and committed.
 
         :param account: BankAccount instance
         :param transaction_type: Type of transaction (e.g.'create_account', 'deposit', 'withdraw', 'transfer_to', 'receive_from')
@@ -245,60 +643,679 @@ class BankingSystem:
         :param transaction_id: Unique identifier for the transaction
         :param reference_number: Reference number for the transaction, same reference number for a pair of 'transfer_to' and 'receive_from' transaction
         :param target_account: Target BankAccount instance for transfer transactions (default is None)
+        :return: TransactionRecord containing the committed transaction details
         """
-        transaction = {
-            'transaction_id': transaction_id,
-            'timestamp_start': datetime.now().isoformat(),
-            'account_id': account.account_id,
-            'user_name': account.user_name,
-            'type': transaction_type,
-            'amount': amount,
-            'currency': account.currency,
-            'balance': account.balance,
-        }
-        
-        if target_account:
-            transaction['target_id'] = target_account.account_id
-            transaction['target_user_name'] = target_account.user_name
-        else:
-            transaction['target_id'] = None
-            transaction['target_user_name'] = None
-
-        if self.check_transaction_validity(transaction):
-            transaction['timestamp_end'] = datetime.now().isoformat()
-            transaction['status'] = 'Completed'  
-            transaction['reference_number'] =  reference_number
-            transaction['remarks'] =  None
+        return self._wait_for(
+            self.submit_transaction(account, transaction_type, amount, transaction_id, reference_number, target_account))[0]
+
+    def post_transaction(self, account, transaction_type, amount, transaction_id: int, reference_number: int,
+                         target_account=None):
+        """
+        Move money on one account under ids allocated elsewhere, e.g. by the router of a ShardedBankingSystem,
+        blocking until the transaction has been validated and committed.
+
+        :param account: BankAccount instance
+        :param transaction_type: 'deposit' or 'receive_from' to credit the account, 'withdraw' or 'transfer_to' to debit it
+        :param amount: Amount of the transaction, in the account's currency
+        :param transaction_id: Unique identifier for the transaction
+        :param reference_number: Reference number for the transaction
+        :param target_account: Other BankAccount of a transfer leg (default is None)
+        :return: TransactionRecord containing the committed transaction details
+        :raise ValueError: If the amount is not positive or a debit exceeds the balance
+        """
+        units = money.to_minor(amount, account.currency, exact=True) if amount > 0 else 0
+        credit = transaction_type in CREDIT_TRANSACTION_TYPES
+        with account._lock:
+            if not units or (not credit and units > account.balance_units):
+                raise ValueError(f"Insufficient funds or invalid {transaction_type} amount.")
+            account.balance_units += units if credit else -units
+            future = self.submit_transaction(account, transaction_type, amount, transaction_id, reference_number,
+                                             target_account)
+        return self._wait_for(future)[0]
+
+    async def record_transaction_async(self, account, transaction_type, amount, transaction_id: int, reference_number: int, target_account=None):
+        """
+        Record a transaction for an account without blocking the event loop while it is validated.
+
+        Takes the same parameters as record_transaction.
+
+        :return: TransactionRecord containing the committed transaction details
+        """
+        return await asyncio.wrap_future(
+            self.submit_transaction(account, transaction_type, amount, transaction_id, reference_number, target_account))
+
+    def submit_transaction(self, account, transaction_type, amount, transaction_id: int, reference_number: int, target_account=None,
+                           idempotency_key=None):
+        """
+        Submit a transaction to the validation pipeline and return immediately.
+
+        Takes the same parameters as record_transaction, plus an optional idempotency key that is
+        journaled with the transaction. The transaction first runs through the rule engine, inline,
+        then many submitted transactions are validated concurrently and committed to the journal in
+        transaction_id order. Callers hold the account's lock and have already applied the balance change.
+
+        :return: concurrent.futures.Future resolved with the committed transaction details
+        """
+        remarks, reservation = self.rule_engine.reserve(account, transaction_type, amount, target_account)
+        return self._submit_checked(account, transaction_type, amount, transaction_id, reference_number, target_account,
+                                    idempotency_key, remarks, reservation)
+
+    def _submit_checked(self, account, transaction_type, amount, transaction_id, reference_number, target_account,
+                        idempotency_key, remarks, reservation=None):
+        """
+        Submit a transaction the rule engine has checked. A transaction failed by a rule, with the rule's
+        reason as remarks, has its balance change reverted and is committed as 'Failed' without further validation.
+        A passed transaction's rule reservation is released if it fails validation.
+        """
+        if remarks is not None:
+            units = money.to_minor(amount, account.currency)
+            account.balance_units += -units if transaction_type in CREDIT_TRANSACTION_TYPES else units
+        transaction = TransactionRecord(
+            transaction_id, datetime.now().isoformat(), account.account_id, account.user_name, transaction_type,
+            amount, account.currency, account.balance,
+            target_account.account_id if target_account else None,
+            target_account.user_name if target_account else None,
+            remarks=remarks,
+        )
+        # Unpinned once the transaction is journaled
+        self.accounts.pin(account)
+        if reservation is not None:
+            self._rule_reservations[transaction_id] = reservation
+        return self._validation_pipeline.submit(transaction_id, (account, transaction, reference_number, idempotency_key))
+
+    def _allocate_ids(self, transaction_count, reference_count=1, batch=False):
+        """
+        Atomically allocate consecutive transaction_ids and reference numbers and reserve their commit order.
+
+        :param transaction_count: Number of transaction_ids to allocate
+        :param reference_count: Number of reference numbers to allocate (default is 1)
+        :param batch: Reserve only the first transaction_id, for rows committed as one TransactionBatch (default is False)
+        :return: Tuple of the list of transaction_ids and the first reference number
+        """
+        start = time.perf_counter()
+        with self._id_lock:
+            first_transaction_id = self._allocate_range('_transaction_id_counter', transaction_count)
+            first_reference_number = self._allocate_range('_reference_number_counter', reference_count)
+            transaction_ids = list(range(first_transaction_id, first_transaction_id + transaction_count))
+            self._validation_pipeline.reserve(transaction_ids[:1] if batch else transaction_ids)
+        self.metrics.observe('allocate_ids', time.perf_counter() - start)
+        return transaction_ids, first_reference_number
+
+    def _submit_allocated(self, transaction_ids, account, transaction_type, amount, reference_number, target_account=None,
+                          idempotency_key=None, target_amount=None):
+        """
+        Submit a transaction whose ids were reserved by _allocate_ids. A transfer submits both legs,
+        and its idempotency key is journaled with the first one. The 'receive_from' leg records
+        target_amount, the amount in the target account's currency (default is amount). The rules
+        check the transfer once, and a failed transfer fails both legs.
+
+        :return: Future of the transaction, or a tuple of the two legs' futures for a transfer
+        """
+        try:
+            remarks, reservation = self.rule_engine.reserve(account, transaction_type, amount, target_account)
+            future = self._submit_checked(account, transaction_type, amount, transaction_ids[0], reference_number,
+                                          target_account, idempotency_key, remarks, reservation)
+            if transaction_type != 'transfer_to':
+                return future
+            return future, self._submit_checked(target_account, 'receive_from',
+                                                amount if target_amount is None else target_amount,
+                                                transaction_ids[1], reference_number, account, None, remarks)
+        except BaseException:
+            # Reserved ids that are never submitted would hold back every later commit
+            self._validation_pipeline.cancel(transaction_ids)
+            self.rule_engine.release(self._rule_reservations.pop(transaction_ids[0], None))
+            raise
+
+    def _run_idempotent(self, idempotency_key, operation, *args):
+        """
+        Run a money-moving operation once per idempotency key.
+
+        A retry with a key whose transaction was committed returns that transaction's record without
+        moving money, and a concurrent call with the same key waits for the first one. The key is
+        recorded when the transaction commits; a call that fails before that releases it.
+
+        :param idempotency_key: Key of the request, None to always run the operation
+        :param operation: Callable taking args followed by the idempotency key
+        :return: The operation's result, or the result recorded for the key
+        """
+        if idempotency_key is None:
+            return operation(*args, None)
+        claimed, result = self.idempotency_cache.begin(idempotency_key)
+        if not claimed:
+            return result
+        try:
+            return operation(*args, idempotency_key)
+        finally:
+            # No-op when the commit recorded the key
+            self.idempotency_cache.abort(idempotency_key)
+
+    def _wait_for(self, *futures):
+        """
+        Wait for submitted transactions to be committed, then write a snapshot if one is due.
+
+        :return: List of the committed results
+        """
+        results = [future.result() for future in futures]
+        for result in results:
+            revert = self._pending_reverts.pop(getattr(result, 'transaction_id', None), None)
+            if revert is not None:
+                revert.result()
+        if self._checkpoint_due:
+            self._maybe_checkpoint()
+        return results
+
+    def _validate_pipeline_item(self, item):
+        if isinstance(item, TransactionBatch):
+            # Batches are validated up front by apply_batch
+            return True
+        transaction = item[1]
+        if transaction.remarks is not None:
+            # Already failed by a rule
+            return False
+        if transaction.type == 'receive_from':
+            # A transfer is validated once, on its 'transfer_to' leg, which decides both legs at commit
+            return True
+        start = time.perf_counter()
+        valid = self.check_transaction_validity(transaction)
+        self.metrics.observe('validation', time.perf_counter() - start)
+        return valid
+
+    def _commit_transaction(self, item, valid):
+        """
+        Write a validated transaction to the journal. Called by the validation pipeline in transaction_id order.
+
+        :param item: Tuple of BankAccount instance, pending TransactionRecord, reference number and idempotency key
+        :param valid: Result of check_transaction_validity
+        :return: TransactionRecord containing the committed transaction details
+        """
+        if isinstance(item, TransactionBatch):
+            return self._commit_batch(item)
+        account, transaction, reference_number, idempotency_key = item
+        reservation = self._rule_reservations.pop(transaction.transaction_id, None)
+        if transaction.transaction_id in self._failed_credit_legs:
+            self._failed_credit_legs.discard(transaction.transaction_id)
+            valid = False
+        revert = None
+        if not valid:
+            # Only committed transactions count against the rules' limits
+            self.rule_engine.release(reservation)
+            if transaction.remarks is None:
+                # Failed validation after its balance change was applied, which is undone as for a rule failure
+                units = money.to_minor(transaction.amount, account.currency)
+                revert = -units if transaction.type in CREDIT_TRANSACTION_TYPES else units
+                transaction = transaction._replace(balance=money.from_minor(
+                    money.to_minor(transaction.balance, account.currency) + revert, account.currency))
+                if transaction.type == 'transfer_to':
+                    self._failed_credit_legs.add(transaction.transaction_id + 1)
+        if valid:
+            transaction = transaction._replace(timestamp_end=datetime.now().isoformat(), status='Completed',
+                                               reference_number=reference_number, remarks=None)
         else:
-            transaction['timestamp_end'] = datetime.now().isoformat()
-            transaction['status'] = 'Failed'
-            transaction['reference_number'] = None
-            transaction['remarks'] =  'checked invalid'
+            transaction = transaction._replace(timestamp_end=datetime.now().isoformat(), status='Failed',
+                                               reference_number=None, remarks=transaction.remarks or 'checked invalid')
 
+        metrics = self.metrics
+        start = time.perf_counter()
         self._log_to_transaction_csv(self._system_transactions_filename, transaction)
+        written = time.perf_counter()
+        metrics.observe('system_journal_write', written - start)
         self._log_to_transaction_csv(account._account_transactions_filename, transaction)   
+        start = time.perf_counter()
+        metrics.observe('account_journal_write', start - written)
         
-        if transaction_type == "create_account":
+        if transaction.type == "create_account":
             self.save_account_profiles(transaction)
+            saved = time.perf_counter()
+            metrics.observe('profile_save', saved - start)
+            start = saved
+
+        if idempotency_key is not None:
+            # Committed together with the transaction, so a restart never forgets a key whose money moved
+            self._journal.append(self._system_idempotency_filename, IDEMPOTENCY_FIELDNAMES,
+                                 self.idempotency_cache.journal_row(idempotency_key, transaction))
+        
+        self._journal.commit()
+        metrics.observe('journal_commit', time.perf_counter() - start)
+        metrics.count_operation(transaction.type, transaction.status)
+        if revert is None:
+            self.accounts.unpin(account)
+        else:
+            self._revert_balance(account, revert, transaction.transaction_id)
+        if idempotency_key is not None:
+            self.idempotency_cache.complete(idempotency_key, transaction)
+        self._after_commit(transaction.transaction_id, 1)
+        self.change_feed.publish((transaction,))
         
-        # Print transaction details
-        print(f"Transaction ID: {transaction_id}, User: {account.user_name}, Type: {transaction_type}, "
-              f"Amount: {amount}, Balance: {account.balance}, Status: {transaction['status']}, Reference no.: {reference_number}")
+        # Transaction details, only built when debug logging is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Transaction ID: %s, User: %s, Type: %s, Amount: %s, Balance: %s, Status: %s, Reference no.: %s",
+                         transaction.transaction_id, transaction.user_name, transaction.type, transaction.amount,
+                         transaction.balance, transaction.status, reference_number,
+                         extra={'event': 'transaction', 'transaction': transaction._asdict()})
+        return transaction
             
+    def _revert_balance(self, account, units, transaction_id):
+        """
+        Undo the balance change of a transaction that failed validation, under the account's lock, then unpin the account.
+
+        The commit runs under the pipeline's lock, which a thread holding the account's lock may be waiting
+        for, so a busy account lock is waited for on the reverter thread instead. _wait_for() waits for
+        that revert before returning the transaction.
+
+        :param account: BankAccount instance of the failed transaction
+        :param units: Minor units added back to the balance, negative to take a failed credit back
+        :param transaction_id: transaction_id of the failed transaction
+        """
+        lock = account._lock
+        if lock.acquire(blocking=False):
+            try:
+                account.balance_units += units
+            finally:
+                lock.release()
+            self.accounts.unpin(account)
+        else:
+            self._pending_reverts[transaction_id] = self._reverter.submit(self._revert_balance_locked, account, units)
+
+    def _revert_balance_locked(self, account, units):
+        with account._lock:
+            account.balance_units += units
+        self.accounts.unpin(account)
+
+    def _after_commit(self, last_transaction_id, committed):
+        """
+        Track the last committed transaction_id and mark a snapshot as due when the checkpoint interval is reached.
+        """
+        self._last_committed_transaction_id = last_transaction_id
+        if self._checkpoint is not None and self.checkpoint_interval:
+            self._transactions_since_checkpoint += committed
+            if self._transactions_since_checkpoint >= self.checkpoint_interval:
+                # Written by the waiting caller, outside the pipeline's commit lock
+                self._checkpoint_due = True
+
+    def _maybe_checkpoint(self):
+        """
+        Write a due snapshot if no other transaction is in flight, otherwise leave it for a later call.
+        """
+        with self._id_lock:
+            if self._checkpoint_due and self._validation_pipeline.in_flight == 0:
+                self.checkpoint()
+
+    def _resolve_batch_account(self, operation, id_key, name_key):
+        if operation.get(id_key) is not None:
+            return self.get_account_by_id(operation[id_key])
+        if operation.get(name_key) is not None:
+            return self.get_account(operation[name_key])
+        raise ValueError(f"Operation must have '{id_key}' or '{name_key}'.")
+
+    def _resolve_batch_operation(self, operation):
+        """
+        Check the shape of a batch operation and resolve its accounts.
+
+        :return: Tuple of operation type, BankAccount, target BankAccount (or None) and amount
+        :raise ValueError: If the operation is malformed or refers to an unknown account
+        """
+        operation_type = operation.get('type')
+        if operation_type not in BATCH_OPERATION_TYPES:
+            raise ValueError(f"Unsupported batch operation type: {operation_type}")
+        account = self._resolve_batch_account(operation, 'account_id', 'user_name')
+        target_account = None
+        if operation_type == 'transfer':
+            target_account = self._resolve_batch_account(operation, 'target_id', 'target_user_name')
+            if target_account is account:
+                raise ValueError("Cannot transfer to the same account.")
+        amount = operation.get('amount')
+        if isinstance(amount, bool) or not isinstance(amount, (int, float)) or amount <= 0:
+            raise ValueError("Amount must be positive.")
+        units = money.to_minor(amount, account.currency, exact=True)
+        if target_account is not None and not self.fx_rates.convert_units(units, account.currency, target_account.currency):
+            raise ValueError(f"Transfer amount is too small to convert to {target_account.currency}.")
+        return operation_type, account, target_account, amount
+
+    def _plan_batch(self, operations, failed):
+        """
+        Work out the legs of every operation in order, tracking the balances left by earlier operations.
+
+        :param operations: List of (index, operation type, account, target account, amount)
+        :param failed: Indices of operations that failed the rules or validation and do not move money
+        :return: Tuple of the legs, the rejected operations as {index: error} and the final balances by account_id,
+                 in minor units
+        """
+        balances = {}
+        legs = []
+        rejected = {}
+        for index, operation_type, account, target_account, amount in operations:
+            # Balances are planned in exact minor units and recorded as floats
+            currency = account.currency
+            units = money.to_minor(amount, currency)
+            balance = balances.get(account.account_id, account.balance_units)
+            if index in failed:
+                legs.append((index, account, BATCH_LEG_TYPES[operation_type], amount, money.from_minor(balance, currency),
+                             target_account, False))
+                if target_account is not None:
+                    target_currency = target_account.currency
+                    target_balance = balances.get(target_account.account_id, target_account.balance_units)
+                    target_amount = (amount if target_currency == currency else money.from_minor(
+                        self.fx_rates.convert_units(units, currency, target_currency), target_currency))
+                    legs.append((index, target_account, 'receive_from', target_amount,
+                                 money.from_minor(target_balance, target_currency), account, False))
+                continue
+            if operation_type in BATCH_CREDIT_TYPES:
+                balances[account.account_id] = balance + units
+                legs.append((index, account, operation_type, amount, money.from_minor(balance + units, currency), None, True))
+            elif units > balance:
+                rejected[index] = f"Insufficient funds or invalid {operation_type} amount."
+            elif operation_type != 'transfer':
+                balances[account.account_id] = balance - units
+                legs.append((index, account, operation_type, amount, money.from_minor(balance - units, currency), None, True))
+            else:
+                target_currency = target_account.currency
+                target_units = self.fx_rates.convert_units(units, currency, target_currency)
+                target_balance = balances.get(target_account.account_id, target_account.balance_units) + target_units
+                balances[account.account_id] = balance - units
+                balances[target_account.account_id] = target_balance
+                legs.append((index, account, 'transfer_to', amount, money.from_minor(balance - units, currency),
+                             target_account, True))
+                target_amount = amount if target_currency == currency else money.from_minor(target_units, target_currency)
+                legs.append((index, target_account, 'receive_from', target_amount,
+                             money.from_minor(target_balance, target_currency), account, True))
+        return legs, rejected, balances
+
+    def apply_batch(self, operations):
+        """
+        Apply many deposits, withdrawals and transfers in one call.
+
+        Each operation is a dictionary with a 'type' ('deposit', 'withdraw', 'transfer', 'interest' or 'fee'), an 'amount',
+        the account as 'account_id' or 'user_name' and, for transfers, the target as 'target_id' or
+        'target_user_name'. The whole batch is checked up front, with each operation seeing the balances
+        left by the operations before it. Rejected operations move no money. Validation of the accepted
+        operations overlaps, their ids are allocated as one range and all their journal rows are written
+        with one bulk write per file.
+
+        :param operations: Iterable of operation dictionaries
+        :return: List of result dictionaries, one per operation, in the order of operations
+        """
+        operations = list(operations)
+        results = [None] * len(operations)
+        resolved = []
+        for index, operation in enumerate(operations):
+            try:
+                resolved.append((index, *self._resolve_batch_operation(operation)))
+            except ValueError as e:
+                results[index] = {'index': index, 'type': operation.get('type'), 'status': 'Rejected', 'error': str(e)}
+
+        # Lock every account of the batch in stripe order, as transfers do
+        involved_stripes = set()
+        for _, _, account, target_account, _ in resolved:
+            involved_stripes.add(account._lock_stripe)
+            if target_account is not None:
+                involved_stripes.add(target_account._lock_stripe)
+        lock_start = time.perf_counter()
+        with ExitStack() as stack:
+            for stripe in sorted(involved_stripes):
+                stack.enter_context(_account_locks[stripe])
+            self.metrics.observe('account_lock', time.perf_counter() - lock_start)
+            future = self._apply_batch_locked(operations, resolved, results)
+        if future is not None:
+            self._wait_for(future)
+        return results
+
+    def apply_interest(self, rate, currency='HKD'):
+        """
+        Credit interest to every positive balance of a currency as one batch of 'interest' transactions.
+
+        The interest of every account is computed in one vectorized pass over the BalanceBook, in exact
+        minor units rounded half to even, from the balances at the time of the call.
+
+        :param rate: Interest rate for the period, e.g. 0.0125 for 1.25%
+        :param currency: Currency of the accounts to credit (default is 'HKD')
+        :return: List of apply_batch result dictionaries, one per credited account
+        :raise ValueError: If the rate is not positive
+        """
+        accruals = self.balance_book.accrue_interest(rate, currency)
+        return self.apply_batch([
+            {'type': 'interest', 'account_id': account_id, 'amount': money.from_minor(units, currency)}
+            for account_id, units in accruals
+        ])
+
+    def apply_fee(self, fee, currency='HKD', below=None):
+        """
+        Charge a fee to every account of a currency that can pay it, as one batch of 'fee' transactions.
+
+        The accounts are selected in one vectorized pass over the BalanceBook; accounts with less than the fee
+        are not charged.
+
+        :param fee: Fee charged to each account
+        :param currency: Currency of the accounts to charge (default is 'HKD')
+        :param below: Only charge balances strictly below this amount, e.g. for a low-balance fee (default is None)
+        :return: List of apply_batch result dictionaries, one per charged account
+        :raise ValueError: If the fee is not positive or has more decimal places than the currency
+        """
+        fee_units = money.to_minor(fee, currency, exact=True)
+        if fee_units <= 0:
+            raise ValueError("Fee must be positive.")
+        below_units = money.to_minor(below, currency) if below is not None else None
+        account_ids = self.balance_book.fee_targets(fee_units, currency, below_units)
+        amount = money.from_minor(fee_units, currency)
+        return self.apply_batch([{'type': 'fee', 'account_id': account_id, 'amount': amount} for account_id in account_ids])
+
+    def schedule_payment(self, operation, due_time, interval=None, max_periods=None):
+        """
+        Schedule an operation to run at a future time, once or as a standing order.
+
+        The order is kept in system_scheduled_orders.csv and survives restarts. Orders that fall due
+        together run as coalesced apply_batch calls, from run_scheduled_payments() or the background
+        thread of start_scheduler().
+
+        :param operation: Operation dictionary as for apply_batch, or {'type': 'interest', 'amount': rate,
+                          'currency': currency} without an account to credit interest to every account of a currency
+        :param due_time: datetime or ISO timestamp of the first run
+        :param interval: None for a one-off payment, a timedelta or seconds, or 'monthly' (default is None)
+        :param max_periods: Number of periods after which a standing order ends, None to run until it is
+                            cancelled (default is None)
+        :return: order_id of the scheduled order
+        :raise ValueError: If the operation is malformed or refers to an unknown account, or the interval is invalid
+        """
+        if operation.get('type') == 'interest' and operation.get('account_id') is None \
+                and operation.get('user_name') is None:
+            rate = operation.get('amount')
+            if isinstance(rate, bool) or not isinstance(rate, (int, float)) or rate <= 0:
+                raise ValueError("Interest rate must be positive.")
+            order = self.scheduler.schedule('interest', None, rate, due_time, interval, max_periods,
+                                            currency=operation.get('currency', 'HKD'))
+        else:
+            operation_type, account, target_account, amount = self._resolve_batch_operation(operation)
+            order = self.scheduler.schedule(operation_type, account.account_id, amount, due_time, interval, max_periods,
+                                            target_account.account_id if target_account is not None else None)
+        return order.order_id
+
+    def cancel_scheduled_payment(self, order_id):
+        """
+        Cancel a scheduled order.
+
+        :return: True if the order was active, False otherwise
+        """
+        return self.scheduler.cancel(order_id)
+
+    def run_scheduled_payments(self, now=None):
+        """
+        Run every scheduled order due at or before now.
+
+        :param now: datetime up to which orders are run (default is the current time)
+        :return: Dictionary mapping each executed order_id to its apply_batch result dictionary, or to the
+                 list of results of an interest order
+        """
+        return self.scheduler.run_due(now)
+
+    def start_scheduler(self, poll_interval: float = 1.0):
+        """
+        Run due scheduled orders from a background thread until the system is closed.
+
+        :param poll_interval: Seconds between checks for due orders (default is 1)
+        """
+        self.scheduler.start(poll_interval)
+
+    def _apply_batch_locked(self, operations, resolved, results):
+        """
+        Plan, validate and submit a batch while its accounts are locked, filling in results.
+
+        :return: Future of the submitted TransactionBatch, or None if no operation was accepted
+        """
+        timestamp_start = datetime.now().isoformat()
+        legs, rejected, balances = self._plan_batch(resolved, set())
+        failed, reservations = self._check_batch_rules(legs)
+        checked_legs = [leg for leg in legs if leg[0] not in failed]
+        validity = self._validate_batch_legs(checked_legs, timestamp_start)
+        failed.update((leg[0], 'checked invalid') for leg, valid in zip(checked_legs, validity) if not valid)
+        if failed:
+            # Operations after a failed one may now see different balances, so plan again without moving its money
+            legs, newly_rejected, balances = self._plan_batch([op for op in resolved if op[0] not in rejected], failed)
+            rejected.update(newly_rejected)
+        # Only operations that move money count against the rules' limits
+        for index in failed.keys() | rejected.keys():
+            self.rule_engine.release(reservations.pop(index, None))
+
+        for index, error in rejected.items():
+            results[index] = {'index': index, 'type': operations[index]['type'], 'status': 'Rejected', 'error': error}
+        if not legs:
+            return None
+
+        # Allocate the transaction_id and reference_number ranges in one step
+        operation_indices = sorted({leg[0] for leg in legs})
+        transaction_ids, first_reference_number = self._allocate_ids(len(legs), len(operation_indices), batch=True)
+        first_transaction_id = transaction_ids[0]
+        reference_numbers = {index: first_reference_number + offset for offset, index in enumerate(operation_indices)}
+
+        transactions = []
+        for offset, (index, account, transaction_type, amount, balance, target_account, valid) in enumerate(legs):
+            if valid:
+                status, reference_number, remarks = 'Completed', reference_numbers[index], None
+            else:
+                status, reference_number, remarks = 'Failed', None, failed[index]
+            transaction = self._build_batch_transaction(account, transaction_type, amount, balance, target_account,
+                                                        timestamp_start, first_transaction_id + offset,
+                                                        reference_number, status, remarks)
+            transactions.append((account, transaction))
+            self.accounts.pin(account)
+
+            result = results[index]
+            if result is None:
+                result = results[index] = {'index': index, 'type': operations[index]['type'],
+                                           'status': transaction.status, 'transaction_ids': [],
+                                           'reference_number': transaction.reference_number,
+                                           'balance': transaction.balance, 'error': remarks}
+            result['transaction_ids'].append(transaction.transaction_id)
+
+        for account_id, units in balances.items():
+            self.accounts.get_by_id(account_id).balance_units = units
+
+        return self._validation_pipeline.submit(first_transaction_id, TransactionBatch(transactions))
+
+    def _build_batch_transaction(self, account, transaction_type, amount, balance, target_account, timestamp_start,
+                                 transaction_id=None, reference_number=None, status=None, remarks=None):
+        return TransactionRecord(
+            transaction_id, timestamp_start, account.account_id, account.user_name, transaction_type, amount,
+            account.currency, balance, target_account.account_id if target_account else None,
+            target_account.user_name if target_account else None, reference_number, None, status, remarks,
+        )
+
+    def _check_batch_rules(self, legs):
+        """
+        Run the rule engine on every operation of a batch, in order. A transfer is checked once, on its 'transfer_to' leg.
+
+        :return: Tuple of a dictionary mapping the index of each operation failed by a rule to the rule's reason,
+                 and a dictionary mapping the index of each passed operation to its rule reservation
+        """
+        failed = {}
+        reservations = {}
+        for index, account, transaction_type, amount, _, target_account, _ in legs:
+            if transaction_type != 'receive_from':
+                remarks, reservation = self.rule_engine.reserve(account, transaction_type, amount, target_account)
+                if remarks is not None:
+                    failed[index] = remarks
+                elif reservation is not None:
+                    reservations[index] = reservation
+        return failed, reservations
+
+    def _validate_batch_legs(self, legs, timestamp_start):
+        """
+        Validate every leg of a batch concurrently.
+
+        :return: List of validity results in the order of legs
+        """
+        transactions = [
+            self._build_batch_transaction(account, transaction_type, amount, balance, target_account, timestamp_start)
+            for _, account, transaction_type, amount, balance, target_account, _ in legs
+        ]
+        if not transactions:
+            return []
+        max_workers = min(len(transactions), self._validation_pipeline.max_in_flight)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch-validator') as executor:
+            validity = list(executor.map(self.check_transaction_validity, transactions))
+        self.metrics.observe('batch_validation', time.perf_counter() - start)
+        return validity
+
+    def _allocate_range(self, counter_name, count):
+        """
+        Take count consecutive values from an id counter in one step.
+
+        :return: The first value of the range
+        """
+        first_value = next(getattr(self, counter_name))
+        setattr(self, counter_name, itertools.count(first_value + count))
+        return first_value
+
+    def _commit_batch(self, batch):
+        """
+        Write a batch's rows with one bulk append per file. Called by the validation pipeline in transaction_id order.
+
+        :param batch: TransactionBatch instance
+        :return: List of the committed TransactionRecords
+        """
+        timestamp_end = datetime.now().isoformat()
+        committed = []
+        account_rows = {}
+        for account, transaction in batch.transactions:
+            # Records are journal rows in column order, so they are written as they are
+            transaction = transaction._replace(timestamp_end=timestamp_end)
+            committed.append(transaction)
+            account_rows.setdefault(account._account_transactions_filename, []).append(transaction)
+
+        metrics = self.metrics
+        start = time.perf_counter()
+        self._journal.append_many(self._system_transactions_filename, TRANSACTION_FIELDNAMES, committed)
+        written = time.perf_counter()
+        metrics.observe('system_journal_write', written - start)
+        for file_path, rows in account_rows.items():
+            self._journal.append_many(file_path, TRANSACTION_FIELDNAMES, rows)
+        start = time.perf_counter()
+        metrics.observe('account_journal_write', start - written)
+        self._journal.commit()
+        metrics.observe('journal_commit', time.perf_counter() - start)
+        if metrics.enabled:
+            for transaction in committed:
+                metrics.count_operation(transaction.type, transaction.status)
+        for account, _ in batch.transactions:
+            self.accounts.unpin(account)
+        self._after_commit(committed[-1].transaction_id, len(committed))
+        self.change_feed.publish(committed)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Batch committed: %s transactions, Transaction IDs: %s-%s", len(committed),
+                         committed[0].transaction_id, committed[-1].transaction_id,
+                         extra={'event': 'batch', 'transactions': len(committed)})
+        return committed
+
     def _generate_account_transaction(self, account_id: int):
         """
         Generate transactions for a specific account from its transaction file: {account_id}_transactions.csv.
     
         :param account_id: Unique identifier for the account
-        :return: Generator yielding dictionaries containing transaction details
+        :return: Generator yielding TransactionRecords with the column values as strings
         """
         file_path = f"{account_id}_transactions.csv"
-
-        if os.path.isfile(file_path):
-            with open(file_path, 'r') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    yield row
+        # The journal flushes buffered rows before reading the file back
+        yield from self._journal.iter_records(file_path)
      
     def read_account_transaction(self, account_id: int):
         """
@@ -311,58 +1328,199 @@ class BankingSystem:
         
         # Iterate over the generator and print each transaction
         for transaction in transactions:
-            print(transaction)
+            print(transaction._asdict())
         
+    def get_transaction_index(self, account_id: int = None):
+        """
+        Return the up-to-date sidecar index of an account's transaction file, or of system_transactions.csv.
+
+        :param account_id: Unique identifier for the account, None for system_transactions.csv (default is None)
+        :return: TransactionIndex instance
+        :raise ValueError: If the journal does not store plain CSV files
+        """
+        if not self._journal.csv_storage:
+            raise ValueError("Transaction indexes are only available with a CSV journal.")
+        file_path = self._system_transactions_filename if account_id is None else f"{account_id}_transactions.csv"
+        index = self._transaction_indexes.get(file_path)
+        if index is None:
+            # Keep the number of resident indexes bounded
+            while len(self._transaction_indexes) >= self.max_cached_indexes:
+                self._transaction_indexes.popitem(last=False)
+            index = TransactionIndex(file_path)
+            self._transaction_indexes[file_path] = index
+        else:
+            self._transaction_indexes.move_to_end(file_path)
+        # Buffered journal rows must reach the file before it is indexed
+        self._journal.flush()
+        index.refresh()
+        return index
+
+    def get_reports(self, account_id: int = None):
+        """
+        Return the up-to-date columnar reports of an account's transaction file, or of system_transactions.csv.
+
+        Only the rows written since the previous call are read; the partial aggregates of older rows come from
+        the '{file}.agg' cache.
+
+        :param account_id: Unique identifier for the account, None for system_transactions.csv (default is None)
+        :return: TransactionReports instance
+        :raise ValueError: If the journal does not store plain CSV files
+        """
+        if not self._journal.csv_storage:
+            raise ValueError("Transaction reports are only available with a CSV journal.")
+        file_path = self._system_transactions_filename if account_id is None else f"{account_id}_transactions.csv"
+        reports = self._transaction_reports.get(file_path)
+        if reports is None:
+            reports = self._transaction_reports[file_path] = TransactionReports(file_path)
+        # Buffered journal rows must reach the file before they are aggregated
+        self._journal.flush()
+        reports.refresh()
+        return reports
+
+    def query_transactions(self, account_id: int = None, start_id: int = None, end_id: int = None, since: str = None,
+                           until: str = None, reverse: bool = False, limit: int = None):
+        """
+        Query an account's transactions, or all transactions, by transaction_id and timestamp range using the sidecar index.
+
+        :param account_id: Unique identifier for the account, None for all transactions (default is None)
+        :param start_id: Smallest transaction_id to return (default is no lower bound)
+        :param end_id: Largest transaction_id to return (default is no upper bound)
+        :param since: Earliest ISO timestamp_end to return (default is no lower bound)
+        :param until: Latest ISO timestamp_end to return (default is no upper bound)
+        :param reverse: Return the newest transactions first (default is False)
+        :param limit: Maximum number of transactions to return, for pagination (default is no limit)
+        :return: List of dictionaries containing transaction details
+        """
+        return self.get_transaction_index(account_id).query(start_id, end_id, since, until, reverse, limit)
+
+    def find_transactions_by_reference(self, reference_number, account_id: int = None):
+        """
+        Find the transactions with a reference number using the sidecar index.
+
+        :param reference_number: Reference number of the transaction
+        :param account_id: Unique identifier for the account, None for all transactions (default is None)
+        :return: List of dictionaries containing transaction details
+        """
+        return self.get_transaction_index(account_id).find_by_reference(reference_number)
+
+    def subscribe(self, after_transaction_id: int = None):
+        """
+        Follow committed transactions in process, as they are committed.
+
+        The returned Subscription is iterated with for or async for, or read with get() and get_batch().
+        Every subscriber reads at its own pace from the shared ChangeFeed buffer.
+
+        :param after_transaction_id: Resume after this transaction_id, None for only new transactions (default is None)
+        :return: Subscription yielding committed TransactionRecords in transaction_id order
+        :raise SubscriptionLagged: If the transactions after after_transaction_id are no longer buffered
+        """
+        return self.change_feed.subscribe(after_transaction_id)
+
+    def follow_transactions(self, offset: int = 0, after_transaction_id: int = None, offset_path: str = None):
+        """
+        Follow system_transactions.csv from a byte offset or a transaction_id, e.g. from another process.
+
+        Rows appear in the file when the journal flushes them, within its flush_interval.
+
+        :param offset: Byte offset to start from, 0 for the first row (default is 0)
+        :param after_transaction_id: Start after this transaction_id instead of at offset (default is None)
+        :param offset_path: JSON file saving the follower's position, resumed from when it exists (default is None)
+        :return: TransactionTailFollower instance
+        :raise ValueError: If the journal does not store plain CSV files
+        """
+        if not self._journal.csv_storage:
+            raise ValueError("Following the transaction file is only available with a CSV journal.")
+        return TransactionTailFollower(self._system_transactions_filename, offset, after_transaction_id, offset_path)
+
     def _log_to_transaction_csv(self, file, transaction):
-        print(f"logging to {file}...")
-        file_exists = os.path.isfile(file)
-
-        with open(file, 'a', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            if not file_exists:
-                writer.writerow(['transaction_id', 'timestamp_start', 'account_id', 'user_name', 'type', 'amount', 
-                                 'currency', 'balance', 'target_id', 'target_user_name', 'reference_number', 'timestamp_end', 'status',
-                                 'remarks'
-                                 ])
-            
-            writer.writerow([
-                    transaction['transaction_id'],
-                    transaction['timestamp_start'],
-                    transaction['account_id'],
-                    transaction['user_name'],
-                    transaction['type'],
-                    transaction['amount'],
-                    transaction['currency'],
-                    transaction['balance'],
-                    transaction['target_id'],
-                    transaction['target_user_name'],
-                    transaction['reference_number'],
-                    transaction['timestamp_end'],
-                    transaction['status'],
-                    transaction['remarks']
-            ])
+        if logger.isEnabledFor(TRACE):
+            logger.log(TRACE, "logging to %s...", file)
+        self._journal.append(file, TRANSACTION_FIELDNAMES, transaction)
+
+    def get_metrics(self, prometheus_file=None):
+        """
+        Return the per-stage latencies, the operation counts and the current gauges of the system.
+
+        :param prometheus_file: Also write them in the Prometheus text format to this file (default is None)
+        :return: Dictionary from Metrics.snapshot
+        """
+        metrics = self.metrics
+        metrics.set_gauge('accounts', len(self.accounts))
+        metrics.set_gauge('resident_accounts', self.accounts.resident_count)
+        metrics.set_gauge('in_flight_validations', self._validation_pipeline.in_flight)
+        metrics.set_gauge('buffered_journal_rows', self._journal.buffered_rows)
+        metrics.set_gauge('scheduled_orders', len(self.scheduler))
+        if prometheus_file is not None:
+            metrics.write_prometheus(prometheus_file)
+        return metrics.snapshot()
 
     def get_total_accounts(self):
         return len(self.accounts)
 
-    def get_total_balance(self):
-        return sum(account.balance for account in self.accounts.values())
+    def get_total_balance(self, currency='HKD'):
+        """
+        Return the total of every balance converted to one currency.
+
+        The running per-currency totals are converted with one multiply-add per currency, without visiting any account.
+        get_balance_summary() gives the per-currency totals, which need no FX rates.
+
+        :param currency: Currency of the total (default is 'HKD')
+        :return: Consolidated total, rounded to the currency's minor unit
+        :raise ValueError: If a held currency has no FX rate to currency, e.g. without an fx_rates.csv
+        """
+        return self.fx_rates.consolidate(self.balance_aggregates.currency_totals_units(), currency)
     
-    def get_average_balance(self):
-        total_accounts = self.get_total_accounts()
-        total_balance = self.get_total_balance()
-        return total_balance / total_accounts if total_accounts > 0 else 0
+    def get_average_balance(self, currency='HKD'):
+        """
+        Return the average balance converted to one currency.
+
+        :raise ValueError: If a held currency has no FX rate to currency
+        """
+        count = self.balance_aggregates.count
+        return self.get_total_balance(currency) / count if count else 0
+
+    def get_balance_summary(self):
+        """
+        Return the running balance aggregates without visiting any account.
+
+        :return: Dictionary with count, total, average, min, max, per-currency totals and the balance histogram
+        """
+        return self.balance_aggregates.snapshot()
+
+    def iter_account_summaries(self, page_size: int = 1000):
+        """
+        Stream the account lines of __str__ in pages instead of building one string.
+
+        :param page_size: Number of account lines per page (default is 1000)
+        :return: Generator yielding lists of account summary strings
+        """
+        page = []
+        for account_id, user_name, currency, balance in self.accounts.iter_balances():
+            page.append(format_account_summary(account_id, user_name, currency, balance))
+            if len(page) == page_size:
+                yield page
+                page = []
+        if page:
+            yield page
 
     def __str__(self):
-        account_summary = "\n".join(str(account) for account in self.accounts.values())
+        account_summary = "\n".join(line for page in self.iter_account_summaries() for line in page)
         total_accounts = self.get_total_accounts()
-        total_balance = self.get_total_balance()
-        average_balance = self.get_average_balance()
+        currency_totals = self.balance_aggregates.currency_totals_units()
+        if self.fx_rates.has_rates(currency_totals, 'HKD'):
+            total_balance = f"HKD ${self.get_total_balance():,.2f}"
+            average_balance = f"HKD ${self.get_average_balance():,.2f}"
+        else:
+            # Without a rate for every currency, each currency is totalled on its own
+            total_balance = ", ".join(f"{currency} ${money.from_minor(units, currency):,.2f}"
+                                      for currency, (units, _) in sorted(currency_totals.items()))
+            average_balance = ", ".join(f"{currency} ${money.from_minor(units, currency) / count:,.2f}"
+                                        for currency, (units, count) in sorted(currency_totals.items()))
         result = (
             f"{account_summary}\n\n"
             f"Total No. of Accounts: {total_accounts}\n"
-            f"Total Balance: HKD ${total_balance:,.2f}\n"
-            f"Average Account Balance: HKD ${average_balance:,.2f}\n"
+            f"Total Balance: {total_balance}\n"
+            f"Average Account Balance: {average_balance}\n"
         )
         return result
     
@@ -370,6 +1528,9 @@ class BankingSystem:
 if __name__ == "__main__":
     start_time = time.time()  # Record the start time
 
+    # Show the system's events next to the example output; run with level=TRACE to also see every journal write
+    configure_logging(logging.INFO, logging.StreamHandler(sys.stdout))
+
     # Initialization of the banking system
     banking_system = BankingSystem()
     
@@ -449,4 +1610,8 @@ if __name__ == "__main__":
 
     end_time = time.time()  # Record the end time
     elapsed_time = end_time - start_time  # Calculate elapsed time
-    print(f"Time taken: {elapsed_time:.2f} seconds")
\ No newline at end of file
+    print(f"Time taken: {elapsed_time:.2f} seconds")
+
+    print("\nPer-stage latency of the second run:")
+    for stage, summary in next_banking_system.get_metrics()['stages'].items():
+        print(f"{stage}: {summary['count']} runs, p50 {summary['p50'] * 1000:.3f} ms, p99 {summary['p99'] * 1000:.3f} ms")
\ No newline at end of file
@@ -0,0 +1,245 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from banking_system import BankingSystem
+
+SCENARIOS = ('create_accounts', 'deposit_withdraw', 'transfers', 'cold_start', 'history_scan')
+
+
+@contextmanager
+def _isolated_directory():
+    """
+    Run the body inside a new temporary directory, so scenarios never share or leave files.
+    """
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='banking-benchmark-') as temp_dir:
+        os.chdir(temp_dir)
+        try:
+            yield temp_dir
+        finally:
+            os.chdir(original_dir)
+
+
+def _percentiles(samples):
+    """
+    Summarize per-operation latencies in milliseconds.
+    """
+    if not samples:
+        return {'p50_ms': None, 'p90_ms': None, 'p99_ms': None, 'max_ms': None}
+    ordered = sorted(samples)
+
+    def rank(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {'p50_ms': rank(0.5), 'p90_ms': rank(0.9), 'p99_ms': rank(0.99), 'max_ms': ordered[-1] * 1000}
+
+
+def _result(operations, elapsed_seconds, samples=(), **extra):
+    result = {
+        'operations': operations,
+        'elapsed_seconds': elapsed_seconds,
+        'ops_per_second': operations / elapsed_seconds if elapsed_seconds else float('inf'),
+    }
+    result.update(_percentiles(samples))
+    result.update(extra)
+    return result
+
+
+def _timed(operation, samples):
+    start = time.perf_counter()
+    operation()
+    samples.append(time.perf_counter() - start)
+
+
+def _populate(system, accounts, starting_balance=1000.0):
+    for account_id in range(accounts):
+        system.create_account(f"user_{account_id}", starting_balance)
+    return list(system.accounts.values())
+
+
+def bench_create_accounts(accounts=1000, **_):
+    """
+    Create accounts one by one.
+    """
+    with _isolated_directory():
+        system = BankingSystem(validation_latency=0)
+        samples = []
+        start = time.perf_counter()
+        for account_id in range(accounts):
+            _timed(lambda: system.create_account(f"user_{account_id}", 1000.0), samples)
+        system.close()
+        return _result(accounts, time.perf_counter() - start, samples)
+
+
+def bench_deposit_withdraw(accounts=100, operations=5000, seed=0, **_):
+    """
+    A random mix of deposits and withdrawals, half of each, over a set of accounts.
+    """
+    rng = random.Random(seed)
+    with _isolated_directory():
+        system = BankingSystem(validation_latency=0)
+        all_accounts = _populate(system, accounts)
+        plan = [(rng.choice(all_accounts), rng.random() < 0.5, rng.randint(1, 100)) for _ in range(operations)]
+        samples = []
+        rejected = 0
+        start = time.perf_counter()
+        for account, is_deposit, amount in plan:
+            operation_start = time.perf_counter()
+            try:
+                if is_deposit:
+                    account.deposit(amount, system)
+                else:
+                    account.withdraw(amount, system)
+            except ValueError:
+                rejected += 1
+            samples.append(time.perf_counter() - operation_start)
+        system.close()
+        return _result(operations, time.perf_counter() - start, samples, rejected=rejected)
+
+
+def bench_transfers(accounts=100, operations=5000, seed=0, **_):
+    """
+    Random transfers between accounts, each writing two legs.
+    """
+    rng = random.Random(seed)
+    with _isolated_directory():
+        system = BankingSystem(validation_latency=0)
+        all_accounts = _populate(system, accounts)
+        plan = [(*rng.sample(all_accounts, 2), rng.randint(1, 100)) for _ in range(operations)]
+        samples = []
+        rejected = 0
+        start = time.perf_counter()
+        for source, target, amount in plan:
+            operation_start = time.perf_counter()
+            try:
+                source.transfer(target, amount, system)
+            except ValueError:
+                rejected += 1
+            samples.append(time.perf_counter() - operation_start)
+        system.close()
+        return _result(operations, time.perf_counter() - start, samples, rejected=rejected)
+
+
+def bench_cold_start(accounts=1000, repeats=5, **_):
+    """
+    Start a BankingSystem over accounts already on disk, which reads every account file's last row.
+    """
+    with _isolated_directory():
+        system = BankingSystem(validation_latency=0)
+        _populate(system, accounts)
+        system.close()
+        del system
+        samples = []
+        start = time.perf_counter()
+        for _ in range(repeats):
+            operation_start = time.perf_counter()
+            system = BankingSystem(validation_latency=0)
+            samples.append(time.perf_counter() - operation_start)
+            loaded = len(system.accounts)
+            system.close()
+        elapsed_seconds = time.perf_counter() - start
+        return _result(repeats, elapsed_seconds, samples, accounts_loaded=loaded,
+                       accounts_per_second=loaded * repeats / elapsed_seconds if elapsed_seconds else float('inf'))
+
+
+def bench_history_scan(rows=50_000, repeats=3, **_):
+    """
+    Read back the whole transaction history of one account with a long file.
+    """
+    with _isolated_directory():
+        system = BankingSystem(validation_latency=0)
+        system.create_account("user_0", 0)
+        batch_size = 5000
+        for first in range(0, rows, batch_size):
+            system.apply_batch([{'type': 'deposit', 'user_name': 'user_0', 'amount': 1}] * min(batch_size, rows - first))
+        system.flush()
+        account_id = system.get_account("user_0").account_id
+        samples = []
+        scanned = 0
+        start = time.perf_counter()
+        for _ in range(repeats):
+            operation_start = time.perf_counter()
+            scanned = sum(1 for _ in system._generate_account_transaction(account_id))
+            samples.append(time.perf_counter() - operation_start)
+        elapsed_seconds = time.perf_counter() - start
+        system.close()
+        return _result(repeats, elapsed_seconds, samples, rows_scanned=scanned,
+                       rows_per_second=scanned * repeats / elapsed_seconds if elapsed_seconds else float('inf'))
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(scenarios=SCENARIOS, accounts=1000, operations=5000, rows=50_000, seed=0):
+    """
+    Run benchmark scenarios against BankingSystem with no validation latency, each in its own temporary directory.
+
+    :param scenarios: Names of the scenarios to run (default is all of SCENARIOS)
+    :param accounts: Number of accounts created, and loaded by cold_start (default is 1000)
+    :param operations: Number of deposits/withdrawals and of transfers (default is 5000)
+    :param rows: Number of rows in the history_scan account file (default is 50,000)
+    :param seed: Seed of the random workloads, for runs that can be compared (default is 0)
+    :return: Dictionary with the run's environment, parameters and one result per scenario
+    """
+    benchmarks = {
+        'create_accounts': lambda: bench_create_accounts(accounts),
+        'deposit_withdraw': lambda: bench_deposit_withdraw(min(accounts, 100), operations, seed),
+        'transfers': lambda: bench_transfers(min(accounts, 100), operations, seed),
+        'cold_start': lambda: bench_cold_start(accounts),
+        'history_scan': lambda: bench_history_scan(rows),
+    }
+    unknown = set(scenarios) - set(benchmarks)
+    if unknown:
+        raise ValueError(f"Unknown scenarios: {sorted(unknown)}")
+    return {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {'accounts': accounts, 'operations': operations, 'rows': rows, 'seed': seed},
+        'results': {name: benchmarks[name]() for name in scenarios},
+    }
+
+
+def compare(baseline, current):
+    """
+    Compare two run_benchmarks reports.
+
+    :return: Dictionary mapping each scenario in both reports to the current / baseline ops_per_second ratio
+    """
+    return {
+        name: result['ops_per_second'] / baseline['results'][name]['ops_per_second']
+        for name, result in current['results'].items()
+        if name in baseline['results'] and baseline['results'][name]['ops_per_second']
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput and latency benchmarks for BankingSystem.")
+    parser.add_argument('scenarios', nargs='*', default=list(SCENARIOS), help=f"any of {', '.join(SCENARIOS)}")
+    parser.add_argument('--accounts', type=int, default=1000)
+    parser.add_argument('--operations', type=int, default=5000)
+    parser.add_argument('--rows', type=int, default=50_000, help="rows of the history_scan account file")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="also write the JSON report to this file")
+    parser.add_argument('--baseline', help="JSON report of an earlier run to compare ops/sec against")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.scenarios, args.accounts, args.operations, args.rows, args.seed)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            report['speedup_vs_baseline'] = compare(json.load(baseline_file), report)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
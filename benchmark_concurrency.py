@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from banking_system import BankingSystem
+from system_reader import CSVLastRowExtractor
+
+
+def run_transfer_stress(threads=8, transfers_per_thread=200, accounts=20, starting_balance=1000.0,
+                        validation_latency=0.0, seed=None):
+    """
+    Hammer random transfers between accounts from several threads and check that no money is created or lost.
+
+    Runs in a temporary directory, so no CSV files are left behind.
+
+    :param threads: Number of worker threads
+    :param transfers_per_thread: Number of transfers attempted by each thread
+    :param accounts: Number of accounts to transfer between
+    :param starting_balance: Starting balance of every account
+    :param validation_latency: Simulated validation latency in seconds
+    :param seed: Seed of the random generator, for reproducible runs
+    :return: Dictionary with the throughput and the conservation check results
+    """
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.chdir(temp_dir)
+        try:
+            system = BankingSystem(validation_latency=validation_latency, max_in_flight_validations=max(threads, 1) * 2)
+            for account_id in range(accounts):
+                system.create_account(f"user_{account_id}", starting_balance)
+            all_accounts = list(system.accounts.values())
+            expected_total = system.get_total_balance()
+            completed = [0] * threads
+            rejected = [0] * threads
+
+            def worker(worker_id):
+                rng = random.Random(None if seed is None else seed + worker_id)
+                for _ in range(transfers_per_thread):
+                    source, target = rng.sample(all_accounts, 2)
+                    try:
+                        source.transfer(target, round(rng.uniform(1, starting_balance / 2), 2), system)
+                        completed[worker_id] += 1
+                    except ValueError:
+                        rejected[worker_id] += 1
+
+            workers = [threading.Thread(target=worker, args=(worker_id,)) for worker_id in range(threads)]
+            start_time = time.perf_counter()
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            elapsed_seconds = time.perf_counter() - start_time
+
+            system.close()
+            actual_total = system.get_total_balance()
+            # Each account file's last row must hold the in-memory balance
+            mismatched_files = [
+                account.account_id for account in all_accounts
+                if float(CSVLastRowExtractor.extract_last_rows(account._account_transactions_filename, ['balance'])[0])
+                != account.balance
+            ]
+            return {
+                'threads': threads,
+                'accounts': accounts,
+                'transfers_completed': sum(completed),
+                'transfers_rejected': sum(rejected),
+                'elapsed_seconds': elapsed_seconds,
+                'transfers_per_second': sum(completed) / elapsed_seconds if elapsed_seconds else float('inf'),
+                'expected_total_balance': expected_total,
+                'actual_total_balance': actual_total,
+                'balance_conserved': abs(actual_total - expected_total) < 1e-6,
+                'mismatched_account_files': mismatched_files,
+            }
+        finally:
+            os.chdir(original_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent transfer stress benchmark for BankingSystem.")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--transfers', type=int, default=200, help="transfers per thread")
+    parser.add_argument('--accounts', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.0, help="simulated validation latency in seconds")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    result = run_transfer_stress(args.threads, args.transfers, args.accounts, validation_latency=args.latency, seed=args.seed)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,102 @@
+import argparse
+import gc
+import json
+import threading
+import tracemalloc
+from datetime import datetime
+from balance_book import BalanceBook
+from banking_system import BankAccount
+from transaction_journal import TransactionRecord, TRANSACTION_FIELDNAMES
+
+
+class _DictBankAccount:
+    """
+    The account layout before __slots__: a per-instance __dict__, a float balance and a stored file name.
+    """
+    def __init__(self, account_id, user_name, balance=0.0, currency='HKD'):
+        self.account_id = account_id
+        self.user_name = user_name
+        self.balance = balance
+        self.currency = currency
+        self._account_transactions_filename = f'{self.account_id}_transactions.csv'
+        self._lock = threading.RLock()
+
+
+def _measure(build, count):
+    """
+    Return the bytes allocated per item by build(count), keeping the built objects alive while measuring.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        items = build(count)
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del items
+    return (after - before) / count
+
+
+def _dict_accounts(count):
+    return [_DictBankAccount(account_id, f"user_{account_id}", account_id * 1.5) for account_id in range(1, count + 1)]
+
+
+def _slotted_accounts(count):
+    book = BalanceBook(initial_capacity=count + 1)
+    accounts = [BankAccount(account_id, f"user_{account_id}", account_id * 1.5) for account_id in range(1, count + 1)]
+    for account in accounts:
+        book.track(account)
+    return book, accounts
+
+
+def _transaction_values(transaction_id, timestamp):
+    return (transaction_id, timestamp, transaction_id % 1000, f"user_{transaction_id % 1000}", 'deposit',
+            transaction_id * 0.5, 'HKD', transaction_id * 1.5, None, None, transaction_id, timestamp, 'Completed', None)
+
+
+def _dict_transactions(count):
+    timestamp = datetime.now().isoformat()
+    return [dict(zip(TRANSACTION_FIELDNAMES, _transaction_values(transaction_id, timestamp)))
+            for transaction_id in range(1, count + 1)]
+
+
+def _record_transactions(count):
+    timestamp = datetime.now().isoformat()
+    return [TransactionRecord._make(_transaction_values(transaction_id, timestamp)) for transaction_id in range(1, count + 1)]
+
+
+def run_memory_benchmark(accounts=100_000, transactions=100_000):
+    """
+    Measure the resident footprint of accounts and transactions in the old and the current layouts with tracemalloc.
+
+    The slotted account figure includes its share of the BalanceBook arrays and aggregates.
+
+    :param accounts: Number of accounts to build per layout
+    :param transactions: Number of transactions to build per layout
+    :return: Dictionary of bytes per account and per transaction, before and after
+    """
+    dict_account = _measure(_dict_accounts, accounts)
+    slotted_account = _measure(_slotted_accounts, accounts)
+    dict_transaction = _measure(_dict_transactions, transactions)
+    record_transaction = _measure(_record_transactions, transactions)
+    return {
+        'accounts': accounts,
+        'transactions': transactions,
+        'bytes_per_account_before': round(dict_account, 1),
+        'bytes_per_account_after': round(slotted_account, 1),
+        'bytes_per_transaction_before': round(dict_transaction, 1),
+        'bytes_per_transaction_after': round(record_transaction, 1),
+        'account_savings_ratio': round(1 - slotted_account / dict_account, 3),
+        'transaction_savings_ratio': round(1 - record_transaction / dict_transaction, 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory footprint benchmark for accounts and transaction records.")
+    parser.add_argument('--accounts', type=int, default=100_000)
+    parser.add_argument('--transactions', type=int, default=100_000)
+    args = parser.parse_args()
+
+    result = run_memory_benchmark(args.accounts, args.transactions)
+    print(json.dumps(result, indent=2))
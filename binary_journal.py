@@ -0,0 +1,364 @@
+import argparse
+import csv
+import json
+import mmap
+import os
+import struct
+from datetime import datetime, timedelta
+from transaction_journal import TransactionJournal, TransactionRecord, TRANSACTION_FIELDNAMES
+
+MAGIC = b'BKJ1'
+FORMAT_VERSION = 1
+# magic, format version, record size, reserved
+FILE_HEADER = struct.Struct('<4sHH8x')
+# One fixed-width record per transaction, in TRANSACTION_FIELDNAMES order. Strings are ids into the string table,
+# timestamps are microseconds since 1970-01-01 in local time.
+RECORD = struct.Struct('<qqqIIdIdqIqqII')
+FIELD_KINDS = ['int', 'time', 'int', 'str', 'str', 'float', 'str', 'float', 'int', 'str', 'int', 'time', 'str', 'str']
+
+NONE_INT = -1
+NONE_STRING = 0xFFFFFFFF
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def binary_path_for(file_path):
+    """
+    Return the binary journal path used in place of a CSV journal path.
+    """
+    root, extension = os.path.splitext(file_path)
+    return f"{root}.bin" if extension == '.csv' else f"{file_path}.bin"
+
+
+class StringTable:
+    """
+    An append-only dictionary of the strings stored in binary journal records.
+
+    Usernames, currencies, transaction types, statuses and remarks repeat on most
+    records, so each distinct string is written once, as one JSON string per line,
+    and records hold its line number.
+    """
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        self._strings = []
+        self._ids = {}
+        self._pending = []
+        if os.path.isfile(file_path):
+            with open(file_path, 'r', encoding='utf-8') as table_file:
+                for line in table_file:
+                    if not line.endswith('\n'):
+                        # A torn last line was never referenced by a flushed record
+                        break
+                    self._add(json.loads(line))
+
+    def _add(self, value):
+        string_id = len(self._strings)
+        self._strings.append(value)
+        self._ids[value] = string_id
+        return string_id
+
+    def intern(self, value):
+        if value is None:
+            return NONE_STRING
+        value = str(value)
+        string_id = self._ids.get(value)
+        if string_id is None:
+            string_id = self._add(value)
+            self._pending.append(value)
+        return string_id
+
+    def lookup(self, string_id):
+        return None if string_id == NONE_STRING else self._strings[string_id]
+
+    def flush(self, fsync=False):
+        """
+        Write newly interned strings. Called before any record that refers to them is written.
+        """
+        if not self._pending:
+            return
+        with open(self.file_path, 'a', encoding='utf-8') as table_file:
+            table_file.write(''.join(json.dumps(value) + '\n' for value in self._pending))
+            table_file.flush()
+            if fsync:
+                os.fsync(table_file.fileno())
+        self._pending = []
+
+
+def _to_micros(timestamp):
+    return NONE_INT if timestamp in (None, '') else (datetime.fromisoformat(timestamp) - EPOCH) // ONE_MICROSECOND
+
+
+def _from_micros(micros):
+    return None if micros == NONE_INT else (EPOCH + timedelta(microseconds=micros)).isoformat()
+
+
+def encode_record(row, strings):
+    """
+    Pack a transaction row, in TRANSACTION_FIELDNAMES order, into a fixed-width record.
+    """
+    values = []
+    for value, kind in zip(row, FIELD_KINDS):
+        if kind == 'str':
+            values.append(strings.intern(value))
+        elif kind == 'time':
+            values.append(_to_micros(value))
+        elif kind == 'float':
+            values.append(float(value))
+        else:
+            values.append(NONE_INT if value in (None, '') else int(value))
+    return RECORD.pack(*values)
+
+
+def decode_record(values, strings):
+    """
+    Turn unpacked record values into a row dictionary with the same string values csv.DictReader returns.
+    """
+    row = {}
+    for field, value, kind in zip(TRANSACTION_FIELDNAMES, values, FIELD_KINDS):
+        if kind == 'str':
+            value = strings.lookup(value)
+        elif kind == 'time':
+            value = _from_micros(value)
+        elif kind == 'int' and value == NONE_INT:
+            value = None
+        row[field] = '' if value is None else str(value)
+    return row
+
+
+class _BinaryJournalFile:
+    """
+    A long-lived append handle for one binary journal file plus its in-memory record buffer.
+    """
+    def __init__(self, file_path, strings):
+        self.file_path = file_path
+        self.strings = strings
+        self.handle = open(file_path, 'ab')
+        if self.handle.tell() == 0:
+            self.handle.write(FILE_HEADER.pack(MAGIC, FORMAT_VERSION, RECORD.size))
+        self.buffer = bytearray()
+        self.buffered_rows = 0
+
+    def write_rows(self, header, rows):
+        for row in rows:
+            self.buffer += encode_record(row, self.strings)
+
+    def flush(self, fsync=False):
+        written = self.buffered_rows
+        # Strings first, so every flushed record can be decoded
+        self.strings.flush(fsync)
+        if self.buffer:
+            self.handle.write(self.buffer)
+            self.buffer = bytearray()
+            self.buffered_rows = 0
+        self.handle.flush()
+        if fsync:
+            os.fsync(self.handle.fileno())
+        return written
+
+    def close(self, fsync=False):
+        self.flush(fsync)
+        self.handle.close()
+
+
+def _check_file_header(data, file_path):
+    if len(data) < FILE_HEADER.size:
+        raise ValueError(f"File {file_path} is not a binary journal")
+    magic, version, record_size = FILE_HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION or record_size != RECORD.size:
+        raise ValueError(f"File {file_path} is not a version {FORMAT_VERSION} binary journal")
+
+
+def iter_records(file_path):
+    """
+    Memory-map a binary journal file and iterate over its unpacked records.
+
+    A torn record at the end of the file is ignored.
+
+    :param file_path: Path of the binary journal file
+    :return: Generator yielding tuples of raw record values
+    """
+    if os.path.getsize(file_path) <= FILE_HEADER.size:
+        with open(file_path, 'rb') as binary_file:
+            _check_file_header(binary_file.read(), file_path)
+        return
+    with open(file_path, 'rb') as binary_file, mmap.mmap(binary_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        _check_file_header(mapped, file_path)
+        record_count = (len(mapped) - FILE_HEADER.size) // RECORD.size
+        view = memoryview(mapped)
+        try:
+            yield from RECORD.iter_unpack(view[FILE_HEADER.size:FILE_HEADER.size + record_count * RECORD.size])
+        finally:
+            view.release()
+
+
+def iter_records_reversed(file_path):
+    """
+    Iterate over the unpacked records of a binary journal file, newest first.
+
+    :param file_path: Path of the binary journal file
+    :return: Generator yielding tuples of raw record values
+    """
+    if os.path.getsize(file_path) <= FILE_HEADER.size:
+        return
+    with open(file_path, 'rb') as binary_file, mmap.mmap(binary_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        _check_file_header(mapped, file_path)
+        record_count = (len(mapped) - FILE_HEADER.size) // RECORD.size
+        for position in range(record_count - 1, -1, -1):
+            yield RECORD.unpack_from(mapped, FILE_HEADER.size + position * RECORD.size)
+
+
+def read_column(file_path, column):
+    """
+    Read one column of every record without decoding the others.
+
+    :param file_path: Path of the binary journal file
+    :param column: Column name from TRANSACTION_FIELDNAMES
+    :return: List of the column's raw values (string ids for string columns)
+    """
+    position = TRANSACTION_FIELDNAMES.index(column)
+    field = struct.Struct('<' + RECORD.format[1:][position])
+    offset = struct.calcsize('<' + RECORD.format[1:position + 1])
+    with open(file_path, 'rb') as binary_file:
+        data = binary_file.read()
+    _check_file_header(data, file_path)
+    record_count = (len(data) - FILE_HEADER.size) // RECORD.size
+    return [field.unpack_from(data, FILE_HEADER.size + i * RECORD.size + offset)[0] for i in range(record_count)]
+
+
+class BinaryTransactionJournal(TransactionJournal):
+    """
+    A storage backend that writes transaction journals as fixed-width binary records instead of CSV rows.
+
+    Every '{name}.csv' transaction file is stored as '{name}.bin': a small file header
+    followed by 96-byte records, so the n-th record is at a fixed offset, the last row
+    is one seek away and the file can be memory-mapped. Strings are interned in a
+    shared StringTable. Files with another header, such as system_accounts.csv, stay
+    CSV. Buffering, flush thresholds and fsync policies are the TransactionJournal's.
+    Rows read back as the strings csv.DictReader would return, except that amounts
+    and balances always have a decimal point.
+    """
+    csv_storage = False
+
+    def __init__(self, string_table_path: str = 'system_strings.jsonl', **kwargs) -> None:
+        """
+        Initialize the BinaryTransactionJournal.
+
+        :param string_table_path: Path of the shared string table (default is 'system_strings.jsonl')
+        :param kwargs: TransactionJournal settings
+        """
+        self.strings = StringTable(string_table_path)
+        super().__init__(**kwargs)
+
+    def _open_file(self, file_path, header):
+        if header == TRANSACTION_FIELDNAMES:
+            return _BinaryJournalFile(binary_path_for(file_path), self.strings)
+        return super()._open_file(file_path, header)
+
+    def exists(self, file_path):
+        return os.path.isfile(binary_path_for(file_path)) or super().exists(file_path)
+
+    def iter_rows(self, file_path):
+        binary_path = binary_path_for(file_path)
+        if not os.path.isfile(binary_path):
+            yield from super().iter_rows(file_path)
+            return
+        self.flush()
+        for values in iter_records(binary_path):
+            yield decode_record(values, self.strings)
+
+    def iter_records(self, file_path):
+        binary_path = binary_path_for(file_path)
+        if not os.path.isfile(binary_path):
+            yield from super().iter_records(file_path)
+            return
+        self.flush()
+        for values in iter_records(binary_path):
+            yield TransactionRecord._make(decode_record(values, self.strings).values())
+
+    def iter_last_rows(self, file_path, columns):
+        binary_path = binary_path_for(file_path)
+        if not os.path.isfile(binary_path):
+            yield from super().iter_last_rows(file_path, columns)
+            return
+        self.flush()
+        for values in iter_records_reversed(binary_path):
+            row = decode_record(values, self.strings)
+            yield [row[column] for column in columns]
+
+    def read_last_row(self, file_path, columns):
+        binary_path = binary_path_for(file_path)
+        if not os.path.isfile(binary_path):
+            return super().read_last_row(file_path, columns)
+        self.flush()
+        with open(binary_path, 'rb') as binary_file:
+            _check_file_header(binary_file.read(FILE_HEADER.size), binary_path)
+            record_count = (os.path.getsize(binary_path) - FILE_HEADER.size) // RECORD.size
+            if record_count == 0:
+                raise ValueError(f"File {binary_path} has no data rows")
+            binary_file.seek(FILE_HEADER.size + (record_count - 1) * RECORD.size)
+            row = decode_record(RECORD.unpack(binary_file.read(RECORD.size)), self.strings)
+        try:
+            return [row[column] for column in columns]
+        except KeyError as e:
+            raise ValueError(f"Columns not found in {binary_path}: {set(columns) - set(row)}") from e
+
+
+def csv_to_binary(csv_path, strings, binary_path=None):
+    """
+    Convert a CSV transaction file to the binary format.
+
+    :param csv_path: Path of the CSV transaction file
+    :param strings: StringTable shared by the binary files
+    :param binary_path: Path of the binary file to write (default is binary_path_for(csv_path))
+    :return: Number of converted rows
+    """
+    binary_path = binary_path if binary_path is not None else binary_path_for(csv_path)
+    converted = 0
+    with open(csv_path, 'r', newline='') as csvfile, open(binary_path, 'wb') as binary_file:
+        reader = csv.DictReader(csvfile)
+        binary_file.write(FILE_HEADER.pack(MAGIC, FORMAT_VERSION, RECORD.size))
+        records = bytearray()
+        for row in reader:
+            records += encode_record([row[field] for field in TRANSACTION_FIELDNAMES], strings)
+            converted += 1
+        strings.flush()
+        binary_file.write(records)
+    return converted
+
+
+def binary_to_csv(binary_path, strings, csv_path):
+    """
+    Convert a binary transaction file back to CSV.
+
+    :param binary_path: Path of the binary transaction file
+    :param strings: StringTable shared by the binary files
+    :param csv_path: Path of the CSV file to write
+    :return: Number of converted rows
+    """
+    converted = 0
+    with open(csv_path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(TRANSACTION_FIELDNAMES)
+        for values in iter_records(binary_path):
+            row = decode_record(values, strings)
+            writer.writerow([row[field] for field in TRANSACTION_FIELDNAMES])
+            converted += 1
+    return converted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert transaction journals between CSV and the binary format.")
+    parser.add_argument('direction', choices=['to-binary', 'to-csv'])
+    parser.add_argument('files', nargs='+', help="CSV files for to-binary, binary files for to-csv")
+    parser.add_argument('--strings', default='system_strings.jsonl', help="path of the shared string table")
+    args = parser.parse_args()
+
+    string_table = StringTable(args.strings)
+    for path in args.files:
+        if args.direction == 'to-binary':
+            count = csv_to_binary(path, string_table)
+            print(f"Converted {count} rows from {path} to {binary_path_for(path)}")
+        else:
+            target = f"{os.path.splitext(path)[0]}.csv"
+            count = binary_to_csv(path, string_table, target)
+            print(f"Converted {count} rows from {path} to {target}")
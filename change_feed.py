@@ -0,0 +1,292 @@
+import asyncio
+import csv
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_right
+from io import StringIO
+from transaction_index import TransactionIndex
+from transaction_journal import TransactionRecord
+
+
+class SubscriptionLagged(LookupError):
+    """
+    Raised when a subscriber asks for records the ChangeFeed has already dropped from its buffer.
+    """
+
+
+class ChangeFeed:
+    """
+    An in-process feed of committed transactions that any number of subscribers follow at their own pace.
+
+    BankingSystem publishes every committed TransactionRecord here, in commit order, which
+    is transaction_id order. Records are kept in one shared buffer and each Subscription
+    only holds its position in it, so a slow subscriber never holds back commits or other
+    subscribers. The buffer keeps at least the capacity most recent records; a subscriber
+    that falls further behind gets SubscriptionLagged and can catch up from the file with
+    a TransactionTailFollower.
+    """
+    def __init__(self, capacity: int = 100_000) -> None:
+        """
+        Initialize the ChangeFeed.
+
+        :param capacity: Number of recent records kept for subscribers that fall behind (default is 100,000)
+        :raise ValueError: If capacity is not positive
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1.")
+        self.capacity = capacity
+        self._records = []
+        # Position of self._records[0] among every record ever published
+        self._first_position = 0
+        # Largest transaction_id committed before the oldest buffered record
+        self._dropped_transaction_id = 0
+        self._condition = threading.Condition()
+        self._closed = False
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def next_position(self):
+        """
+        Position the next published record will have.
+        """
+        return self._first_position + len(self._records)
+
+    def publish(self, records):
+        """
+        Append committed records and wake the waiting subscribers.
+
+        :param records: Sequence of TransactionRecords in commit order
+        """
+        with self._condition:
+            self._records.extend(records)
+            # Dropping the oldest records in large steps keeps publish() amortized O(1)
+            if len(self._records) >= 2 * self.capacity:
+                dropped = len(self._records) - self.capacity
+                self._dropped_transaction_id = self._records[dropped - 1].transaction_id
+                del self._records[:dropped]
+                self._first_position += dropped
+            self._condition.notify_all()
+
+    def start_after(self, transaction_id):
+        """
+        Record that transactions up to transaction_id were committed before the feed started, e.g. in an earlier run.
+        """
+        with self._condition:
+            if not self._records:
+                self._dropped_transaction_id = transaction_id or 0
+
+    def subscribe(self, after_transaction_id: int = None):
+        """
+        Start following the feed.
+
+        :param after_transaction_id: Resume after this transaction_id, e.g. the last one a consumer processed,
+                                     None to only receive records published from now on (default is None)
+        :return: Subscription instance
+        :raise SubscriptionLagged: If records after after_transaction_id are no longer buffered
+        """
+        with self._condition:
+            if after_transaction_id is None:
+                return Subscription(self, self.next_position)
+            if after_transaction_id < self._dropped_transaction_id:
+                raise SubscriptionLagged(f"Transactions after {after_transaction_id} are no longer buffered.")
+            index = bisect_right(self._records, after_transaction_id, key=lambda record: record.transaction_id)
+            return Subscription(self, self._first_position + index)
+
+    def close(self):
+        """
+        Stop the feed. Subscribers still receive the buffered records, then their iterators end.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def _read(self, subscription, max_records, timeout):
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.next_position > subscription.position or self._closed or subscription.closed, timeout)
+            start = subscription.position - self._first_position
+            if start < 0:
+                raise SubscriptionLagged(f"The subscriber is {-start} records behind the oldest buffered record.")
+            records = self._records[start:start + max_records]
+            subscription.position += len(records)
+            return records
+
+
+class Subscription:
+    """
+    One consumer's position in a ChangeFeed, iterated synchronously or with async for.
+    """
+    def __init__(self, feed, position):
+        self.feed = feed
+        self.position = position
+        self.closed = False
+
+    @property
+    def lag(self):
+        """
+        Number of published records this subscriber has not read yet.
+        """
+        return self.feed.next_position - self.position
+
+    def get_batch(self, max_records: int = 1000, timeout: float = None):
+        """
+        Return the next records, waiting for at least one.
+
+        :param max_records: Maximum number of records returned (default is 1000)
+        :param timeout: Seconds to wait, None to wait until a record arrives or the feed closes (default is None)
+        :return: List of TransactionRecords, empty on timeout or once the feed or subscription is closed
+        :raise SubscriptionLagged: If the next records were already dropped from the buffer
+        """
+        if self.closed:
+            return []
+        return self.feed._read(self, max_records, timeout)
+
+    def get(self, timeout: float = None):
+        """
+        Return the next record, or None on timeout or once the feed is closed.
+        """
+        records = self.get_batch(1, timeout)
+        return records[0] if records else None
+
+    def close(self):
+        """
+        Stop this subscription; a blocked get_batch() returns at once.
+        """
+        self.closed = True
+        with self.feed._condition:
+            self.feed._condition.notify_all()
+
+    def __iter__(self):
+        while True:
+            records = self.get_batch()
+            if not records:
+                return
+            yield from records
+
+    def __aiter__(self):
+        return self._iterate_async()
+
+    async def _iterate_async(self, poll_interval: float = 0.5):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Waits in a worker thread with a timeout, so the event loop stays free and cancellation is prompt
+            records = await loop.run_in_executor(None, self.get_batch, 1000, poll_interval)
+            if records:
+                for record in records:
+                    yield record
+            elif self.closed or (self.feed.closed and self.lag <= 0):
+                return
+
+
+class TransactionTailFollower:
+    """
+    Follows a transaction CSV file, such as system_transactions.csv, by byte offset.
+
+    Each poll() only reads the bytes appended since the previous one and returns their
+    complete rows; a half-written last row is left for the next poll. The offset and the
+    last transaction_id can be saved to an offset file with commit_offset(), so a consumer
+    process resumes where it stopped. Any number of followers can read the same file.
+    """
+    def __init__(self, file_path: str, offset: int = 0, after_transaction_id: int = None,
+                 offset_path: str = None) -> None:
+        """
+        Initialize the TransactionTailFollower.
+
+        The start position is, in order of precedence, the one stored in offset_path, the row after
+        after_transaction_id (found through the file's TransactionIndex), then offset.
+
+        :param file_path: Path of the transaction CSV file
+        :param offset: Byte offset to start from, 0 for the first row (default is 0)
+        :param after_transaction_id: Start after this transaction_id instead of at offset (default is None)
+        :param offset_path: JSON file where commit_offset() saves the position, and from which it is resumed
+                            (default is None)
+        """
+        self.file_path = file_path
+        self.offset_path = offset_path
+        self.offset = offset
+        self.transaction_id = after_transaction_id
+        if offset_path is not None and os.path.isfile(offset_path):
+            with open(offset_path) as offset_file:
+                stored = json.load(offset_file)
+            self.offset, self.transaction_id = stored['offset'], stored['transaction_id']
+        elif after_transaction_id is not None:
+            index = TransactionIndex(file_path)
+            index.refresh()
+            position = bisect_right(index.transaction_ids, after_transaction_id)
+            self.offset = index.offsets[position] if position < len(index) else index.indexed_size
+
+    def poll(self, max_bytes: int = 4 * 1024 * 1024):
+        """
+        Read the rows appended since the last poll.
+
+        :param max_bytes: Maximum number of bytes read by one poll (default is 4 MiB)
+        :return: List of TransactionRecords with the column values as strings
+        :raise ValueError: If the file became shorter than the offset, e.g. it was replaced
+        """
+        if not os.path.isfile(self.file_path):
+            return []
+        file_size = os.path.getsize(self.file_path)
+        if file_size < self.offset:
+            raise ValueError(f"{self.file_path} is shorter than the followed offset {self.offset}.")
+        records = []
+        with open(self.file_path, 'rb') as data_file:
+            if self.offset == 0:
+                self.offset = len(data_file.readline())
+            data_file.seek(self.offset)
+            data = data_file.read(max_bytes)
+            record = b''
+            for line in data.splitlines(keepends=True):
+                record += line
+                # A record is complete once its quotes are balanced and it ends with a newline
+                if record.count(b'"') % 2 or not record.endswith(b'\n'):
+                    continue
+                row = next(csv.reader(StringIO(record.decode(), newline='')), None)
+                self.offset += len(record)
+                record = b''
+                if row:
+                    records.append(TransactionRecord._make(row))
+        if records:
+            self.transaction_id = int(records[-1].transaction_id)
+        return records
+
+    def follow(self, poll_interval: float = 0.2, stop_event: threading.Event = None):
+        """
+        Yield new rows as they are appended, polling the file while there are none.
+
+        :param poll_interval: Seconds between polls of an idle file (default is 0.2)
+        :param stop_event: threading.Event that ends the generator when set (default is to follow forever)
+        :return: Generator yielding TransactionRecords with the column values as strings
+        """
+        while stop_event is None or not stop_event.is_set():
+            records = self.poll()
+            if records:
+                yield from records
+            elif stop_event is not None:
+                stop_event.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+
+    def commit_offset(self):
+        """
+        Atomically save the current offset and transaction_id to the offset file.
+
+        :raise ValueError: If the follower has no offset_path
+        """
+        if self.offset_path is None:
+            raise ValueError("No offset_path was given to save the offset to.")
+        directory = os.path.dirname(os.path.abspath(self.offset_path))
+        fd, temp_path = tempfile.mkstemp(prefix='.offset-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as temp_file:
+                json.dump({'offset': self.offset, 'transaction_id': self.transaction_id}, temp_file)
+            os.replace(temp_path, self.offset_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
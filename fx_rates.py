@@ -0,0 +1,160 @@
+import csv
+import os
+import threading
+import time
+from decimal import Decimal
+import money
+
+FX_RATES_FIELDNAMES = ['currency', 'rate']
+
+
+class FXRates:
+    """
+    Exchange rates read from a local CSV table, with cached cross rates that expire after a time to live.
+
+    Each row of the table gives how many units of the base currency one unit of a
+    currency buys, e.g. 'USD,7.8' with an HKD base. The rate between any two listed
+    currencies is derived through the base and cached. Every ttl seconds the table
+    file is checked again, and a changed table is reloaded and empties the cache, so
+    updated rates are picked up without a restart. Conversions are exact Decimal
+    arithmetic on minor units, rounded half to even to the target currency's minor unit.
+    """
+    def __init__(self, file_path: str = 'fx_rates.csv', base_currency: str = 'HKD', ttl: float = 300.0,
+                 clock=time.monotonic) -> None:
+        """
+        Initialize FXRates and load the rate table if it exists.
+
+        :param file_path: Path of the CSV rate table with FX_RATES_FIELDNAMES columns (default is 'fx_rates.csv')
+        :param base_currency: Currency the table's rates are quoted in (default is 'HKD')
+        :param ttl: Seconds between checks of the table file for changed rates (default is 300)
+        :param clock: Callable returning the current time in seconds (default is time.monotonic)
+        :raise ValueError: If ttl is not positive or a rate in the table is not a positive number
+        """
+        if ttl <= 0:
+            raise ValueError("ttl must be positive.")
+        self.file_path = file_path
+        self.base_currency = base_currency
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._rates = {base_currency: Decimal(1)}  # currency -> base currency units per unit
+        self._cross_rates = {}  # (from_currency, to_currency) -> rate, emptied when the table is reloaded
+        self._misses = set()  # currencies the table lacked when last checked, until the cache expires
+        self._file_mtime = None
+        self._expires_at = clock() + ttl
+        self.reloads = 0
+        self.reload()
+
+    def reload(self):
+        """
+        Read the rate table again and drop every cached cross rate.
+
+        :return: Number of currencies with a rate, the base currency included
+        """
+        rates = {self.base_currency: Decimal(1)}
+        file_mtime = None
+        if os.path.isfile(self.file_path):
+            file_mtime = os.path.getmtime(self.file_path)
+            with open(self.file_path, 'r', newline='') as csvfile:
+                for row in csv.DictReader(csvfile):
+                    rate = money.to_decimal(row['rate'])
+                    if rate <= 0:
+                        raise ValueError(f"FX rate of {row['currency']} must be positive, got {row['rate']}.")
+                    rates[row['currency']] = rate
+        with self._lock:
+            self._rates = rates
+            self._cross_rates = {}
+            self._misses = set()
+            self._file_mtime = file_mtime
+            self.reloads += 1
+        return len(rates)
+
+    def _table_changed(self):
+        file_mtime = os.path.getmtime(self.file_path) if os.path.isfile(self.file_path) else None
+        return file_mtime != self._file_mtime
+
+    def currencies(self):
+        return sorted(self._rates)
+
+    def rate(self, from_currency, to_currency):
+        """
+        Return how many units of to_currency one unit of from_currency buys.
+
+        :return: Decimal exchange rate
+        :raise ValueError: If either currency has no rate in the table
+        """
+        if from_currency == to_currency:
+            return Decimal(1)
+        key = (from_currency, to_currency)
+        rates = self._rates
+        now = self._clock()
+        # Once the cache has expired, or for a currency the table lacked, the table file is checked again;
+        # a currency still missing is not checked for again until the cache expires
+        expired = now >= self._expires_at
+        missing = [currency for currency in key if currency not in rates]
+        if expired or any(currency not in self._misses for currency in missing):
+            if expired:
+                self._expires_at = now + self.ttl
+                self._misses = set()
+            if self._table_changed():
+                self.reload()
+                rates = self._rates
+            self._misses.update(currency for currency in key if currency not in rates)
+        rate = self._cross_rates.get(key)
+        if rate is not None:
+            return rate
+        for currency in key:
+            if currency not in rates:
+                raise ValueError(f"No FX rate for {currency} in {self.file_path}.")
+        rate = self._cross_rates[key] = rates[from_currency] / rates[to_currency]
+        return rate
+
+    def has_rates(self, currencies, to_currency):
+        """
+        Return True if every currency can be converted to to_currency.
+        """
+        try:
+            for currency in currencies:
+                self.rate(currency, to_currency)
+        except ValueError:
+            return False
+        return True
+
+    def convert_units(self, units, from_currency, to_currency):
+        """
+        Convert an amount in minor units of one currency to minor units of another.
+
+        :return: Integer minor units of to_currency, rounded half to even
+        :raise ValueError: If either currency has no rate in the table
+        """
+        if from_currency == to_currency:
+            return units
+        converted = money.minor_to_decimal(units, from_currency) * self.rate(from_currency, to_currency)
+        return money.to_minor(converted, to_currency)
+
+    def convert(self, amount, from_currency, to_currency):
+        """
+        Convert an amount in major units, rounded to the minor unit of to_currency.
+
+        :return: Converted amount as a float
+        """
+        units = money.to_minor(amount, from_currency)
+        return money.from_minor(self.convert_units(units, from_currency, to_currency), to_currency)
+
+    def consolidate(self, currency_totals_units, currency=None):
+        """
+        Convert per-currency totals into one total, with one multiply-add per currency.
+
+        :param currency_totals_units: Dictionary mapping currency to a total in minor units, or to a
+                                      (total_units, count) tuple as BalanceAggregates.currency_totals_units returns
+        :param currency: Currency of the consolidated total (default is the base currency)
+        :return: Consolidated total as a float, rounded to the currency's minor unit
+        :raise ValueError: If a currency has no rate in the table
+        """
+        currency = currency if currency is not None else self.base_currency
+        total = Decimal(0)
+        for from_currency, units in currency_totals_units.items():
+            if isinstance(units, tuple):
+                units = units[0]
+            total += money.minor_to_decimal(units, from_currency) * self.rate(from_currency, currency)
+        return money.from_minor(money.to_minor(total, currency), currency)
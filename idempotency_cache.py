@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from system_reader import iter_tail_rows
+from transaction_journal import TransactionRecord, TRANSACTION_FIELDNAMES
+
+# Keyed by transaction_id like the transaction files, so WAL replay can skip rows already written
+IDEMPOTENCY_FIELDNAMES = ['transaction_id', 'idempotency_key', 'expires_time'] + TRANSACTION_FIELDNAMES[1:]
+
+
+class IdempotencyCache:
+    """
+    A bounded LRU cache of recent idempotency keys and the results recorded for them, with a time to live.
+
+    A money-moving call with an idempotency key first claims the key with begin(). A key whose
+    result is cached returns it at once, a concurrent call with the same key waits for the first
+    one to finish, and a new key is claimed until complete() stores its result or abort()
+    releases it. Only the max_entries most recently used keys are kept. The keys and results are
+    also journaled by BankingSystem to system_idempotency.csv and reloaded from its tail by load().
+    """
+    def __init__(self, max_entries: int = 100_000, ttl: float = 24 * 60 * 60) -> None:
+        """
+        Initialize the IdempotencyCache.
+
+        :param max_entries: Maximum number of keys kept (default is 100,000)
+        :param ttl: Seconds a key is remembered after its result was recorded (default is one day)
+        :raise ValueError: If max_entries or ttl is not positive
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1.")
+        if ttl <= 0:
+            raise ValueError("ttl must be positive.")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (result, expires_at)
+        self._in_flight = {}  # key -> threading.Event set when the claiming call finishes
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get_locked(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, key):
+        """
+        Return the result recorded for a key, or None if it is unknown or expired.
+        """
+        with self._lock:
+            entry = self._get_locked(key, time.time())
+        return entry[0] if entry is not None else None
+
+    def begin(self, key):
+        """
+        Claim a key for a new call, or return the result already recorded for it.
+
+        :param key: Idempotency key
+        :return: Tuple of (True, None) if the caller claimed the key and must call complete() or abort(),
+                 or (False, result) if a result was already recorded
+        """
+        while True:
+            with self._lock:
+                entry = self._get_locked(key, time.time())
+                if entry is not None:
+                    self.hits += 1
+                    return False, entry[0]
+                done = self._in_flight.get(key)
+                if done is None:
+                    self._in_flight[key] = threading.Event()
+                    return True, None
+            # Another call holds the key; take its result, or the key if it gives up
+            done.wait()
+
+    def complete(self, key, result, expires_at=None):
+        """
+        Record the result of a key and release its claim.
+
+        :param key: Idempotency key
+        :param result: Result returned to later calls with the same key
+        :param expires_at: time.time() value when the key expires (default is now plus the ttl)
+        """
+        with self._lock:
+            self._store_locked(key, result, time.time() + self.ttl if expires_at is None else expires_at)
+            done = self._in_flight.pop(key, None)
+        if done is not None:
+            done.set()
+
+    def abort(self, key):
+        """
+        Release the claim of a key whose call failed without recording a result.
+        """
+        with self._lock:
+            done = self._in_flight.pop(key, None)
+        if done is not None:
+            done.set()
+
+    def _store_locked(self, key, result, expires_at):
+        self._entries[key] = (result, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def load(self, file_path):
+        """
+        Rebuild the cache from the tail of a journaled idempotency file, keeping the newest unexpired keys.
+
+        :param file_path: Path of the CSV file with IDEMPOTENCY_FIELDNAMES columns
+        :return: Number of keys loaded
+        """
+        now = time.time()
+        newest_first = []
+        for row in iter_tail_rows(file_path, self.max_entries):
+            if len(row) != len(IDEMPOTENCY_FIELDNAMES):
+                continue
+            transaction_id, key, expires_time, *values = row
+            expires_at = datetime.fromisoformat(expires_time).timestamp()
+            if expires_at <= now:
+                # Rows are in commit order, so every older row has expired too
+                break
+            newest_first.append((key, TransactionRecord(transaction_id, *values), expires_at))
+        with self._lock:
+            for key, result, expires_at in reversed(newest_first):
+                self._store_locked(key, result, expires_at)
+        return len(newest_first)
+
+    def journal_row(self, key, transaction):
+        """
+        Return the system_idempotency.csv row recording a key and its committed transaction.
+        """
+        expires_time = (datetime.now() + timedelta(seconds=self.ttl)).isoformat()
+        return [transaction.transaction_id, key, expires_time, *transaction[1:]]
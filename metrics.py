@@ -0,0 +1,205 @@
+import math
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency buckets, from 10 microseconds to 10 seconds; one more bucket is unbounded
+DEFAULT_LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class LatencyHistogram:
+    """
+    Counts of observed durations per latency bucket, with their count, sum, minimum and maximum.
+
+    Not thread-safe on its own; Metrics serializes the observations.
+    """
+    __slots__ = ('bounds', 'buckets', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, bounds=DEFAULT_LATENCY_BUCKETS) -> None:
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds):
+        self.buckets[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """
+        Estimate a percentile by linear interpolation inside the bucket holding it.
+
+        :param fraction: Percentile as a fraction, e.g. 0.99
+        :return: Estimated duration in seconds, or None if nothing was observed
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            if bucket_count and seen + bucket_count >= rank:
+                low = self.bounds[index - 1] if index else 0.0
+                high = self.bounds[index] if index < len(self.bounds) else self.max
+                estimate = low + (high - low) * (rank - seen) / bucket_count
+                return min(max(estimate, self.min), self.max)
+            seen += bucket_count
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'buckets': list(zip(self.bounds + (math.inf,), self.buckets)),
+        }
+
+
+class Metrics:
+    """
+    Per-stage latency histograms, operation counters by type and status, and gauges of one BankingSystem.
+
+    Stages are timed by the caller with time.perf_counter() and recorded with observe(), so a disabled
+    Metrics costs one attribute check per stage. snapshot() returns everything as a dictionary and
+    write_prometheus() exports it in the Prometheus text format, e.g. for a node_exporter textfile collector.
+    """
+    def __init__(self, enabled: bool = True, latency_buckets=DEFAULT_LATENCY_BUCKETS, prefix: str = 'banking') -> None:
+        """
+        Initialize the Metrics.
+
+        :param enabled: Record observations; a disabled Metrics ignores them (default is True)
+        :param latency_buckets: Increasing upper bounds in seconds of the latency buckets
+        :param prefix: Prefix of the exported Prometheus metric names (default is 'banking')
+        """
+        latency_buckets = tuple(latency_buckets)
+        if not latency_buckets or any(low >= high for low, high in zip(latency_buckets, latency_buckets[1:])):
+            raise ValueError("latency_buckets must be a non-empty increasing sequence.")
+        self.enabled = enabled
+        self.latency_buckets = latency_buckets
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._operations = {}  # (type, status) -> count
+        self._gauges = {}
+
+    def observe(self, stage, seconds):
+        """
+        Record the duration of one run of a stage.
+
+        :param stage: Stage name, e.g. 'validation' or 'system_journal_write'
+        :param seconds: Duration in seconds
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = LatencyHistogram(self.latency_buckets)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        """
+        Time the body of a with block as one run of a stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def count_operation(self, operation_type, status, count=1):
+        """
+        Count committed operations by transaction type and status.
+        """
+        if not self.enabled:
+            return
+        key = (operation_type, status)
+        with self._lock:
+            self._operations[key] = self._operations.get(key, 0) + count
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._operations.clear()
+            self._gauges.clear()
+
+    def snapshot(self):
+        """
+        Return every metric.
+
+        :return: Dictionary with 'stages' (stage -> latency summary in seconds), 'operations'
+                 (type -> status -> count) and 'gauges' (name -> value)
+        """
+        with self._lock:
+            operations = {}
+            for (operation_type, status), count in self._operations.items():
+                operations.setdefault(operation_type, {})[status] = count
+            return {
+                'stages': {stage: histogram.snapshot() for stage, histogram in self._stages.items()},
+                'operations': operations,
+                'gauges': dict(self._gauges),
+            }
+
+    def to_prometheus(self):
+        """
+        Render every metric in the Prometheus text exposition format.
+        """
+        prefix = self.prefix
+        lines = [f'# HELP {prefix}_stage_latency_seconds Latency of each transaction processing stage.',
+                 f'# TYPE {prefix}_stage_latency_seconds histogram']
+        with self._lock:
+            for stage, histogram in sorted(self._stages.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.bounds + (math.inf,), histogram.buckets):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == math.inf else repr(bound)
+                    lines.append(f'{prefix}_stage_latency_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_latency_seconds_sum{{stage="{stage}"}} {histogram.sum!r}')
+                lines.append(f'{prefix}_stage_latency_seconds_count{{stage="{stage}"}} {histogram.count}')
+            lines.append(f'# HELP {prefix}_operations_total Committed operations by transaction type and status.')
+            lines.append(f'# TYPE {prefix}_operations_total counter')
+            for (operation_type, status), count in sorted(self._operations.items()):
+                lines.append(f'{prefix}_operations_total{{type="{operation_type}",status="{status}"}} {count}')
+            for name, value in sorted(self._gauges.items()):
+                lines.append(f'# TYPE {prefix}_{name} gauge')
+                lines.append(f'{prefix}_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, file_path):
+        """
+        Atomically write the Prometheus text format to a file, so a scraper never reads a partial file.
+
+        :param file_path: Path of the file, e.g. 'banking.prom'
+        """
+        directory = os.path.dirname(os.path.abspath(file_path))
+        fd, temp_path = tempfile.mkstemp(prefix='.metrics-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as temp_file:
+                temp_file.write(self.to_prometheus())
+            os.replace(temp_path, file_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
@@ -0,0 +1,82 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
+
+# Number of decimal places of each currency's minor unit, ISO 4217
+CURRENCY_SCALES = {
+    'HKD': 2, 'USD': 2, 'EUR': 2, 'GBP': 2, 'CNY': 2, 'SGD': 2, 'AUD': 2, 'CAD': 2, 'CHF': 2,
+    'JPY': 0, 'KRW': 0,
+    'BHD': 3, 'KWD': 3,
+}
+DEFAULT_SCALE = 2
+
+
+def currency_scale(currency):
+    return CURRENCY_SCALES.get(currency, DEFAULT_SCALE)
+
+
+def to_decimal(amount):
+    """
+    Convert an amount to Decimal, reading floats by their shortest repr so 0.1 becomes Decimal('0.1').
+
+    :raise ValueError: If the amount is not a finite number
+    """
+    if isinstance(amount, bool):
+        raise ValueError(f"Invalid amount: {amount!r}")
+    try:
+        value = Decimal(repr(amount)) if isinstance(amount, float) else Decimal(amount)
+    except (InvalidOperation, TypeError) as e:
+        raise ValueError(f"Invalid amount: {amount!r}") from e
+    if not value.is_finite():
+        raise ValueError(f"Invalid amount: {amount!r}")
+    return value
+
+
+def to_minor(amount, currency, exact=False):
+    """
+    Convert an amount in major units (e.g. dollars) to an integer number of minor units (e.g. cents).
+
+    :param amount: int, float, Decimal or numeric string
+    :param currency: Currency code, which sets the number of minor units per major unit
+    :param exact: Raise instead of rounding when the amount has more decimal places than the currency (default is False)
+    :return: Integer number of minor units, rounded half to even
+    :raise ValueError: If the amount is invalid, or needs rounding while exact is True
+    """
+    value = to_decimal(amount).scaleb(currency_scale(currency))
+    units = value.to_integral_value(rounding=ROUND_HALF_EVEN)
+    if exact and units != value:
+        raise ValueError(f"Amount {amount} has more than {currency_scale(currency)} decimal places for {currency}.")
+    return int(units)
+
+
+def from_minor(units, currency):
+    """
+    Convert minor units back to a float amount in major units, the type the rest of the system exposes.
+
+    The float is the one closest to the exact decimal value, so 33980 HKD cents gives 339.8.
+    """
+    scale = currency_scale(currency)
+    return units / 10 ** scale if scale else float(units)
+
+
+def minor_to_decimal(units, currency):
+    """
+    Convert minor units to an exact Decimal amount in major units.
+    """
+    return Decimal(units).scaleb(-currency_scale(currency))
+
+
+def rate_ratio(rate):
+    """
+    Return an interest or fee rate as an exact (numerator, denominator) pair of integers.
+    """
+    return to_decimal(rate).as_integer_ratio()
+
+
+def round_half_even_div(numerator, denominator):
+    """
+    Integer division of two ints, rounded half to even. denominator must be positive.
+    """
+    quotient, remainder = divmod(numerator, denominator)
+    twice = 2 * remainder
+    if twice > denominator or (twice == denominator and quotient % 2):
+        quotient += 1
+    return quotient
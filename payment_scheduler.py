@@ -0,0 +1,343 @@
+import calendar
+import csv
+import heapq
+import itertools
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional, Union
+from banking_logging import get_logger
+
+logger = get_logger(__name__)
+
+# Keyed by an increasing revision, so WAL replay can skip rows already written; the last row of an order wins
+SCHEDULED_ORDER_FIELDNAMES = ['revision', 'order_id', 'type', 'account_id', 'target_id', 'amount', 'currency',
+                              'first_due_time', 'interval', 'period', 'max_periods', 'status', 'updated_time']
+MONTHLY = 'monthly'
+# What happens to the periods of an order that fell due while the system was down
+MISSED_SKIP = 'skip'  # run the order once and skip the other missed periods
+MISSED_CATCH_UP = 'catch_up'  # run every missed period, oldest first
+MISSED_PERIOD_POLICIES = (MISSED_SKIP, MISSED_CATCH_UP)
+
+
+def add_months(moment, months):
+    """
+    Add calendar months to a datetime, moving the day back to the last day of shorter months.
+    """
+    month_index = moment.month - 1 + months
+    year, month = moment.year + month_index // 12, month_index % 12 + 1
+    return moment.replace(year=year, month=month, day=min(moment.day, calendar.monthrange(year, month)[1]))
+
+
+class ScheduledOrder(NamedTuple):
+    """
+    A future-dated or recurring operation, due at first_due_time and then every interval.
+
+    The due time of each period is computed from first_due_time, so monthly orders on the
+    31st stay on the last day of every month instead of drifting. Orders without an
+    account_id are system-wide interest orders, with the rate as amount.
+    """
+    order_id: int
+    type: str
+    account_id: Optional[int]
+    target_id: Optional[int]
+    amount: float
+    currency: Optional[str]
+    first_due_time: datetime
+    interval: Union[None, float, str]  # None for a one-off order, seconds, or 'monthly'
+    period: int  # index of the next due period
+    max_periods: Optional[int]
+    status: str  # 'active', 'completed' or 'cancelled'
+
+    def due_time(self, period=None):
+        period = self.period if period is None else period
+        if self.interval == MONTHLY:
+            return add_months(self.first_due_time, period)
+        if period == 0:
+            return self.first_due_time
+        return self.first_due_time + timedelta(seconds=self.interval * period)
+
+    def advance(self, now, catch_up=False):
+        """
+        Move the order past the period that fell due.
+
+        :param now: datetime the order runs at; the periods that fell due before it are skipped unless catch_up is set
+        :param catch_up: Only move to the next period, so missed periods still fall due (default is False)
+        :return: The advanced ScheduledOrder, 'completed' once it has no period left
+        """
+        if self.interval is None:
+            return self._replace(period=self.period + 1, status='completed')
+        period = self.period + 1
+        if not catch_up and self.interval == MONTHLY:
+            while self.due_time(period) <= now:
+                period += 1
+        elif not catch_up:
+            period = max(period, int((now - self.first_due_time).total_seconds() // self.interval) + 1)
+        if self.max_periods is not None and period >= self.max_periods:
+            return self._replace(period=period, status='completed')
+        return self._replace(period=period)
+
+    def operation(self):
+        """
+        Return the apply_batch operation of the order.
+        """
+        operation = {'type': self.type, 'account_id': self.account_id, 'amount': self.amount}
+        if self.target_id is not None:
+            operation['target_id'] = self.target_id
+        return operation
+
+
+def _to_row(revision, order, updated_time):
+    return [revision, order.order_id, order.type, order.account_id, order.target_id, order.amount, order.currency,
+            order.first_due_time.isoformat(), order.interval, order.period, order.max_periods, order.status,
+            updated_time]
+
+
+def _from_row(row):
+    interval = row['interval']
+    return ScheduledOrder(
+        int(row['order_id']), row['type'], int(row['account_id']) if row['account_id'] else None,
+        int(row['target_id']) if row['target_id'] else None, float(row['amount']), row['currency'] or None,
+        datetime.fromisoformat(row['first_due_time']),
+        None if not interval else interval if interval == MONTHLY else float(interval),
+        int(row['period']), int(row['max_periods']) if row['max_periods'] else None, row['status'],
+    )
+
+
+class PaymentScheduler:
+    """
+    Persistent future-dated and standing orders, indexed in a heap keyed by due time.
+
+    Every change of an order is appended to system_scheduled_orders.csv through the
+    system's journal, so a restart rebuilds the heap from that file alone, without
+    reading the transaction history. run_due() pops every order that fell due and
+    runs them as coalesced apply_batch calls of up to batch_size operations, in due
+    time order, so a month-end of many due orders costs a few bulk journal writes.
+    An order's next period is journaled before its batch runs: a crash in between
+    skips that period rather than moving the money twice.
+
+    Periods that fell due while the system was down are skipped with a warning by
+    default, and counted in skipped; with missed_periods='catch_up' each of them runs,
+    oldest first, in the same coalesced batches.
+    """
+    def __init__(self, journal, execute_batch, apply_interest, file_path: str = 'system_scheduled_orders.csv',
+                 batch_size: int = 10_000, clock=datetime.now, missed_periods: str = MISSED_SKIP) -> None:
+        """
+        Initialize the PaymentScheduler and load the active orders from file_path.
+
+        :param journal: TransactionJournal the order changes are written through
+        :param execute_batch: Callable running a list of apply_batch operations and returning their results
+        :param apply_interest: Callable taking a rate and a currency, used for system-wide interest orders
+        :param file_path: Path of the scheduled orders file (default is 'system_scheduled_orders.csv')
+        :param batch_size: Maximum number of operations run by one execute_batch call (default is 10,000)
+        :param clock: Callable returning the current datetime (default is datetime.now)
+        :param missed_periods: 'skip' to run an order once for all its missed periods, or 'catch_up' to run
+                               every missed period (default is 'skip')
+        :raise ValueError: If batch_size is not positive or missed_periods is unknown
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1.")
+        if missed_periods not in MISSED_PERIOD_POLICIES:
+            raise ValueError(f"missed_periods must be one of {MISSED_PERIOD_POLICIES}, got {missed_periods!r}.")
+        self._journal = journal
+        self._execute_batch = execute_batch
+        self._apply_interest = apply_interest
+        self.file_path = file_path
+        self.batch_size = batch_size
+        self._clock = clock
+        self.missed_periods = missed_periods
+        self._orders = {}  # order_id -> active ScheduledOrder
+        self._heap = []  # (due time, order_id, period); entries of cancelled or advanced orders are skipped when popped
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._order_id_counter = itertools.count(1)
+        self._revision_counter = itertools.count(1)
+        self._stopped = threading.Event()
+        self._thread = None
+        self.executed = 0
+        self.skipped = 0
+        self._load()
+
+    def __len__(self):
+        return len(self._orders)
+
+    def _load(self):
+        """
+        Rebuild the active orders and their heap from the orders file, compacting the file when most rows are stale.
+        """
+        orders = {}
+        rows = last_revision = last_order_id = 0
+        for row in self._journal.iter_rows(self.file_path):
+            order = _from_row(row)
+            orders[order.order_id] = order
+            rows += 1
+            last_revision = max(last_revision, int(row['revision']))
+            last_order_id = max(last_order_id, order.order_id)
+        with self._lock:
+            self._orders = {order_id: order for order_id, order in orders.items() if order.status == 'active'}
+            self._heap = [(order.due_time(), order.order_id, order.period) for order in self._orders.values()]
+            heapq.heapify(self._heap)
+            self._order_id_counter = itertools.count(last_order_id + 1)
+            self._revision_counter = itertools.count(last_revision + 1)
+            if rows > 2 * len(self._orders) + 1000:
+                # The newest order is kept even when it ended, so its order_id is not handed out again
+                self._compact_locked([orders[last_order_id]] if last_order_id not in self._orders else [])
+
+    def _compact_locked(self, ended_orders):
+        # Only done at startup, before the journal holds an append handle to the file
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        fd, temp_path = tempfile.mkstemp(prefix='.orders-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', newline='') as temp_file:
+                writer = csv.writer(temp_file)
+                writer.writerow(SCHEDULED_ORDER_FIELDNAMES)
+                updated_time = datetime.now().isoformat()
+                orders = sorted([*self._orders.values(), *ended_orders], key=lambda order: order.order_id)
+                writer.writerows(_to_row(next(self._revision_counter), order, updated_time) for order in orders)
+            os.replace(temp_path, self.file_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _journal_orders(self, orders):
+        updated_time = datetime.now().isoformat()
+        self._journal.append_many(self.file_path, SCHEDULED_ORDER_FIELDNAMES,
+                                  [_to_row(next(self._revision_counter), order, updated_time) for order in orders])
+        self._journal.commit()
+
+    def schedule(self, operation_type, account_id, amount, due_time, interval=None, max_periods=None, target_id=None,
+                 currency=None):
+        """
+        Add an order and journal it.
+
+        :param operation_type: apply_batch operation type, e.g. 'transfer'
+        :param account_id: Account of the operation, None for a system-wide interest order
+        :param amount: Amount of the operation, or the rate of a system-wide interest order
+        :param due_time: datetime or ISO timestamp of the first execution
+        :param interval: None for a one-off order, a timedelta or seconds, or 'monthly' (default is None)
+        :param max_periods: Number of periods after which a recurring order ends, None to run until cancelled
+                            (default is None)
+        :param target_id: Target account of a transfer (default is None)
+        :param currency: Currency of a system-wide interest order (default is None)
+        :return: The ScheduledOrder
+        :raise ValueError: If the interval or max_periods is invalid
+        """
+        if isinstance(due_time, str):
+            due_time = datetime.fromisoformat(due_time)
+        if isinstance(interval, timedelta):
+            interval = interval.total_seconds()
+        if interval is not None and interval != MONTHLY and (isinstance(interval, str) or interval <= 0):
+            raise ValueError(f"interval must be positive seconds, a timedelta or '{MONTHLY}', got {interval!r}.")
+        if max_periods is not None and max_periods < 1:
+            raise ValueError("max_periods must be at least 1.")
+        with self._lock:
+            order = ScheduledOrder(next(self._order_id_counter), operation_type, account_id, target_id, amount,
+                                   currency, due_time, interval, 0, max_periods, 'active')
+            self._journal_orders([order])
+            self._orders[order.order_id] = order
+            heapq.heappush(self._heap, (due_time, order.order_id, 0))
+        return order
+
+    def cancel(self, order_id):
+        """
+        Cancel an active order. Its heap entry is dropped when it is next popped.
+
+        :return: True if the order was active, False otherwise
+        """
+        with self._lock:
+            order = self._orders.pop(order_id, None)
+            if order is None:
+                return False
+            self._journal_orders([order._replace(status='cancelled')])
+        return True
+
+    def get(self, order_id):
+        return self._orders.get(order_id)
+
+    def run_due(self, now=None):
+        """
+        Run every order due at or before now as coalesced batches and advance them.
+
+        :param now: datetime up to which orders are run (default is the clock's current time)
+        :return: Dictionary mapping each executed order_id to its apply_batch result dictionary,
+                 or to the list of apply_interest results of a system-wide interest order; an order
+                 that caught up on several periods maps to the result of its last one
+        """
+        with self._run_lock:
+            now = self._clock() if now is None else now
+            catch_up = self.missed_periods == MISSED_CATCH_UP
+            due = []
+            advanced_orders = []
+            with self._lock:
+                while self._heap and self._heap[0][0] <= now:
+                    _, order_id, period = heapq.heappop(self._heap)
+                    order = self._orders.get(order_id)
+                    if order is None or order.period != period:
+                        continue
+                    advanced = order.advance(now, catch_up)
+                    last_period = advanced.period if advanced.max_periods is None \
+                        else min(advanced.period, advanced.max_periods)
+                    if last_period > order.period + 1:
+                        skipped = last_period - order.period - 1
+                        self.skipped += skipped
+                        logger.warning("Scheduled order %s skipped %d missed periods due from %s.",
+                                       order_id, skipped, order.due_time(order.period + 1).isoformat())
+                    if advanced.status == 'active':
+                        self._orders[order_id] = advanced
+                        heapq.heappush(self._heap, (advanced.due_time(), order_id, advanced.period))
+                    else:
+                        del self._orders[order_id]
+                    due.append(order)
+                    advanced_orders.append(advanced)
+                for start in range(0, len(advanced_orders), self.batch_size):
+                    self._journal_orders(advanced_orders[start:start + self.batch_size])
+
+            results = {}
+            chunk = []
+            # Runs in due time order: consecutive account orders are batched, an interest order ends the batch
+            for order in due:
+                if order.account_id is not None:
+                    chunk.append(order)
+                    if len(chunk) < self.batch_size:
+                        continue
+                self._run_chunk(chunk, results)
+                if order.account_id is None:
+                    results[order.order_id] = self._apply_interest(order.amount, order.currency)
+            self._run_chunk(chunk, results)
+            self.executed += len(due)
+            return results
+
+    def _run_chunk(self, chunk, results):
+        if chunk:
+            for order, result in zip(chunk, self._execute_batch([order.operation() for order in chunk])):
+                results[order.order_id] = result
+            chunk.clear()
+
+    def start(self, poll_interval: float = 1.0):
+        """
+        Run due orders from a background thread every poll_interval seconds until stop() is called.
+        """
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run_periodically, args=(poll_interval,),
+                                        name='payment-scheduler', daemon=True)
+        self._thread.start()
+
+    def _run_periodically(self, poll_interval):
+        while not self._stopped.wait(poll_interval):
+            try:
+                self.run_due()
+            except Exception:
+                logger.exception("Scheduled orders failed to run.")
+
+    def stop(self):
+        """
+        Stop the background thread, letting a run in progress finish.
+        """
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
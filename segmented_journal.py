@@ -0,0 +1,504 @@
+import argparse
+import csv
+import os
+import re
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+from io import StringIO
+from transaction_journal import TransactionJournal, TransactionRecord, TRANSACTION_FIELDNAMES, FSYNC_NONE
+from write_ahead_log import repair_torn_tail
+
+# Per-account transaction files, as named by BankAccount._account_transactions_filename
+ACCOUNT_FILE_PATTERN = re.compile(r'^(\d+)_transactions\.csv$')
+# A segment holds the rows first written to segments first..last; compaction merges a range into one file
+SEGMENT_PATTERN = re.compile(r'^segment-(\d+)-(\d+)\.csv$')
+INDEX_MAGIC = b'SGI1'
+# magic, number of segment bytes the index covers; followed by (account_id, offset) int64 pairs
+INDEX_HEADER = struct.Struct('<4sQ')
+# A row position is its segment number and byte offset packed into one int64
+OFFSET_BITS = 40
+OFFSET_MASK = (1 << OFFSET_BITS) - 1
+
+
+def account_id_for(file_path):
+    """
+    Return the account_id of a per-account transaction file path, or None for any other file.
+    """
+    match = ACCOUNT_FILE_PATTERN.match(os.path.basename(file_path))
+    return int(match.group(1)) if match else None
+
+
+def segment_name(first, last):
+    return f"segment-{first:06d}-{last:06d}.csv"
+
+
+def _read_record(handle, offset):
+    """
+    Read the raw bytes of the row starting at offset, including quoted newlines.
+    """
+    handle.seek(offset)
+    record = handle.readline()
+    while record.count(b'"') % 2:
+        line = handle.readline()
+        if not line:
+            break
+        record += line
+    return record
+
+
+def _parse_record(record):
+    """
+    Split a segment row into its account_id and the transaction values, as strings.
+    """
+    row = next(csv.reader(StringIO(record.decode(), newline='')))
+    return int(row[0]), row[1:]
+
+
+def scan_segment(file_path, start=0):
+    """
+    Find the complete rows of a segment file from a byte offset on.
+
+    :return: Tuple of an array of (account_id, offset) pairs and the offset where complete rows end
+    """
+    entries = array('q')
+    offset = start
+    with open(file_path, 'rb') as segment_file:
+        segment_file.seek(start)
+        record = b''
+        for line in segment_file:
+            record += line
+            # A record is complete once its quotes are balanced and it ends with a newline
+            if record.count(b'"') % 2 or not record.endswith(b'\n'):
+                continue
+            # The account_id is a plain integer in the first column
+            entries.extend((int(record[:record.index(b',')]), offset))
+            offset += len(record)
+            record = b''
+    return entries, offset
+
+
+def read_index(index_path):
+    """
+    Read a segment's index sidecar.
+
+    :return: Tuple of the array of (account_id, offset) pairs and the number of segment bytes covered,
+             or None if the sidecar is missing or not a segment index
+    """
+    if not os.path.isfile(index_path):
+        return None
+    with open(index_path, 'rb') as index_file:
+        data = index_file.read()
+    if len(data) < INDEX_HEADER.size:
+        return None
+    magic, covered = INDEX_HEADER.unpack_from(data)
+    if magic != INDEX_MAGIC or (len(data) - INDEX_HEADER.size) % 16:
+        return None
+    entries = array('q')
+    entries.frombytes(data[INDEX_HEADER.size:])
+    return entries, covered
+
+
+def write_index(index_path, entries, covered):
+    """
+    Atomically write a segment's index sidecar.
+    """
+    temp_path = f"{index_path}.tmp"
+    with open(temp_path, 'wb') as index_file:
+        index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, covered))
+        index_file.write(entries.tobytes())
+        index_file.flush()
+        os.fsync(index_file.fileno())
+    os.replace(temp_path, index_path)
+
+
+class _SegmentAccountFile:
+    """
+    The journal handle of one per-account transaction file, whose rows go to the shared active segment.
+    """
+    def __init__(self, journal, account_id):
+        self.journal = journal
+        self.account_id = account_id
+        self.buffered_rows = 0
+
+    def write_rows(self, header, rows):
+        self.journal._write_account_rows(self.account_id, rows)
+
+    def flush(self, fsync=False):
+        written = self.buffered_rows
+        self.journal._flush_segment(fsync)
+        self.buffered_rows = 0
+        return written
+
+    def close(self, fsync=False):
+        self.flush(fsync)
+
+
+class SegmentedTransactionJournal(TransactionJournal):
+    """
+    A storage backend that packs every account's transaction rows into a few append-only segment files.
+
+    Rows of the '{account_id}_transactions.csv' files are appended, prefixed by their
+    account_id, to the active 'segment-{first}-{last}.csv' in segment_dir, which is rolled
+    once it reaches max_segment_bytes. Every account's row positions are kept in memory,
+    so its history is read with one seek per row and its last row with one seek. Each
+    sealed segment has a binary '.idx' sidecar of its (account_id, offset) pairs, so
+    startup only scans the bytes written after the last sidecar. Once compact_threshold
+    sealed segments exist, a background thread merges them into one segment that stores
+    each account's rows together. Every other file, such as system_transactions.csv and
+    system_accounts.csv, stays a plain CSV file. Buffering, flush thresholds and fsync
+    policies are the TransactionJournal's.
+    """
+    csv_storage = False
+
+    def __init__(self, segment_dir: str = 'segments', max_segment_bytes: int = 64 * 1024 * 1024,
+                 compact_threshold: int = 8, **kwargs) -> None:
+        """
+        Initialize the SegmentedTransactionJournal and index the existing segments.
+
+        :param segment_dir: Directory of the segment files (default is 'segments')
+        :param max_segment_bytes: Size at which the active segment is sealed and a new one started (default is 64 MiB)
+        :param compact_threshold: Number of sealed segments that starts a background compaction, None to only
+                                  compact on compact() (default is 8)
+        :param kwargs: TransactionJournal settings
+        :raise ValueError: If max_segment_bytes is not positive
+        """
+        if max_segment_bytes < 1:
+            raise ValueError("max_segment_bytes must be at least 1.")
+        self.segment_dir = segment_dir
+        self.max_segment_bytes = max_segment_bytes
+        self.compact_threshold = compact_threshold
+        os.makedirs(segment_dir, exist_ok=True)
+        self._positions = {}  # account_id -> array of packed row positions, oldest first
+        self._segments = {}  # last segment number -> (first segment number, path)
+        self._readers = {}  # last segment number -> read handle
+        self._compaction_lock = threading.Lock()
+        self._compactor = None
+        self._load_segments()
+        self._open_active_segment()
+        super().__init__(**kwargs)
+
+    def _load_segments(self):
+        found = []
+        for name in os.listdir(self.segment_dir):
+            path = os.path.join(self.segment_dir, name)
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                found.append((int(match.group(1)), int(match.group(2)), path))
+            elif name.endswith('.tmp'):
+                # Left by an interrupted compaction or index write
+                os.remove(path)
+        for first, last, path in found:
+            # A merged segment is only renamed into place after its index, so the segments it covers are obsolete
+            if any(other_first <= first and last <= other_last and (other_first, other_last) != (first, last)
+                   for other_first, other_last, _ in found):
+                self._remove_segment_files(path)
+            else:
+                self._segments[last] = (first, path)
+
+        numbers = sorted(self._segments)
+        for number in numbers:
+            path = self._segments[number][1]
+            if number == numbers[-1]:
+                repair_torn_tail(path)
+            index = read_index(f"{path}.idx")
+            entries, covered = index if index is not None else (array('q'), 0)
+            if os.path.getsize(path) > covered:
+                scanned, covered = scan_segment(path, covered)
+                entries.extend(scanned)
+                if number != numbers[-1]:
+                    write_index(f"{path}.idx", entries, covered)
+            self._add_entries(number, entries)
+            if number == numbers[-1]:
+                self._active_entries = entries
+
+    def _add_entries(self, number, entries):
+        positions = self._positions
+        base = number << OFFSET_BITS
+        for i in range(0, len(entries), 2):
+            account_positions = positions.get(entries[i])
+            if account_positions is None:
+                account_positions = positions[entries[i]] = array('q')
+            account_positions.append(base | entries[i + 1])
+
+    def _open_active_segment(self):
+        numbers = sorted(self._segments)
+        if numbers and os.path.getsize(self._segments[numbers[-1]][1]) < self.max_segment_bytes:
+            self._active = numbers[-1]
+        else:
+            if numbers:
+                # The last segment was full but not yet sealed
+                path = self._segments[numbers[-1]][1]
+                write_index(f"{path}.idx", self._active_entries, os.path.getsize(path))
+            self._active = numbers[-1] + 1 if numbers else 1
+            self._segments[self._active] = (self._active, os.path.join(self.segment_dir,
+                                                                        segment_name(self._active, self._active)))
+            self._active_entries = array('q')
+        self._active_handle = open(self._segments[self._active][1], 'ab')
+        self._active_size = self._active_handle.tell()
+        self._buffer = bytearray()
+        self._encoder = StringIO()
+        self._encoder_writer = csv.writer(self._encoder, lineterminator='\n')
+
+    def _open_file(self, file_path, header):
+        account_id = account_id_for(file_path)
+        if account_id is not None and header == TRANSACTION_FIELDNAMES:
+            return _SegmentAccountFile(self, account_id)
+        return super()._open_file(file_path, header)
+
+    def _write_account_rows(self, account_id, rows):
+        """
+        Encode rows into the active segment's buffer and record their positions. Called with the journal lock held.
+        """
+        positions = self._positions.get(account_id)
+        if positions is None:
+            positions = self._positions[account_id] = array('q')
+        encoder = self._encoder
+        base = self._active << OFFSET_BITS
+        for row in rows:
+            self._encoder_writer.writerow((account_id, *row))
+            offset = self._active_size + len(self._buffer)
+            positions.append(base | offset)
+            self._active_entries.extend((account_id, offset))
+            self._buffer += encoder.getvalue().encode()
+            encoder.seek(0)
+            encoder.truncate()
+
+    def _flush_segment(self, fsync=False):
+        """
+        Write the active segment's buffer, then seal the segment if it is full. Called with the journal lock held.
+        """
+        if not self._buffer:
+            return
+        self._active_handle.write(self._buffer)
+        self._active_size += len(self._buffer)
+        self._buffer = bytearray()
+        self._active_handle.flush()
+        if fsync:
+            os.fsync(self._active_handle.fileno())
+        if self._active_size >= self.max_segment_bytes:
+            self._roll_segment()
+
+    def _roll_segment(self):
+        os.fsync(self._active_handle.fileno())
+        self._active_handle.close()
+        write_index(f"{self._segments[self._active][1]}.idx", self._active_entries, self._active_size)
+        self._active += 1
+        self._segments[self._active] = (self._active, os.path.join(self.segment_dir,
+                                                                    segment_name(self._active, self._active)))
+        self._active_entries = array('q')
+        self._active_handle = open(self._segments[self._active][1], 'ab')
+        self._active_size = 0
+        if (self.compact_threshold and len(self._segments) - 1 >= self.compact_threshold
+                and (self._compactor is None or not self._compactor.is_alive())):
+            self._compactor = threading.Thread(target=self.compact, name='segment-compactor', daemon=True)
+            self._compactor.start()
+
+    def _flush_locked(self):
+        super()._flush_locked()
+        # Rows of account files evicted from the open handles are still in the shared buffer
+        self._flush_segment(self.fsync_policy != FSYNC_NONE)
+
+    def close(self):
+        """
+        Flush buffered rows, wait for a running compaction and index the active segment for the next start.
+        """
+        super().close()
+        compactor = self._compactor
+        if compactor is not None and compactor is not threading.current_thread():
+            compactor.join()
+        with self._lock:
+            if self._active_handle.closed:
+                return
+            self._flush_segment(self.fsync_policy != FSYNC_NONE)
+            self._active_handle.close()
+            write_index(f"{self._segments[self._active][1]}.idx", self._active_entries, self._active_size)
+            for reader in self._readers.values():
+                reader.close()
+            self._readers = {}
+
+    def _reader(self, number):
+        reader = self._readers.get(number)
+        if reader is None:
+            reader = self._readers[number] = open(self._segments[number][1], 'rb')
+        return reader
+
+    def _read_account_rows(self, account_id, last_only=False):
+        """
+        Flush buffered rows, then read an account's rows as lists of strings.
+        """
+        with self._lock:
+            self._flush_locked()
+            positions = self._positions.get(account_id, ())
+            if last_only:
+                positions = positions[-1:]
+            rows = []
+            for position in positions:
+                record = _read_record(self._reader(position >> OFFSET_BITS), position & OFFSET_MASK)
+                rows.append(_parse_record(record)[1])
+            return rows
+
+    def exists(self, file_path):
+        account_id = account_id_for(file_path)
+        if account_id is None:
+            return super().exists(file_path)
+        return account_id in self._positions
+
+    def iter_rows(self, file_path):
+        account_id = account_id_for(file_path)
+        if account_id is None:
+            yield from super().iter_rows(file_path)
+            return
+        for row in self._read_account_rows(account_id):
+            yield dict(zip(TRANSACTION_FIELDNAMES, row))
+
+    def iter_records(self, file_path):
+        account_id = account_id_for(file_path)
+        if account_id is None:
+            yield from super().iter_records(file_path)
+            return
+        for row in self._read_account_rows(account_id):
+            yield TransactionRecord._make(row)
+
+    def read_last_row(self, file_path, columns):
+        account_id = account_id_for(file_path)
+        if account_id is None:
+            return super().read_last_row(file_path, columns)
+        rows = self._read_account_rows(account_id, last_only=True)
+        if not rows:
+            raise ValueError(f"Account {account_id} has no rows in {self.segment_dir}")
+        row = dict(zip(TRANSACTION_FIELDNAMES, rows[0]))
+        try:
+            return [row[column] for column in columns]
+        except KeyError as e:
+            raise ValueError(f"Columns not found for account {account_id}: {set(columns) - set(row)}") from e
+
+    @property
+    def segment_count(self):
+        return len(self._segments)
+
+    def compact(self):
+        """
+        Merge every sealed segment into one segment that stores each account's rows together.
+
+        The sealed segments are read and the merged one written without holding the journal
+        lock; only the switch to the merged segment's positions holds it.
+
+        :return: Number of rows rewritten, 0 if there were fewer than two sealed segments
+        """
+        with self._compaction_lock:
+            with self._lock:
+                sealed = sorted(number for number in self._segments if number != self._active)
+                if len(sealed) < 2:
+                    return 0
+                first, last = self._segments[sealed[0]][0], sealed[-1]
+                sealed_paths = {number: self._segments[number][1] for number in sealed}
+                limit = (last + 1) << OFFSET_BITS
+                # Positions are increasing, so each account's rows in sealed segments are a prefix of its list
+                snapshot = []
+                for account_id, positions in self._positions.items():
+                    count = bisect_left(positions, limit)
+                    if count:
+                        snapshot.append((account_id, positions[:count]))
+            snapshot.sort()
+
+            path = os.path.join(self.segment_dir, segment_name(first, last))
+            entries = array('q')
+            merged = []
+            readers = {}
+            offset = 0
+            try:
+                with open(f"{path}.tmp", 'wb') as merged_file:
+                    for account_id, positions in snapshot:
+                        moved = array('q')
+                        for position in positions:
+                            number = position >> OFFSET_BITS
+                            reader = readers.get(number)
+                            if reader is None:
+                                reader = readers[number] = open(sealed_paths[number], 'rb')
+                            record = _read_record(reader, position & OFFSET_MASK)
+                            moved.append(last << OFFSET_BITS | offset)
+                            entries.extend((account_id, offset))
+                            merged_file.write(record)
+                            offset += len(record)
+                        merged.append((account_id, moved))
+                    merged_file.flush()
+                    os.fsync(merged_file.fileno())
+            finally:
+                for reader in readers.values():
+                    reader.close()
+            # The index lands first: a merged segment in place always has one
+            write_index(f"{path}.idx", entries, offset)
+
+            with self._lock:
+                os.replace(f"{path}.tmp", path)
+                for account_id, moved in merged:
+                    self._positions[account_id] = moved + self._positions[account_id][len(moved):]
+                for number in sealed:
+                    reader = self._readers.pop(number, None)
+                    if reader is not None:
+                        reader.close()
+                    old_path = self._segments.pop(number)[1]
+                    if old_path != path:
+                        self._remove_segment_files(old_path)
+                self._segments[last] = (first, path)
+            return len(entries) // 2
+
+    @staticmethod
+    def _remove_segment_files(path):
+        for file_path in (path, f"{path}.idx"):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+
+def migrate_account_files(journal, directory='.', remove=True):
+    """
+    Move every '{account_id}_transactions.csv' file of a directory into a SegmentedTransactionJournal.
+
+    Each file is flushed to the segments before it is removed, and a file whose account
+    already has rows in the segments is only removed, so an interrupted migration can be run again.
+
+    :param journal: SegmentedTransactionJournal to migrate into
+    :param directory: Directory of the per-account files (default is the current directory)
+    :param remove: Delete each CSV file once its rows are in the segments (default is True)
+    :return: Tuple of the number of migrated files and rows
+    """
+    account_files = sorted((account_id_for(name), name) for name in os.listdir(directory)
+                           if account_id_for(name) is not None)
+    migrated_files = migrated_rows = 0
+    for account_id, name in account_files:
+        path = os.path.join(directory, name)
+        if not journal.exists(name):
+            with open(path, 'r', newline='') as csvfile:
+                reader = csv.reader(csvfile)
+                header = next(reader, None)
+                if header is not None:
+                    positions = [header.index(field) for field in TRANSACTION_FIELDNAMES]
+                    rows = [[row[position] for position in positions] for row in reader if row]
+                    journal.append_many(name, TRANSACTION_FIELDNAMES, rows)
+                    journal.flush()
+                    migrated_files += 1
+                    migrated_rows += len(rows)
+        if remove:
+            os.remove(path)
+    return migrated_files, migrated_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the segmented store of per-account transaction rows.")
+    parser.add_argument('command', choices=['migrate', 'compact'])
+    parser.add_argument('--directory', default='.', help="directory of the {account_id}_transactions.csv files")
+    parser.add_argument('--segment-dir', default='segments', help="directory of the segment files")
+    parser.add_argument('--keep-files', action='store_true', help="keep the per-account CSV files after migrating")
+    args = parser.parse_args()
+
+    segmented_journal = SegmentedTransactionJournal(args.segment_dir, compact_threshold=None, flush_interval=None)
+    try:
+        if args.command == 'migrate':
+            files, rows = migrate_account_files(segmented_journal, args.directory, remove=not args.keep_files)
+            print(f"Migrated {rows} rows from {files} account files to {args.segment_dir}")
+        else:
+            print(f"Compacted {segmented_journal.compact()} rows in {args.segment_dir}")
+    finally:
+        segmented_journal.close()
@@ -0,0 +1,449 @@
+import contextlib
+import csv
+import itertools
+import multiprocessing
+import os
+import tempfile
+import threading
+from datetime import datetime
+from banking_logging import get_logger
+from fx_rates import FXRates
+import money
+
+logger = get_logger(__name__)
+
+DECISION_FIELDNAMES = ['reference_number', 'source_id', 'source_user_name', 'target_id', 'target_user_name', 'amount',
+                       'target_amount', 'debit_transaction_id', 'credit_transaction_id', 'decided_time']
+
+
+def _shard_worker(directory, validation_latency, connection):
+    """
+    Run one shard: a BankingSystem owning its slice of the accounts inside its own directory.
+
+    Commands arrive as (command, args) tuples on the connection and every reply is ('ok', result) or ('error', message).
+    """
+    os.makedirs(directory, exist_ok=True)
+    os.chdir(directory)
+    # Imported here so that a spawned worker does not need the parent's modules
+    from banking_system import BankAccount, BankingSystem
+
+    system = BankingSystem(validation_latency=validation_latency)
+    holds = {}  # reference_number -> (account, units) debited by prepare_debit, not yet journaled
+
+    def handle(command, args):
+        if command == 'create':
+            account_id, user_name, balance, currency, transaction_id, reference_number = args
+            account = BankAccount(account_id, user_name, balance, currency)
+            system.accounts.add(account)
+            system.record_transaction(account, 'create_account', balance, transaction_id, reference_number)
+            return account.balance
+        if command in ('deposit', 'withdraw'):
+            account_id, amount, transaction_id, reference_number = args
+            return system.post_transaction(system.get_account_by_id(account_id), command, amount, transaction_id,
+                                           reference_number).balance
+        if command == 'prepare_debit':
+            reference_number, account_id, amount = args
+            account = system.get_account_by_id(account_id)
+            units = money.to_minor(amount, account.currency, exact=True) if amount > 0 else 0
+            with account._lock:
+                if not 0 < units <= account.balance_units:
+                    raise ValueError("Insufficient funds or invalid transfer amount.")
+                # The funds are held by taking them off the balance until the transfer commits or aborts
+                account.balance_units -= units
+                holds[reference_number] = (account, units)
+            return True
+        if command == 'prepare_credit':
+            account_id, amount = args
+            account = system.get_account_by_id(account_id)
+            # Checked before the decision is logged, as commit_credit must not fail once it is
+            if not money.to_minor(amount, account.currency, exact=True) > 0:
+                raise ValueError("Invalid transfer amount.")
+            return account.user_name
+        if command == 'commit_debit':
+            reference_number, transaction_id, target_id, target_user_name = args
+            account, units = holds.pop(reference_number)
+            system.record_transaction(account, 'transfer_to', money.from_minor(units, account.currency), transaction_id,
+                                      reference_number, BankAccount(target_id, target_user_name))
+            return account.balance
+        if command == 'abort_debit':
+            reference_number, = args
+            hold = holds.pop(reference_number, None)
+            if hold is not None:
+                account, units = hold
+                with account._lock:
+                    account.balance_units += units
+            return True
+        if command == 'commit_credit':
+            account_id, amount, transaction_id, reference_number, source_id, source_user_name = args
+            return system.post_transaction(system.get_account_by_id(account_id), 'receive_from', amount, transaction_id,
+                                           reference_number, BankAccount(source_id, source_user_name)).balance
+        if command == 'has_transaction':
+            transaction_id, = args
+            return bool(system.query_transactions(start_id=transaction_id, end_id=transaction_id))
+        if command == 'balances':
+            return [(account.account_id, account.user_name, account.currency, account.balance)
+                    for account in system.accounts.values()]
+        if command == 'state':
+            return {
+                'accounts': [(account.account_id, account.user_name, account.currency)
+                             for account in system.accounts.values()],
+                'next_transaction_id': system._peek_counter('_transaction_id_counter'),
+                'next_reference_number': system._peek_counter('_reference_number_counter'),
+            }
+        raise ValueError(f"Unknown shard command: {command}")
+
+    try:
+        while True:
+            command, args = connection.recv()
+            if command == 'close':
+                system.close()
+                connection.send(('ok', None))
+                break
+            try:
+                connection.send(('ok', handle(command, args)))
+            except Exception as e:
+                connection.send(('error', f"{type(e).__name__}: {e}"))
+    finally:
+        connection.close()
+
+
+class ShardError(RuntimeError):
+    """
+    Raised when a shard fails a command for a reason other than an invalid request.
+    """
+
+
+class ShardedBankingSystem:
+    """
+    A banking engine that partitions accounts by account_id across worker processes.
+
+    Each shard is a BankingSystem running in its own process and directory
+    (shard_0, shard_1, ...), owning its accounts and their CSV files. The router
+    in the calling process keeps the username directory and allocates the global
+    account, transaction and reference ids, then dispatches each operation to the
+    owning shard. Transfers between shards use two-phase commit: the source shard
+    holds the funds, the target shard confirms the account and the amount converted
+    to its currency, the decision is logged by the router, and both shards then
+    write their 'transfer_to' / 'receive_from' rows with the shared reference_number.
+    Each shard is held from the allocation of an operation's ids until its rows are
+    written, so every shard journals its transaction ids in increasing order.
+    """
+    def __init__(self, shard_count: int = 4, base_dir: str = '.', validation_latency: float = 0.1,
+                 start_method: str = None, fx_rates=None) -> None:
+        """
+        Initialize the ShardedBankingSystem and start the shard processes.
+
+        :param shard_count: Number of shard processes (default is 4)
+        :param base_dir: Directory holding the shard directories and the router's decision log (default is '.')
+        :param validation_latency: Simulated validation latency of every shard in seconds (default is 0.1)
+        :param start_method: multiprocessing start method, None for the platform default
+        :param fx_rates: FXRates used to convert cross-currency transfers
+                         (default is FXRates reading 'fx_rates.csv' in base_dir)
+        """
+        if shard_count < 1:
+            raise ValueError("shard_count must be at least 1.")
+        self.shard_count = shard_count
+        self.base_dir = os.path.abspath(base_dir)
+        self.fx_rates = fx_rates if fx_rates is not None else FXRates(os.path.join(self.base_dir, 'fx_rates.csv'))
+        self._decision_log_filename = os.path.join(self.base_dir, 'shard_transfer_decisions.csv')
+        # Number of leading decisions whose legs are known to be on both shards
+        self._decision_mark_filename = os.path.join(self.base_dir, 'shard_transfer_decisions.mark')
+        context = multiprocessing.get_context(start_method)
+
+        self._connections = []
+        self._processes = []
+        self._shard_locks = []
+        for shard_index in range(shard_count):
+            parent_connection, child_connection = context.Pipe()
+            process = context.Process(target=_shard_worker, name=f'shard-{shard_index}', daemon=True,
+                                      args=(os.path.join(self.base_dir, f'shard_{shard_index}'), validation_latency,
+                                            child_connection))
+            process.start()
+            child_connection.close()
+            self._connections.append(parent_connection)
+            self._processes.append(process)
+            # Reentrant, so an operation holding its shard can still send commands through _call
+            self._shard_locks.append(threading.RLock())
+
+        self._id_lock = threading.Lock()
+        self._account_ids = {}  # user_name -> account_id
+        self._currencies = {}  # account_id -> currency
+        self._load_directory()
+        self.recover()
+        logger.info("Sharded banking system is running now.")
+
+    def _load_directory(self):
+        """
+        Rebuild the username directory and the global counters from the shards' own state.
+        """
+        next_account_id = next_transaction_id = next_reference_number = 1
+        for shard_index in range(self.shard_count):
+            state = self._call(shard_index, 'state')
+            for account_id, user_name, currency in state['accounts']:
+                self._account_ids[user_name] = account_id
+                self._currencies[account_id] = currency
+                next_account_id = max(next_account_id, account_id + 1)
+            next_transaction_id = max(next_transaction_id, state['next_transaction_id'])
+            next_reference_number = max(next_reference_number, state['next_reference_number'])
+        for decision in self._read_decisions():
+            next_transaction_id = max(next_transaction_id, decision['credit_transaction_id'] + 1)
+            next_reference_number = max(next_reference_number, decision['reference_number'] + 1)
+        self._account_id_counter = itertools.count(next_account_id)
+        self._transaction_id_counter = itertools.count(next_transaction_id)
+        self._reference_number_counter = itertools.count(next_reference_number)
+
+    def shard_for(self, account_id: int):
+        """
+        Return the index of the shard owning an account.
+        """
+        return account_id % self.shard_count
+
+    def _call(self, shard_index, command, *args):
+        with self._shard_locks[shard_index]:
+            connection = self._connections[shard_index]
+            connection.send((command, args))
+            status, result = connection.recv()
+        if status == 'error':
+            if result.startswith('ValueError: '):
+                raise ValueError(result[len('ValueError: '):])
+            raise ShardError(f"Shard {shard_index} failed '{command}': {result}")
+        return result
+
+    def _resolve(self, user_name):
+        account_id = self._account_ids.get(user_name)
+        if account_id is None:
+            raise ValueError(f"No account found with user_name: {user_name}")
+        return account_id
+
+    def _allocate(self, transaction_count):
+        with self._id_lock:
+            transaction_ids = [next(self._transaction_id_counter) for _ in range(transaction_count)]
+            return transaction_ids, next(self._reference_number_counter)
+
+    def create_account(self, user_name, starting_balance=0.0, currency='HKD'):
+        """
+        Create a new account on the shard that owns its account_id.
+
+        :param user_name: Name of the account holder
+        :param starting_balance: Initial balance of the account (default is 0.0)
+        :param currency: Currency type of the account (default is 'HKD')
+        :return: The new account_id, or None if the username already exists
+        """
+        with self._id_lock:
+            if user_name in self._account_ids:
+                logger.warning("Account with username '%s' already exists. Skipping creation.", user_name)
+                return None
+            account_id = next(self._account_id_counter)
+            self._account_ids[user_name] = account_id
+            self._currencies[account_id] = currency
+        shard_index = self.shard_for(account_id)
+        with self._shard_locks[shard_index]:
+            (transaction_id,), reference_number = self._allocate(1)
+            self._call(shard_index, 'create', account_id, user_name, starting_balance, currency,
+                       transaction_id, reference_number)
+        return account_id
+
+    def deposit(self, user_name, amount):
+        """
+        Deposit into an account on its shard.
+
+        :return: The balance after the deposit
+        :raise ValueError: If the deposit amount is not positive or the account does not exist
+        """
+        if not amount > 0:
+            raise ValueError("Deposit amount must be positive.")
+        account_id = self._resolve(user_name)
+        shard_index = self.shard_for(account_id)
+        with self._shard_locks[shard_index]:
+            (transaction_id,), reference_number = self._allocate(1)
+            return self._call(shard_index, 'deposit', account_id, amount, transaction_id, reference_number)
+
+    def withdraw(self, user_name, amount):
+        """
+        Withdraw from an account on its shard.
+
+        :return: The balance after the withdrawal
+        :raise ValueError: If the amount is invalid or exceeds the balance
+        """
+        account_id = self._resolve(user_name)
+        shard_index = self.shard_for(account_id)
+        with self._shard_locks[shard_index]:
+            (transaction_id,), reference_number = self._allocate(1)
+            return self._call(shard_index, 'withdraw', account_id, amount, transaction_id, reference_number)
+
+    def transfer(self, user_name, target_user_name, amount):
+        """
+        Transfer between two accounts with two-phase commit across their shards.
+
+        The target is credited in its own currency, converted with fx_rates.
+
+        :return: The reference_number shared by the 'transfer_to' and 'receive_from' rows
+        :raise ValueError: If the amount is invalid, exceeds the balance, an account does not exist
+                           or no FX rate is available
+        """
+        source_id = self._resolve(user_name)
+        target_id = self._resolve(target_user_name)
+        if source_id == target_id:
+            raise ValueError("Cannot transfer to the same account.")
+        source_currency = self._currencies[source_id]
+        target_currency = self._currencies[target_id]
+        units = money.to_minor(amount, source_currency, exact=True) if amount > 0 else 0
+        target_units = self.fx_rates.convert_units(units, source_currency, target_currency)
+        if units and not target_units:
+            raise ValueError(f"Transfer amount is too small to convert to {target_currency}.")
+        target_amount = amount if target_currency == source_currency else money.from_minor(target_units, target_currency)
+        source_shard = self.shard_for(source_id)
+        target_shard = self.shard_for(target_id)
+
+        with contextlib.ExitStack() as stack:
+            for shard_index in sorted({source_shard, target_shard}):
+                stack.enter_context(self._shard_locks[shard_index])
+            (debit_transaction_id, credit_transaction_id), reference_number = self._allocate(2)
+
+            # Phase 1: hold the funds on the source shard and check the target account and amount on its shard
+            self._call(source_shard, 'prepare_debit', reference_number, source_id, amount)
+            try:
+                self._call(target_shard, 'prepare_credit', target_id, target_amount)
+            except BaseException:
+                self._call(source_shard, 'abort_debit', reference_number)
+                raise
+
+            # The logged decision lets recover() finish the transfer if a commit below does not complete
+            decision = {
+                'reference_number': reference_number, 'source_id': source_id, 'source_user_name': user_name,
+                'target_id': target_id, 'target_user_name': target_user_name, 'amount': amount,
+                'target_amount': target_amount, 'debit_transaction_id': debit_transaction_id,
+                'credit_transaction_id': credit_transaction_id,
+            }
+            self._log_decision(decision)
+
+            # Phase 2: both shards write their leg with the shared reference_number
+            self._call(source_shard, 'commit_debit', reference_number, debit_transaction_id, target_id, target_user_name)
+            self._call(target_shard, 'commit_credit', target_id, target_amount, credit_transaction_id, reference_number,
+                       source_id, user_name)
+        return reference_number
+
+    def _log_decision(self, decision):
+        file_exists = os.path.isfile(self._decision_log_filename)
+        with open(self._decision_log_filename, 'a', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=DECISION_FIELDNAMES)
+            if not file_exists:
+                writer.writeheader()
+            writer.writerow({**decision, 'decided_time': datetime.now().isoformat()})
+            csvfile.flush()
+            os.fsync(csvfile.fileno())
+
+    def _read_decisions(self):
+        if not os.path.isfile(self._decision_log_filename):
+            return []
+        decisions = []
+        with open(self._decision_log_filename, 'r', newline='') as csvfile:
+            for row in csv.DictReader(csvfile):
+                for key in ('reference_number', 'source_id', 'target_id', 'debit_transaction_id', 'credit_transaction_id'):
+                    row[key] = int(row[key])
+                row['amount'] = float(row['amount'])
+                # A decision logged without a target amount credits the amount unconverted
+                row['target_amount'] = float(row['target_amount']) if row.get('target_amount') else row['amount']
+                decisions.append(row)
+        return decisions
+
+    def _read_decision_mark(self):
+        if not os.path.isfile(self._decision_mark_filename):
+            return 0
+        with open(self._decision_mark_filename, 'r') as mark_file:
+            return int(mark_file.read().strip() or 0)
+
+    def _write_decision_mark(self, mark):
+        fd, temp_path = tempfile.mkstemp(prefix='.decisions-', suffix='.tmp', dir=self.base_dir)
+        try:
+            with os.fdopen(fd, 'w') as mark_file:
+                mark_file.write(str(mark))
+                mark_file.flush()
+                os.fsync(mark_file.fileno())
+            os.replace(temp_path, self._decision_mark_filename)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def recover(self):
+        """
+        Finish committed cross-shard transfers whose rows did not reach both shards, for example after a crash.
+
+        A debit leg that is missing was never journaled, so its shard still holds the
+        full balance and the leg is written again from the decision log. Every decision
+        after the persisted low-water mark is checked, however old, and the mark then
+        moves up to the first transfer that could not be finished, so a later run only
+        checks the decisions logged since and the ones still in doubt.
+
+        :return: Number of legs written again
+        """
+        repaired = 0
+        decisions = self._read_decisions()
+        mark = self._read_decision_mark()
+        new_mark = None
+        for position in range(mark, len(decisions)):
+            decision = decisions[position]
+            source_shard = self.shard_for(decision['source_id'])
+            target_shard = self.shard_for(decision['target_id'])
+            reference_number = decision['reference_number']
+            if not self._call(source_shard, 'has_transaction', decision['debit_transaction_id']):
+                try:
+                    self._call(source_shard, 'prepare_debit', reference_number, decision['source_id'], decision['amount'])
+                except ValueError as e:
+                    logger.warning("Cannot finish transfer with reference no. %s: %s", reference_number, e)
+                    if new_mark is None:
+                        new_mark = position
+                    continue
+                self._call(source_shard, 'commit_debit', reference_number, decision['debit_transaction_id'],
+                           decision['target_id'], decision['target_user_name'])
+                repaired += 1
+            if not self._call(target_shard, 'has_transaction', decision['credit_transaction_id']):
+                self._call(target_shard, 'commit_credit', decision['target_id'], decision['target_amount'],
+                           decision['credit_transaction_id'], reference_number, decision['source_id'],
+                           decision['source_user_name'])
+                repaired += 1
+        new_mark = len(decisions) if new_mark is None else new_mark
+        if new_mark != mark:
+            self._write_decision_mark(new_mark)
+        return repaired
+
+    def get_balance(self, user_name):
+        account_id = self._resolve(user_name)
+        for balance_account_id, _, _, balance in self._call(self.shard_for(account_id), 'balances'):
+            if balance_account_id == account_id:
+                return balance
+        raise ValueError(f"No account found with user_name: {user_name}")
+
+    def get_balances(self):
+        """
+        Return every account's balance, gathered from all shards.
+
+        :return: List of (account_id, user_name, currency, balance) sorted by account_id
+        """
+        balances = []
+        for shard_index in range(self.shard_count):
+            balances.extend(self._call(shard_index, 'balances'))
+        return sorted(balances)
+
+    def get_total_accounts(self):
+        return len(self._account_ids)
+
+    def get_total_balance(self):
+        return sum(balance for _, _, _, balance in self.get_balances())
+
+    def close(self):
+        """
+        Close every shard's BankingSystem and stop the shard processes.
+        """
+        for shard_index, process in enumerate(self._processes):
+            if process.is_alive():
+                try:
+                    self._call(shard_index, 'close')
+                except (EOFError, OSError):
+                    pass
+            process.join()
+            self._connections[shard_index].close()
+        self._processes = []
+        self._connections = []
+
@@ -1,48 +1,169 @@
 import csv
+import mmap
+import os
 from io import StringIO
 import time
+from banking_logging import get_logger
 #from collections import deque
 
+logger = get_logger(__name__)
+
 def timer(func):
     def wrapper(*args, **kwargs):
         start_time = time.time()
         result = func(*args, **kwargs)
         end_time = time.time()
-        print(f"Function '{func.__name__}' executed in {end_time - start_time:.6f} seconds.")
+        logger.debug("Function '%s' executed in %.6f seconds.", func.__name__, end_time - start_time)
         return result
     return wrapper
 
+def iter_tail_rows(file_path, max_rows=None):
+    """
+    Yield data rows of a CSV file, newest first, reading backwards from the end.
+
+    Rows are single lines, as the journal writes them. A partially written last line is skipped.
+
+    :param file_path: Path of the CSV file
+    :param max_rows: Maximum number of rows yielded, None for every row (default is None)
+    :return: Generator yielding rows as lists of strings
+    """
+    if (max_rows is not None and max_rows <= 0) or not os.path.isfile(file_path) or os.path.getsize(file_path) == 0:
+        return
+    with open(file_path, 'rb') as csv_file, mmap.mmap(csv_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        header_end = mapped.find(b'\n') + 1
+        if header_end == 0:
+            return
+        end = mapped.rfind(b'\n') + 1
+        yielded = 0
+        while end > header_end and (max_rows is None or yielded < max_rows):
+            start = mapped.rfind(b'\n', header_end, end - 1) + 1 or header_end
+            row = next(csv.reader([mapped[start:end].decode()]), None)
+            if row:
+                yield row
+                yielded += 1
+            end = start
+
 class CSVLastRowExtractor:
     """
-    A class to extract the last row from a CSV file using a byte-level method.
+    A class to extract the last row from a CSV file using a memory-mapped byte-level method.
     
     Methods
     -------
     get_last_line(file_path)
-        Reads the last line of the file using byte operations.
+        Reads the last record of the file by scanning backwards for a newline.
+    
+    read_header_and_last_row(file_path)
+        Reads the header and the last row from a single memory map of the file.
     
     extract_last_rows(file_path, columns)
         Extracts the last row's values for the specified columns.
+    
+    extract_last_rows_many(file_paths, columns)
+        Extracts the last row's values for the specified columns of several files.
     """
+    # Parsed headers keyed by the raw header line, shared by every file with the same schema
+    _header_cache = {}
+    # Column positions keyed by the raw header line and the requested columns
+    _indices_cache = {}
+
     @classmethod
-    @timer
     def get_last_line(cls, file_path):
         """
-        Reads the last line of a file by seeking to the end and moving backwards.
+        Reads the last record of a file, without its line ending, by scanning backwards from the end.
         """
         with open(file_path, 'rb') as f:
-            f.seek(0, 2)  # Move to the end of the file
-            filesize = f.tell()
-            offset = -100  # Start reading from the last 100 bytes
-            while True:
-                if filesize + offset > 0:
-                    f.seek(offset, 2)
-                    lines = f.readlines()
-                    if len(lines) >= 2:  # Ensure we have a complete last line
-                        # print(f"need offset: {offset}")
-                        # print(f"line: {lines[-1].decode().strip()}")
-                        return lines[-1].decode().strip()
-                offset *= 2  # Increase offset if the last line is not foundss
+            if os.fstat(f.fileno()).st_size == 0:
+                return ''
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[cls._last_record_start(mapped, 0):cls._content_end(mapped)].decode()
+
+    @staticmethod
+    def _content_end(mapped):
+        """
+        Returns the position after the last non-newline byte.
+        """
+        end = len(mapped)
+        while end and mapped[end - 1] in b'\r\n':
+            end -= 1
+        return end
+
+    @classmethod
+    def _last_record_start(cls, mapped, lower_bound):
+        """
+        Returns the start position of the last record, at or after lower_bound.
+
+        A newline inside a quoted field leaves an odd number of quotes after it,
+        so the scan keeps moving backwards until the quotes after the newline balance.
+        """
+        end = cls._content_end(mapped)
+        quotes = 0
+        position = end
+        while True:
+            newline = mapped.rfind(b'\n', lower_bound, position)
+            start = newline + 1 if newline >= 0 else lower_bound
+            quotes += mapped[start:position].count(b'"')
+            if quotes % 2 == 0 or newline < 0:
+                return start
+            position = newline
+
+    @classmethod
+    def _parse_header(cls, header_line):
+        header = cls._header_cache.get(header_line)
+        if header is None:
+            header = next(csv.reader(StringIO(header_line.decode())), None)
+            cls._header_cache[header_line] = header
+        return header
+
+    @classmethod
+    def _read_raw(cls, file_path):
+        """
+        Memory-maps a CSV file and returns its raw header line and the decoded text of its last record.
+        """
+        with open(file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError(f"File {file_path} is empty or has no header")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                header_end = mapped.find(b'\n') + 1 or len(mapped)
+                header_line = mapped[:header_end]
+                if not header_line.strip():
+                    raise ValueError(f"File {file_path} is empty or has no header")
+                end = cls._content_end(mapped)
+                if end <= header_end:
+                    raise ValueError(f"File {file_path} has no data rows")
+                last_record = mapped[cls._last_record_start(mapped, header_end):end].decode()
+        return header_line, last_record
+
+    @classmethod
+    def read_header_and_last_row(cls, file_path):
+        """
+        Reads the header and the last row of a CSV file from a single memory map.
+        
+        Parameters
+        ----------
+        file_path : str
+            The path to the CSV file.
+            
+        Returns
+        -------
+        tuple
+            The header as a list of column names and the last row as a list of values.
+        """
+        header_line, last_record = cls._read_raw(file_path)
+        # Parse the last record as CSV, quoted fields may span several lines
+        return cls._parse_header(header_line), next(csv.reader(StringIO(last_record, newline='')))
+
+    @classmethod
+    def _column_indices(cls, file_path, header_line, columns):
+        key = (header_line, tuple(columns))
+        indices = cls._indices_cache.get(key)
+        if indices is None:
+            header = cls._parse_header(header_line)
+            missing = set(columns) - set(header)
+            if missing:
+                raise ValueError(f"Columns not found in CSV {file_path}: {missing}")
+            indices = [header.index(column) for column in columns]
+            cls._indices_cache[key] = indices
+        return indices
 
     @classmethod
     def extract_last_rows(cls, file_path, columns):
@@ -64,28 +185,52 @@ class CSVLastRowExtractor:
         if not columns or not isinstance(columns, list):
             raise ValueError("Columns must be a non-empty list.")
         
-        # Get header
-        with open(file_path, 'r') as file:
-            reader = csv.reader(file)
-            header = next(reader, None)
-            if header is None:
-                raise ValueError(f"File {file_path} is empty or has no header")
+        header_line, last_record = cls._read_raw(file_path)
+        indices = cls._column_indices(file_path, header_line, columns)
+        last_row = next(csv.reader(StringIO(last_record, newline='')))
+        try:
+            return [last_row[index] for index in indices]
+        except IndexError as e:
+            raise ValueError(f"Last row of CSV {file_path} is shorter than its header") from e
+
+    @classmethod
+    def extract_last_rows_many(cls, file_paths, columns):
+        """
+        Extracts the last row's values for the specified columns of several CSV files.
         
-        # Get last line
-        last_line = cls.get_last_line(file_path)
-        if not last_line:
-            raise ValueError(f"File {file_path} has no data rows")
+        Parameters
+        ----------
+        file_paths : iterable
+            The paths to the CSV files.
+        columns : list
+            A list of column names to extract from each last row.
+            
+        Returns
+        -------
+        list
+            A list with one list of values per file, in the order of file_paths.
+        """
+        if not columns or not isinstance(columns, list):
+            raise ValueError("Columns must be a non-empty list.")
         
-        # Parse last line as CSV
-        reader = csv.reader(StringIO(last_line))
-        last_row = next(reader)
+        file_paths = list(file_paths)
+        results = []
+        last_lines = []
+        for file_path in file_paths:
+            header_line, last_record = cls._read_raw(file_path)
+            results.append(cls._column_indices(file_path, header_line, columns))
+            last_lines.append(last_record)
         
-        try:
-            indices = [header.index(column) for column in columns]
-            return [last_row[index] for index in indices]
-        except ValueError as e:
-            missing = set(columns) - set(header)
-            raise ValueError(f"Columns not found in CSV {file_path}: {missing}") from e
+        # Single-line records, the usual case, are parsed by one csv.reader pass
+        if not any('\n' in line or '\r' in line for line in last_lines):
+            rows = csv.reader(last_lines)
+        else:
+            rows = (next(csv.reader(StringIO(line, newline=''))) for line in last_lines)
+        for position, (indices, last_row) in enumerate(zip(results, rows)):
+            if len(last_row) <= max(indices):
+                raise ValueError(f"Last row of CSV {file_paths[position]} is shorter than its header")
+            results[position] = [last_row[index] for index in indices]
+        return results
             
     # below is CSV Reader with Deque with Time complexity O(n), space complexity O(1)
     # Time complexity O(n) 
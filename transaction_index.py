@@ -0,0 +1,228 @@
+import csv
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from io import StringIO
+
+INDEX_FIELDNAMES = ['transaction_id', 'timestamp_end', 'reference_number', 'offset', 'length']
+
+
+class TransactionIndex:
+    """
+    A sidecar index mapping transaction_id, timestamp_end and reference_number to byte offsets in a transaction CSV file.
+
+    The index is kept in '{file_path}.idx' and caught up incrementally: refresh() only
+    scans the bytes appended to the CSV file since the last refresh. Rows are appended
+    in transaction_id order and timestamp_end is set at commit, so both columns are
+    sorted and queries use binary search, then seek straight to the matching rows.
+    """
+    def __init__(self, file_path: str, index_path: str = None) -> None:
+        """
+        Initialize the TransactionIndex.
+
+        :param file_path: Path of the transaction CSV file
+        :param index_path: Path of the sidecar index file (default is '{file_path}.idx')
+        """
+        self.file_path = file_path
+        self.index_path = index_path if index_path is not None else f"{file_path}.idx"
+        self._reset()
+        self._loaded = False
+
+    def _reset(self):
+        self.transaction_ids = array('q')
+        self.timestamps = []
+        self.reference_numbers = []
+        self.offsets = array('q')
+        self.lengths = array('q')
+        self._references = {}
+        self._header = None
+        self.indexed_size = 0
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _add_entry(self, transaction_id, timestamp_end, reference_number, offset, length):
+        position = len(self.offsets)
+        self.transaction_ids.append(transaction_id)
+        self.timestamps.append(timestamp_end)
+        self.reference_numbers.append(reference_number)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+        if reference_number:
+            self._references.setdefault(reference_number, []).append(position)
+        self.indexed_size = offset + length
+
+    def _load_sidecar(self):
+        """
+        Load the sidecar index, discarding it if it no longer matches the CSV file.
+        """
+        self._loaded = True
+        if not os.path.isfile(self.index_path):
+            return
+        with open(self.index_path, 'rb') as index_file:
+            data = index_file.read()
+        # A torn last line from an interrupted refresh is dropped and its rows are indexed again
+        complete = data[:data.rfind(b'\n') + 1]
+        rows = list(csv.reader(StringIO(complete.decode(), newline='')))
+        if not rows or rows[0] != INDEX_FIELDNAMES:
+            self._rewrite_sidecar()
+            return
+        for transaction_id, timestamp_end, reference_number, offset, length in rows[1:]:
+            self._add_entry(int(transaction_id), timestamp_end, reference_number, int(offset), int(length))
+
+        file_size = os.path.getsize(self.file_path) if os.path.isfile(self.file_path) else 0
+        if file_size < self.indexed_size:
+            # The CSV file was truncated or replaced, so the index is rebuilt from scratch
+            self._reset()
+            self._rewrite_sidecar()
+        elif len(complete) != len(data):
+            self._rewrite_sidecar()
+
+    def _rewrite_sidecar(self):
+        with open(self.index_path, 'w', newline='') as index_file:
+            writer = csv.writer(index_file)
+            writer.writerow(INDEX_FIELDNAMES)
+            for position in range(len(self.offsets)):
+                writer.writerow(self._sidecar_row(position))
+
+    def _sidecar_row(self, position):
+        return [self.transaction_ids[position], self.timestamps[position], self.reference_numbers[position],
+                self.offsets[position], self.lengths[position]]
+
+    def refresh(self):
+        """
+        Index the rows appended to the CSV file since the last refresh.
+
+        :return: Number of newly indexed rows
+        """
+        if not self._loaded:
+            self._load_sidecar()
+        if not os.path.isfile(self.file_path):
+            return 0
+        file_size = os.path.getsize(self.file_path)
+        if file_size < self.indexed_size:
+            self._reset()
+            self._rewrite_sidecar()
+        if file_size == self.indexed_size:
+            return 0
+
+        new_entries = []
+        with open(self.file_path, 'rb') as data_file:
+            header_line = data_file.readline()
+            self._header = next(csv.reader([header_line.decode()]))
+            columns = {column: position for position, column in enumerate(self._header)}
+            id_column = columns['transaction_id']
+            timestamp_column = columns['timestamp_end']
+            reference_column = columns['reference_number']
+
+            offset = max(self.indexed_size, len(header_line))
+            data_file.seek(offset)
+            record = b''
+            record_offset = offset
+            for line in data_file:
+                record += line
+                # A record is complete once its quotes are balanced and it ends with a newline
+                if record.count(b'"') % 2 or not record.endswith(b'\n'):
+                    continue
+                row = next(csv.reader(StringIO(record.decode(), newline='')), None)
+                if row:
+                    new_entries.append((int(row[id_column]), row[timestamp_column], row[reference_column],
+                                        record_offset, len(record)))
+                else:
+                    # A blank line still moves the indexed position forward
+                    self.indexed_size = record_offset + len(record)
+                record_offset += len(record)
+                record = b''
+
+        if not new_entries:
+            return 0
+        sidecar_exists = os.path.isfile(self.index_path)
+        with open(self.index_path, 'a', newline='') as index_file:
+            writer = csv.writer(index_file)
+            if not sidecar_exists:
+                writer.writerow(INDEX_FIELDNAMES)
+            for entry in new_entries:
+                self._add_entry(*entry)
+                writer.writerow(entry)
+        return len(new_entries)
+
+    def _read_rows(self, start, stop):
+        """
+        Read the rows at index positions start to stop (exclusive) with one seek and one read.
+        """
+        if start >= stop:
+            return []
+        with open(self.file_path, 'rb') as data_file:
+            if self._header is None:
+                self._header = next(csv.reader([data_file.readline().decode()]))
+            begin = self.offsets[start]
+            data_file.seek(begin)
+            data = data_file.read(self.offsets[stop - 1] + self.lengths[stop - 1] - begin)
+        header = self._header
+        return [dict(zip(header, row)) for row in csv.reader(StringIO(data.decode(), newline='')) if row]
+
+    def _read_positions(self, positions):
+        return [self._read_rows(position, position + 1)[0] for position in positions]
+
+    def query(self, start_id: int = None, end_id: int = None, since: str = None, until: str = None,
+              reverse: bool = False, limit: int = None):
+        """
+        Return the rows matching an inclusive transaction_id range and an inclusive timestamp_end range.
+
+        Seek-based pagination: pass the last transaction_id of a page, plus or minus one,
+        as start_id (or as end_id with reverse=True) to get the next page.
+
+        :param start_id: Smallest transaction_id to return (default is no lower bound)
+        :param end_id: Largest transaction_id to return (default is no upper bound)
+        :param since: Earliest ISO timestamp_end to return (default is no lower bound)
+        :param until: Latest ISO timestamp_end to return (default is no upper bound)
+        :param reverse: Return the newest rows first (default is False)
+        :param limit: Maximum number of rows to return (default is no limit)
+        :return: List of dictionaries containing transaction details
+        """
+        self.refresh()
+        lo, hi = 0, len(self.offsets)
+        if start_id is not None:
+            lo = max(lo, bisect_left(self.transaction_ids, start_id))
+        if end_id is not None:
+            hi = min(hi, bisect_right(self.transaction_ids, end_id))
+        if since is not None:
+            lo = max(lo, bisect_left(self.timestamps, since))
+        if until is not None:
+            hi = min(hi, bisect_right(self.timestamps, until))
+        if limit is not None and hi - lo > limit:
+            if reverse:
+                lo = hi - limit
+            else:
+                hi = lo + limit
+        rows = self._read_rows(lo, hi)
+        if reverse:
+            rows.reverse()
+        return rows
+
+    def find_by_reference(self, reference_number):
+        """
+        Return the rows with a reference number.
+
+        :param reference_number: Reference number of the transaction
+        :return: List of dictionaries containing transaction details
+        """
+        self.refresh()
+        return self._read_positions(self._references.get(str(reference_number), []))
+
+    def iter_rows(self, reverse: bool = False, page_size: int = 256):
+        """
+        Iterate over every row, reading page_size rows per seek.
+
+        :param reverse: Yield the newest rows first (default is False)
+        :param page_size: Number of rows read at once (default is 256)
+        :return: Generator yielding dictionaries containing transaction details
+        """
+        self.refresh()
+        total = len(self.offsets)
+        if reverse:
+            for stop in range(total, 0, -page_size):
+                yield from reversed(self._read_rows(max(0, stop - page_size), stop))
+        else:
+            for start in range(0, total, page_size):
+                yield from self._read_rows(start, min(total, start + page_size))
@@ -0,0 +1,329 @@
+import csv
+import os
+import threading
+import time
+from collections import OrderedDict
+from io import StringIO
+from typing import NamedTuple, Optional, Union
+from system_reader import CSVLastRowExtractor, iter_tail_rows
+
+
+class TransactionRecord(NamedTuple):
+    """
+    One transaction, as an immutable tuple in journal column order.
+
+    A tuple takes a fraction of the memory of the equivalent 14-key dict and is
+    written to the journal as is. Fields can also be read by name with
+    record['balance'], like the dictionaries transactions used to be. Records
+    read back from the journal hold the column values as strings.
+    """
+    transaction_id: Union[int, str]
+    timestamp_start: str
+    account_id: Union[int, str]
+    user_name: str
+    type: str
+    amount: Union[float, str]
+    currency: str
+    balance: Union[float, str]
+    target_id: Optional[Union[int, str]] = None
+    target_user_name: Optional[str] = None
+    reference_number: Optional[Union[int, str]] = None
+    timestamp_end: Optional[str] = None
+    status: Optional[str] = None
+    remarks: Optional[str] = None
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        return tuple.__getitem__(self, key)
+
+
+TRANSACTION_FIELDNAMES = list(TransactionRecord._fields)
+
+ACCOUNT_PROFILE_FIELDNAMES = ['account_id', 'user_name', 'account_created_time']
+
+FSYNC_NONE = 'none'
+FSYNC_BATCH = 'batch'
+FSYNC_TRANSACTION = 'transaction'
+FSYNC_POLICIES = (FSYNC_NONE, FSYNC_BATCH, FSYNC_TRANSACTION)
+
+
+class _JournalFile:
+    """
+    A long-lived append handle for one journal target plus its in-memory row buffer.
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.handle = open(file_path, 'a', newline='')
+        # In append mode the position starts at the end, so 0 means a new or empty file
+        self.needs_header = self.handle.tell() == 0
+        self.buffer = StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.buffered_rows = 0
+
+    def write_rows(self, header, rows):
+        if self.needs_header:
+            self.writer.writerow(header)
+            self.needs_header = False
+        self.writer.writerows(rows)
+
+    def flush(self, fsync=False):
+        """
+        Write the buffered rows to the file handle and return how many rows were written.
+        """
+        written = self.buffered_rows
+        data = self.buffer.getvalue()
+        if data:
+            self.handle.write(data)
+            self.buffer.seek(0)
+            self.buffer.truncate()
+            self.buffered_rows = 0
+        self.handle.flush()
+        if fsync:
+            os.fsync(self.handle.fileno())
+        return written
+
+    def close(self, fsync=False):
+        self.flush(fsync)
+        self.handle.close()
+
+
+class TransactionJournal:
+    """
+    A buffered, group-committed CSV journal writer.
+
+    Keeps one long-lived append handle per target file and batches rows in memory.
+    Buffered rows are written out when the size threshold or the time threshold is
+    reached at a commit, or on an explicit flush() / close(). The on-disk format is
+    the same plain CSV that CSVLastRowExtractor and csv.DictReader read back.
+
+    This class is also the CSV storage backend of BankingSystem: exists(), iter_rows()
+    and read_last_row() read the files back, and other on-disk formats subclass it.
+
+    Fsync policies:
+        'none'        - rely on the OS page cache (default)
+        'batch'       - fsync every file touched by a flush
+        'transaction' - flush and fsync at every commit()
+    """
+    # Plain CSV files, which the sidecar indexes, checkpoint replay and process-pool loading read directly
+    csv_storage = True
+
+    def __init__(self, max_buffered_rows: int = 512, flush_interval: float = 1.0,
+                 fsync_policy: str = FSYNC_NONE, max_open_files: int = 256) -> None:
+        """
+        Initialize the TransactionJournal.
+
+        :param max_buffered_rows: Number of buffered rows that triggers a flush at the next commit
+        :param flush_interval: Maximum age in seconds of buffered rows before they are flushed,
+                               None disables the time threshold and the background flusher
+        :param fsync_policy: One of 'none', 'batch' or 'transaction'
+        :param max_open_files: Maximum number of file handles kept open at once
+        :raise ValueError: If the fsync policy or a threshold is invalid
+        """
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"fsync_policy must be one of {FSYNC_POLICIES}, got '{fsync_policy}'.")
+        if max_buffered_rows < 1:
+            raise ValueError("max_buffered_rows must be at least 1.")
+        if max_open_files < 1:
+            raise ValueError("max_open_files must be at least 1.")
+
+        self.max_buffered_rows = max_buffered_rows
+        self.flush_interval = flush_interval
+        self.fsync_policy = fsync_policy
+        self.max_open_files = max_open_files
+
+        self._files = OrderedDict()
+        self._lock = threading.RLock()
+        self._buffered_rows = 0
+        self._last_flush = time.monotonic()
+        self._closed = threading.Event()
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(target=self._flush_periodically, name='journal-flusher', daemon=True)
+            self._flusher.start()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            with self._lock:
+                if self._buffered_rows and time.monotonic() - self._last_flush >= self.flush_interval:
+                    self._flush_locked()
+
+    def _open_file(self, file_path, header):
+        """
+        Open the append handle of a journal target. Storage backends override this to change the on-disk format.
+        """
+        return _JournalFile(file_path)
+
+    def _get_file(self, file_path, header):
+        journal_file = self._files.get(file_path)
+        if journal_file is not None:
+            self._files.move_to_end(file_path)
+            return journal_file
+
+        # Evict the least recently used handle to keep the number of open files bounded
+        while len(self._files) >= self.max_open_files:
+            _, evicted = self._files.popitem(last=False)
+            self._buffered_rows -= evicted.buffered_rows
+            evicted.close(fsync=self.fsync_policy != FSYNC_NONE)
+
+        journal_file = self._open_file(file_path, header)
+        self._files[file_path] = journal_file
+        return journal_file
+
+    def append(self, file_path, header, row):
+        """
+        Buffer a row for a journal file, writing the header first if the file is new.
+
+        :param file_path: Path of the CSV file to append to
+        :param header: Column names written when the file is empty
+        :param row: Sequence of values in header order
+        """
+        self.append_many(file_path, header, [row])
+
+    def append_many(self, file_path, header, rows):
+        """
+        Buffer several rows for a journal file in one call.
+
+        :param file_path: Path of the CSV file to append to
+        :param header: Column names written when the file is empty
+        :param rows: Iterable of sequences of values in header order
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        with self._lock:
+            journal_file = self._get_file(file_path, header)
+            journal_file.write_rows(header, rows)
+            journal_file.buffered_rows += len(rows)
+            self._buffered_rows += len(rows)
+
+    def commit(self):
+        """
+        Mark the end of a transaction's rows and apply the flush thresholds and fsync policy.
+
+        Rows are not held back until their commit: the background flusher and the eviction of a
+        least recently used handle may write part of a transaction's rows earlier, so a crash can
+        leave some of them on disk without the rest. WriteAheadJournal makes them durable together.
+        """
+        with self._lock:
+            if self.fsync_policy == FSYNC_TRANSACTION:
+                self._flush_locked()
+            elif self._buffered_rows >= self.max_buffered_rows:
+                self._flush_locked()
+            elif self.flush_interval is not None and time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+
+    def flush(self):
+        """
+        Write every buffered row to disk.
+        """
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        fsync = self.fsync_policy != FSYNC_NONE
+        for journal_file in self._files.values():
+            if journal_file.buffered_rows:
+                journal_file.flush(fsync)
+        self._buffered_rows = 0
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        """
+        Flush buffered rows, close every file handle and stop the background flusher.
+        """
+        self._closed.set()
+        self._close_files()
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join()
+            self._flusher = None
+
+    def _close_files(self):
+        """
+        Flush buffered rows and close every file handle, which later appends open again.
+        """
+        with self._lock:
+            fsync = self.fsync_policy != FSYNC_NONE
+            while self._files:
+                _, journal_file = self._files.popitem(last=False)
+                journal_file.close(fsync)
+            self._buffered_rows = 0
+
+    @property
+    def buffered_rows(self):
+        return self._buffered_rows
+
+    def exists(self, file_path):
+        """
+        Return True if a journal file has been written.
+        """
+        return os.path.isfile(file_path)
+
+    def iter_rows(self, file_path):
+        """
+        Flush buffered rows, then iterate over a journal file's rows.
+
+        :param file_path: Path of the CSV file
+        :return: Generator yielding dictionaries with the row's values as strings
+        """
+        self.flush()
+        if os.path.isfile(file_path):
+            with open(file_path, 'r', newline='') as csvfile:
+                yield from csv.DictReader(csvfile)
+
+    def iter_records(self, file_path):
+        """
+        Flush buffered rows, then iterate over a transaction file's rows as TransactionRecords of strings.
+
+        :param file_path: Path of the CSV transaction file
+        :return: Generator yielding TransactionRecord instances
+        """
+        self.flush()
+        if not os.path.isfile(file_path):
+            return
+        with open(file_path, 'r', newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            header = next(reader, None)
+            if header == TRANSACTION_FIELDNAMES:
+                make = TransactionRecord._make
+                for row in reader:
+                    if row:
+                        yield make(row)
+            elif header is not None:
+                positions = [header.index(field) for field in TRANSACTION_FIELDNAMES]
+                for row in reader:
+                    if row:
+                        yield TransactionRecord._make(row[position] for position in positions)
+
+    def iter_last_rows(self, file_path, columns):
+        """
+        Flush buffered rows, then iterate over columns of a journal file's rows, newest first, reading backwards.
+
+        :param file_path: Path of the CSV file
+        :param columns: List of column names
+        :return: Generator yielding lists of the rows' values as strings
+        """
+        self.flush()
+        if not os.path.isfile(file_path):
+            return
+        with open(file_path, 'r', newline='') as csvfile:
+            header = next(csv.reader(csvfile), None)
+        if header is None:
+            return
+        indices = [header.index(column) for column in columns]
+        for row in iter_tail_rows(file_path):
+            yield [row[index] for index in indices]
+
+    def read_last_row(self, file_path, columns):
+        """
+        Flush buffered rows, then read columns of the last row of a journal file.
+
+        :param file_path: Path of the CSV file
+        :param columns: List of column names
+        :return: List of the last row's values as strings
+        """
+        self.flush()
+        return CSVLastRowExtractor.extract_last_rows(file_path, columns)
@@ -0,0 +1,397 @@
+import csv
+import json
+import os
+import tempfile
+from bisect import bisect_left
+from collections import Counter
+from io import StringIO
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, the pure Python paths give the same results
+    np = None
+
+CACHE_VERSION = 2
+# Types that move money out of an account
+OUTFLOW_TYPES = ('withdraw', 'transfer_to', 'fee')
+# Upper edges of the amount histogram buckets, eight per power of ten from 0.01 to 10^9
+AMOUNT_BUCKET_EDGES = tuple(10 ** (exponent / 8) for exponent in range(-16, 73))
+# Bytes of the CSV file turned into column arrays at a time
+DEFAULT_CHUNK_BYTES = 4 * 1024 * 1024
+# Bytes at the end of each chunk kept to notice a file that was rewritten under the cache
+FINGERPRINT_BYTES = 64
+
+
+def _group(key_columns, amounts=None):
+    """
+    Group rows by the values of several equal-length columns and count them, and sum their amounts.
+
+    :param key_columns: List of columns; row i has the key (column[i] for column in key_columns)
+    :param amounts: Column of floats to sum per group (default is None, counting only)
+    :return: Dictionary mapping key tuples to counts, or to [count, sum] pairs when amounts are given
+    """
+    if not key_columns or not len(key_columns[0]):
+        return {}
+    if np is not None:
+        uniques, codes = [], []
+        for column in key_columns:
+            unique, inverse = np.unique(np.asarray(column), return_inverse=True)
+            uniques.append(unique.tolist())
+            codes.append(inverse)
+        dimensions = [len(unique) for unique in uniques]
+        groups, inverse = np.unique(np.ravel_multi_index(codes, dimensions), return_inverse=True)
+        counts = np.bincount(inverse).tolist()
+        sums = np.bincount(inverse, weights=amounts).tolist() if amounts is not None else None
+        result = {}
+        for position, indices in enumerate(zip(*np.unravel_index(groups, dimensions))):
+            key = tuple(unique[index] for unique, index in zip(uniques, indices))
+            result[key] = [counts[position], sums[position]] if sums is not None else counts[position]
+        return result
+    keys = list(zip(*key_columns))
+    if amounts is None:
+        return dict(Counter(keys))
+    result = {}
+    for key, amount in zip(keys, amounts):
+        entry = result.get(key)
+        if entry is None:
+            result[key] = [1, amount]
+        else:
+            entry[0] += 1
+            entry[1] += amount
+    return result
+
+
+def _merge(totals, partial):
+    """
+    Add a partial aggregate into running totals, both {key: count} or {key: [count, sum]}.
+    """
+    for key, value in partial.items():
+        if isinstance(value, list):
+            entry = totals.get(key)
+            if entry is None:
+                totals[key] = list(value)
+            else:
+                entry[0] += value[0]
+                entry[1] += value[1]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+def aggregate_chunk(columns):
+    """
+    Compute the partial aggregates of one chunk of rows.
+
+    :param columns: Dictionary of column lists with 'day', 'account_id', 'type', 'amount', 'currency' and 'status'
+    :return: Dictionary of the chunk's 'volume' ((day, type, currency) -> [count, amount]), 'statuses'
+             ((day, type, status) -> count), 'outflow' ((account_id, currency) -> [count, amount]) and
+             'amounts' ((type, bucket) -> count) aggregates; volume, outflow and amounts count completed rows only
+    """
+    completed = [position for position, status in enumerate(columns['status']) if status == 'Completed']
+    if np is not None:
+        positions = np.asarray(completed, dtype=np.int64)
+        amount_array = np.asarray(columns['amount'], dtype=np.float64)[positions]
+
+        def pick(name):
+            return np.asarray(columns[name])[positions]
+
+        types = pick('type')
+        outflow = np.isin(types, OUTFLOW_TYPES)
+        buckets = np.searchsorted(np.asarray(AMOUNT_BUCKET_EDGES), amount_array, side='left')
+        return {
+            'volume': _group([pick('day'), types, pick('currency')], amount_array),
+            'statuses': _group([columns['day'], columns['type'], columns['status']]),
+            'outflow': _group([pick('account_id')[outflow], pick('currency')[outflow]], amount_array[outflow]),
+            'amounts': _group([types, buckets]),
+        }
+
+    def pick(name):
+        column = columns[name]
+        return [column[position] for position in completed]
+
+    types = pick('type')
+    amounts = pick('amount')
+    account_ids = pick('account_id')
+    currencies = pick('currency')
+    outflow = [position for position, transaction_type in enumerate(types) if transaction_type in OUTFLOW_TYPES]
+    return {
+        'volume': _group([pick('day'), types, currencies], amounts),
+        'statuses': _group([columns['day'], columns['type'], columns['status']]),
+        'outflow': _group([[account_ids[position] for position in outflow], [currencies[position] for position in outflow]],
+                          [amounts[position] for position in outflow]),
+        'amounts': _group([types, [bisect_left(AMOUNT_BUCKET_EDGES, amount) for amount in amounts]]),
+    }
+
+
+AGGREGATE_NAMES = ('volume', 'statuses', 'outflow', 'amounts')
+
+
+class TransactionReports:
+    """
+    Columnar reports over a transaction CSV file: volume by day and type, top accounts by outflow,
+    status counts and amount percentiles.
+
+    The file is read in chunks of whole rows, each chunk is turned into column arrays and
+    reduced to partial aggregates with vectorized group-by operations (numpy when it is
+    installed, C-level Counter and zip passes otherwise). The partial aggregates of every
+    chunk are cached in '{file_path}.agg' with the byte range they cover, so refresh() only
+    reads the rows appended since the last run. A chunk whose bytes changed, e.g. after the
+    file was truncated or rewritten, is dropped with every chunk after it and read again.
+    """
+    def __init__(self, file_path: str, cache_path: str = None, chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> None:
+        """
+        Initialize the TransactionReports.
+
+        :param file_path: Path of the transaction CSV file, e.g. 'system_transactions.csv'
+        :param cache_path: Path of the partial aggregate cache, None for '{file_path}.agg' (default is None)
+        :param chunk_bytes: Approximate number of bytes of rows aggregated per chunk (default is 4 MiB)
+        """
+        self.file_path = file_path
+        self.cache_path = cache_path if cache_path is not None else f"{file_path}.agg"
+        self.chunk_bytes = chunk_bytes
+        self._chunks = []  # {'start', 'end', 'fingerprint', 'rows', aggregate name -> {key: value}}
+        self._header = None
+        self._totals = None
+        self._loaded = False
+
+    def _load_cache(self):
+        self._loaded = True
+        if not os.path.isfile(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r') as cache_file:
+                cache = json.load(cache_file)
+        except (OSError, ValueError):
+            return
+        if not isinstance(cache, dict) or cache.get('version') != CACHE_VERSION:
+            return
+        self._header = cache['header']
+        for chunk in cache['chunks']:
+            for name in AGGREGATE_NAMES:
+                chunk[name] = {tuple(entry[0]): entry[1] for entry in chunk[name]}
+            self._chunks.append(chunk)
+
+    def _save_cache(self):
+        cache = {
+            'version': CACHE_VERSION,
+            'header': self._header,
+            'chunks': [
+                {**chunk, **{name: [[list(key), value] for key, value in chunk[name].items()] for name in AGGREGATE_NAMES}}
+                for chunk in self._chunks
+            ],
+        }
+        directory = os.path.dirname(os.path.abspath(self.cache_path))
+        fd, temp_path = tempfile.mkstemp(prefix='.reports-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as temp_file:
+                json.dump(cache, temp_file, separators=(',', ':'))
+            os.replace(temp_path, self.cache_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _drop_stale_chunks(self, data_file, file_size):
+        """
+        Drop the cached chunks whose bytes no longer match the file, with every chunk after them.
+        """
+        for position, chunk in enumerate(self._chunks):
+            if chunk['end'] > file_size:
+                del self._chunks[position:]
+                return True
+            fingerprint = chunk['fingerprint'].encode('latin-1')
+            data_file.seek(chunk['end'] - len(fingerprint))
+            if data_file.read(len(fingerprint)) != fingerprint:
+                del self._chunks[position:]
+                return True
+        return False
+
+    def _columns(self, rows):
+        header = self._header
+        positions = {name: header.index(name) for name in
+                     ('timestamp_start', 'timestamp_end', 'account_id', 'type', 'amount', 'currency', 'status')}
+        transposed = list(zip(*rows))
+
+        def column(name):
+            return transposed[positions[name]]
+
+        return {
+            # ISO timestamps start with the date; rows without an end time fall back to their start time
+            'day': [end[:10] or start[:10] for start, end in zip(column('timestamp_start'), column('timestamp_end'))],
+            'account_id': list(map(int, column('account_id'))),
+            'type': column('type'),
+            'amount': [float(amount) if amount else 0.0 for amount in column('amount')],
+            'currency': column('currency'),
+            'status': column('status'),
+        }
+
+    def refresh(self):
+        """
+        Aggregate the rows appended to the file since the last refresh.
+
+        :return: Number of newly aggregated rows
+        """
+        if not self._loaded:
+            self._load_cache()
+        if not os.path.isfile(self.file_path):
+            return 0
+        file_size = os.path.getsize(self.file_path)
+        new_rows = 0
+        with open(self.file_path, 'rb') as data_file:
+            header_line = data_file.readline()
+            header = next(csv.reader([header_line.decode()]), None)
+            if header != self._header:
+                self._header = header
+                self._chunks = []
+                self._totals = None
+            if self._drop_stale_chunks(data_file, file_size):
+                self._totals = None
+            offset = self._chunks[-1]['end'] if self._chunks else len(header_line)
+            data_file.seek(offset)
+            while offset < file_size:
+                block = data_file.read(self.chunk_bytes)
+                if not block:
+                    break
+                # Only whole rows; a partly written last row is left for the next refresh
+                complete = block[:block.rfind(b'\n') + 1]
+                if not complete:
+                    if len(block) < self.chunk_bytes:
+                        break
+                    # A row longer than a chunk
+                    complete = block + data_file.readline()
+                    if not complete.endswith(b'\n'):
+                        break
+                data_file.seek(offset + len(complete))
+                rows = [row for row in csv.reader(StringIO(complete.decode(), newline='')) if row]
+                chunk = {'start': offset, 'end': offset + len(complete),
+                         'fingerprint': complete[-FINGERPRINT_BYTES:].decode('latin-1'), 'rows': len(rows)}
+                chunk.update(aggregate_chunk(self._columns(rows)) if rows else {name: {} for name in AGGREGATE_NAMES})
+                self._chunks.append(chunk)
+                if self._totals is not None:
+                    for name in AGGREGATE_NAMES:
+                        _merge(self._totals[name], chunk[name])
+                new_rows += len(rows)
+                offset = chunk['end']
+        if new_rows or not os.path.isfile(self.cache_path):
+            self._save_cache()
+        return new_rows
+
+    def _aggregates(self):
+        if self._totals is None:
+            self._totals = {name: {} for name in AGGREGATE_NAMES}
+            for chunk in self._chunks:
+                for name in AGGREGATE_NAMES:
+                    _merge(self._totals[name], chunk[name])
+        return self._totals
+
+    @property
+    def row_count(self):
+        return sum(chunk['rows'] for chunk in self._chunks)
+
+    def daily_volume(self, since=None, until=None):
+        """
+        Return the number and total amount of completed transactions per day, type and currency.
+
+        :param since: Earliest day to include, as 'YYYY-MM-DD' (default is no lower bound)
+        :param until: Latest day to include, as 'YYYY-MM-DD' (default is no upper bound)
+        :return: Dictionary mapping day to {type: {currency: {'count': count, 'amount': amount}}}
+        """
+        report = {}
+        for (day, transaction_type, currency), (count, amount) in sorted(self._aggregates()['volume'].items()):
+            if (since is None or day >= since) and (until is None or day <= until):
+                report.setdefault(day, {}).setdefault(transaction_type, {})[currency] = {'count': count, 'amount': amount}
+        return report
+
+    def top_outflow(self, limit=10, fx_rates=None, currency=None):
+        """
+        Return the accounts with the largest completed outflow (withdrawals, transfers out and fees) per currency.
+
+        Amounts of different currencies are only compared once converted, so without fx_rates
+        the accounts are ranked within each currency.
+
+        :param limit: Number of accounts to return per currency (default is 10)
+        :param fx_rates: FXRates to convert every amount into one currency and rank all accounts together
+                         (default is None)
+        :param currency: Currency the amounts are converted into (default is the base currency of fx_rates)
+        :return: Dictionary mapping currency to a list of (account_id, amount, count) tuples, largest amount first
+        :raise ValueError: If a currency has no rate in fx_rates
+        """
+        if fx_rates is not None and currency is None:
+            currency = fx_rates.base_currency
+        by_currency = {}
+        for (account_id, from_currency), (count, amount) in self._aggregates()['outflow'].items():
+            to_currency = from_currency
+            if fx_rates is not None:
+                amount, to_currency = fx_rates.convert(amount, from_currency, currency), currency
+            totals = by_currency.setdefault(to_currency, {})
+            # An account's outflow in several currencies adds up once converted
+            entry = totals.setdefault(account_id, [0, 0])
+            entry[0] += amount
+            entry[1] += count
+        report = {}
+        for to_currency, totals in sorted(by_currency.items()):
+            outflow = sorted(((account_id, amount, count) for account_id, (amount, count) in totals.items()),
+                             key=lambda entry: (-entry[1], entry[0]))
+            report[to_currency] = outflow[:limit]
+        return report
+
+    def status_counts(self, since=None, until=None):
+        """
+        Return the number of transactions per type and status, e.g. to count failed transactions.
+
+        :param since: Earliest day to include, as 'YYYY-MM-DD' (default is no lower bound)
+        :param until: Latest day to include, as 'YYYY-MM-DD' (default is no upper bound)
+        :return: Dictionary mapping type to {status: count}
+        """
+        report = {}
+        for (day, transaction_type, status), count in self._aggregates()['statuses'].items():
+            if (since is None or day >= since) and (until is None or day <= until):
+                statuses = report.setdefault(transaction_type, {})
+                statuses[status] = statuses.get(status, 0) + count
+        return report
+
+    def amount_percentiles(self, transaction_type=None, percentiles=(0.5, 0.9, 0.99)):
+        """
+        Estimate percentiles of the completed transaction amounts from the amount histogram.
+
+        Amounts are bucketed eight buckets per power of ten, so estimates are within about 33% of the exact value.
+
+        :param transaction_type: Only include this type (default is every type)
+        :param percentiles: Percentiles as fractions (default is 0.5, 0.9 and 0.99)
+        :return: Dictionary mapping each percentile to its estimated amount, None when there are no amounts
+        """
+        counts = [0] * (len(AMOUNT_BUCKET_EDGES) + 1)
+        for (bucket_type, bucket), count in self._aggregates()['amounts'].items():
+            if transaction_type is None or bucket_type == transaction_type:
+                counts[bucket] += count
+        total = sum(counts)
+        report = {}
+        for fraction in percentiles:
+            if not total:
+                report[fraction] = None
+                continue
+            rank = fraction * total
+            seen = 0
+            for bucket, count in enumerate(counts):
+                if count and seen + count >= rank:
+                    high = AMOUNT_BUCKET_EDGES[min(bucket, len(AMOUNT_BUCKET_EDGES) - 1)]
+                    low = AMOUNT_BUCKET_EDGES[bucket - 1] if bucket else 0.0
+                    # Geometric interpolation within the bucket, linear in the first one
+                    share = (rank - seen) / count
+                    report[fraction] = low * (high / low) ** share if low > 0 else high * share
+                    break
+                seen += count
+        return report
+
+    def summary(self, since=None, until=None, top=10):
+        """
+        Return every report at once.
+
+        :return: Dictionary with rows, daily_volume, status_counts, top_outflow (per currency) and amount_percentiles
+        """
+        return {
+            'rows': self.row_count,
+            'daily_volume': self.daily_volume(since, until),
+            'status_counts': self.status_counts(since, until),
+            'top_outflow': self.top_outflow(top),
+            'amount_percentiles': self.amount_percentiles(),
+        }
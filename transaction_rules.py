@@ -0,0 +1,366 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+import money
+
+DEBIT_TYPES = ('withdraw', 'transfer_to')
+
+
+class SlidingWindowCounter:
+    """
+    Count and total of the events of the last window seconds, kept in a ring of time buckets.
+
+    Every bucket covers window / buckets seconds, and the running count and total are
+    updated as events are added and as expired buckets are cleared, so add() and
+    totals() are O(1) amortized and the memory is fixed. An event leaves the window
+    within one bucket's length after it is window seconds old.
+    """
+    __slots__ = ('bucket_seconds', '_counts', '_totals', '_epoch', 'count', 'total')
+
+    def __init__(self, window: float, buckets: int, now: float) -> None:
+        self.bucket_seconds = window / buckets
+        self._counts = [0] * buckets
+        self._totals = [0] * buckets
+        self._epoch = int(now // self.bucket_seconds)
+        self.count = 0
+        self.total = 0
+
+    def _advance(self, now):
+        epoch = int(now // self.bucket_seconds)
+        if epoch <= self._epoch:
+            return
+        size = len(self._counts)
+        # Clears each bucket that expired since the last call, at most the whole ring once
+        for step in range(1, min(epoch - self._epoch, size) + 1):
+            slot = (self._epoch + step) % size
+            self.count -= self._counts[slot]
+            self.total -= self._totals[slot]
+            self._counts[slot] = self._totals[slot] = 0
+        self._epoch = epoch
+
+    def totals(self, now):
+        """
+        :return: Tuple of the number and the total amount of the events in the window
+        """
+        self._advance(now)
+        return self.count, self.total
+
+    def add(self, now, amount=0):
+        self._advance(now)
+        slot = self._epoch % len(self._counts)
+        self._counts[slot] += 1
+        self._totals[slot] += amount
+        self.count += 1
+        self.total += amount
+
+    def remove(self, at, amount=0):
+        """
+        Take back an event added at time at, unless its bucket already left the window.
+        """
+        epoch = int(at // self.bucket_seconds)
+        if epoch <= self._epoch - len(self._counts) or epoch > self._epoch:
+            return
+        slot = epoch % len(self._counts)
+        self._counts[slot] -= 1
+        self._totals[slot] -= amount
+        self.count -= 1
+        self.total -= amount
+
+
+class TransactionRule:
+    """
+    Base class of the rules a RuleEngine runs on every transaction of its transaction_types.
+
+    check() returns the reason a transaction breaks the rule, or None, and record() is
+    called once every rule passed the transaction. undo() takes a recorded transaction
+    back when it fails later, e.g. in validation. Amounts are in minor units of the
+    account's currency. All are called with the engine's lock held.
+    """
+    transaction_types = DEBIT_TYPES
+
+    def __init__(self, max_amount=None, transaction_types=None) -> None:
+        if transaction_types is not None:
+            self.transaction_types = tuple(transaction_types)
+        self.max_amount = max_amount
+        self._limit_units = {}  # currency -> max_amount in minor units
+
+    @property
+    def name(self):
+        return type(self).__name__
+
+    def limit_units(self, currency):
+        units = self._limit_units.get(currency)
+        if units is None:
+            units = self._limit_units[currency] = money.to_minor(self.max_amount, currency)
+        return units
+
+    def check(self, account, transaction_type, units, target_account, now):
+        return None
+
+    def record(self, account, transaction_type, units, target_account, now):
+        pass
+
+    def undo(self, account, transaction_type, units, target_account, now):
+        pass
+
+
+class _WindowRule(TransactionRule):
+    def __init__(self, window: float, buckets: int, max_amount=None, transaction_types=None) -> None:
+        super().__init__(max_amount, transaction_types)
+        if window <= 0 or buckets < 1:
+            raise ValueError("window must be positive and buckets at least 1.")
+        self.window = window
+        self.buckets = buckets
+        self._counters = OrderedDict()  # account_id -> SlidingWindowCounter, least recently used first
+
+    def _counter(self, account_id, now):
+        counters = self._counters
+        # Counters of accounts idle for a whole window are empty and dropped, so the state stays bounded
+        while counters:
+            oldest_id, oldest = next(iter(counters.items()))
+            if oldest.totals(now)[0]:
+                break
+            del counters[oldest_id]
+        counter = counters.get(account_id)
+        if counter is None:
+            counter = counters[account_id] = SlidingWindowCounter(self.window, self.buckets, now)
+        else:
+            counters.move_to_end(account_id)
+        return counter
+
+    def record(self, account, transaction_type, units, target_account, now):
+        self._counter(account.account_id, now).add(now, units)
+
+    def undo(self, account, transaction_type, units, target_account, now):
+        counter = self._counters.get(account.account_id)
+        if counter is not None:
+            counter.remove(now, units)
+
+
+class VelocityLimit(_WindowRule):
+    """
+    Fails a transaction that would make an account's number of transactions in the last window seconds exceed max_transactions.
+    """
+    def __init__(self, max_transactions: int, window: float = 60.0, transaction_types=None, buckets: int = 12) -> None:
+        """
+        :param max_transactions: Maximum number of transactions per account in the window
+        :param window: Length of the sliding window in seconds (default is 60)
+        :param transaction_types: Transaction types the rule applies to (default is withdrawals and outgoing transfers)
+        :param buckets: Number of time buckets the window is kept in (default is 12)
+        """
+        super().__init__(window, buckets, transaction_types=transaction_types)
+        self.max_transactions = max_transactions
+
+    def check(self, account, transaction_type, units, target_account, now):
+        count, _ = self._counter(account.account_id, now).totals(now)
+        if count >= self.max_transactions:
+            return f"velocity limit: more than {self.max_transactions} transactions in {self.window:g}s"
+        return None
+
+
+class AmountLimit(_WindowRule):
+    """
+    Fails a transaction that would make an account's total amount in the last window seconds exceed max_amount.
+    """
+    def __init__(self, max_amount, window: float = 3600.0, transaction_types=None, buckets: int = 12) -> None:
+        """
+        :param max_amount: Maximum total amount per account in the window, in the account's currency
+        :param window: Length of the sliding window in seconds (default is 3600)
+        :param transaction_types: Transaction types the rule applies to (default is withdrawals and outgoing transfers)
+        :param buckets: Number of time buckets the window is kept in (default is 12)
+        """
+        super().__init__(window, buckets, max_amount, transaction_types)
+
+    def check(self, account, transaction_type, units, target_account, now):
+        _, total = self._counter(account.account_id, now).totals(now)
+        if total + units > self.limit_units(account.currency):
+            return f"amount limit: more than {self.max_amount:,} in {self.window:g}s"
+        return None
+
+
+class NewPayeeLimit(TransactionRule):
+    """
+    Fails a transfer of more than max_amount to an account the sender has not transferred to before.
+
+    Each account remembers its max_payees most recently paid targets, least recently paid first out,
+    and the payees of at most max_accounts accounts are kept, those of the least recently active
+    account first out. A forgotten payee counts as new again.
+    """
+    transaction_types = ('transfer_to',)
+
+    def __init__(self, max_amount, max_payees: int = 64, max_accounts: int = 100_000) -> None:
+        """
+        :param max_amount: Largest transfer allowed to a new payee, in the sender's currency
+        :param max_payees: Number of known payees remembered per account (default is 64)
+        :param max_accounts: Number of accounts whose payees are remembered (default is 100,000)
+        """
+        super().__init__(max_amount)
+        self.max_payees = max_payees
+        self.max_accounts = max_accounts
+        # account_id -> OrderedDict of known target account_id -> number of recorded transfers, least recently used first
+        self._payees = OrderedDict()
+
+    def check(self, account, transaction_type, units, target_account, now):
+        payees = self._payees.get(account.account_id)
+        if (payees is None or target_account.account_id not in payees) and units > self.limit_units(account.currency):
+            return f"new payee limit: more than {self.max_amount:,} to a new payee"
+        return None
+
+    def record(self, account, transaction_type, units, target_account, now):
+        payees = self._payees.get(account.account_id)
+        if payees is None:
+            payees = self._payees[account.account_id] = OrderedDict()
+            if len(self._payees) > self.max_accounts:
+                self._payees.popitem(last=False)
+        else:
+            self._payees.move_to_end(account.account_id)
+        payees[target_account.account_id] = payees.get(target_account.account_id, 0) + 1
+        payees.move_to_end(target_account.account_id)
+        if len(payees) > self.max_payees:
+            payees.popitem(last=False)
+
+    def undo(self, account, transaction_type, units, target_account, now):
+        payees = self._payees.get(account.account_id)
+        transfers = payees.get(target_account.account_id) if payees is not None else None
+        if transfers is None:
+            return
+        if transfers > 1:
+            payees[target_account.account_id] = transfers - 1
+            return
+        del payees[target_account.account_id]
+        if not payees:
+            del self._payees[account.account_id]
+
+
+class DailyLimit(TransactionRule):
+    """
+    Fails a transaction that would make an account's total for the calendar day exceed max_amount, e.g. a daily withdrawal cap.
+    """
+    transaction_types = ('withdraw',)
+
+    def __init__(self, max_amount, transaction_types=None) -> None:
+        """
+        :param max_amount: Maximum total amount per account and day, in the account's currency
+        :param transaction_types: Transaction types the rule applies to (default is withdrawals)
+        """
+        super().__init__(max_amount, transaction_types)
+        self._days = OrderedDict()  # account_id -> [day ordinal, total units], least recently used first
+
+    def _total(self, account_id, now):
+        day = date.fromtimestamp(now).toordinal()
+        days = self._days
+        # Totals of earlier days no longer count and are dropped, so the state stays bounded
+        while days:
+            oldest_id, oldest = next(iter(days.items()))
+            if oldest[0] == day and oldest[1]:
+                break
+            del days[oldest_id]
+        entry = days.get(account_id)
+        if entry is None or entry[0] != day:
+            entry = days[account_id] = [day, 0]
+        else:
+            days.move_to_end(account_id)
+        return entry
+
+    def check(self, account, transaction_type, units, target_account, now):
+        if self._total(account.account_id, now)[1] + units > self.limit_units(account.currency):
+            return f"daily limit: more than {self.max_amount:,} today"
+        return None
+
+    def record(self, account, transaction_type, units, target_account, now):
+        self._total(account.account_id, now)[1] += units
+
+    def undo(self, account, transaction_type, units, target_account, now):
+        entry = self._days.get(account.account_id)
+        if entry is not None and entry[0] == date.fromtimestamp(now).toordinal():
+            entry[1] -= units
+
+
+class RuleEngine:
+    """
+    Runs pluggable TransactionRules inline on every transaction before it moves money.
+
+    The rules only keep small per-account state, ring buffers of time buckets, day
+    totals and bounded payee lists, so every check is O(1) amortized and never reads
+    the account's transaction history, and the state of idle accounts is dropped. A
+    transaction is recorded in the rules' state when every rule passed it, so transactions
+    in flight count against the limits, and release() takes it back if it then fails to
+    commit. Without rules every transaction passes.
+    """
+    def __init__(self, rules=(), clock=time.time) -> None:
+        """
+        Initialize the RuleEngine.
+
+        :param rules: Iterable of TransactionRule instances (default is no rules)
+        :param clock: Callable returning the current time in seconds since the epoch (default is time.time)
+        """
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._rules = []
+        self._rules_by_type = {}
+        self.rejections = {}  # rule name -> number of transactions it failed
+        for rule in rules:
+            self.add_rule(rule)
+
+    @property
+    def rules(self):
+        return list(self._rules)
+
+    def add_rule(self, rule):
+        """
+        Add a rule, checked after the rules added before it.
+        """
+        with self._lock:
+            self._rules.append(rule)
+            for transaction_type in rule.transaction_types:
+                self._rules_by_type.setdefault(transaction_type, []).append(rule)
+
+    def check(self, account, transaction_type, amount, target_account=None):
+        """
+        Run the rules of a transaction type and record the transaction for good if it passes.
+
+        Takes the same parameters as reserve().
+
+        :return: Reason of the first rule the transaction breaks, None if it passes
+        """
+        return self.reserve(account, transaction_type, amount, target_account)[0]
+
+    def reserve(self, account, transaction_type, amount, target_account=None):
+        """
+        Run the rules of a transaction type and record the transaction if it passes, until it is released.
+
+        :param account: BankAccount the transaction is for
+        :param transaction_type: Type of transaction (e.g. 'withdraw', 'transfer_to')
+        :param amount: Amount of the transaction, in the account's currency
+        :param target_account: Target BankAccount of a transfer (default is None)
+        :return: Tuple of the reason of the first rule the transaction breaks, None if it passes, and the
+                 reservation to pass to release() if the transaction does not commit, None if nothing was recorded
+        """
+        rules = self._rules_by_type.get(transaction_type)
+        if not rules:
+            return None, None
+        units = money.to_minor(amount, account.currency)
+        now = self._clock()
+        with self._lock:
+            for rule in rules:
+                reason = rule.check(account, transaction_type, units, target_account, now)
+                if reason is not None:
+                    self.rejections[rule.name] = self.rejections.get(rule.name, 0) + 1
+                    return reason, None
+            for rule in rules:
+                rule.record(account, transaction_type, units, target_account, now)
+        return None, (rules, account, transaction_type, units, target_account, now)
+
+    def release(self, reservation):
+        """
+        Take a reserved transaction back out of the rules' state, e.g. when it failed validation.
+
+        :param reservation: Reservation returned by reserve(), None is ignored
+        """
+        if reservation is None:
+            return
+        rules, account, transaction_type, units, target_account, now = reservation
+        with self._lock:
+            for rule in rules:
+                rule.undo(account, transaction_type, units, target_account, now)
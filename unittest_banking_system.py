@@ -1,6 +1,28 @@
 import unittest
+import asyncio
+import csv
+import io
+import json
+import logging
+import random
 import os
+import tempfile
+import threading
+import time
+from account_loader import AccountLoader
+from datetime import datetime, timedelta
+import banking_logging
+from banking_logging import SamplingFilter, configure_logging, shutdown_logging
 from banking_system import BankingSystem
+from binary_journal import BinaryTransactionJournal
+from change_feed import SubscriptionLagged
+from idempotency_cache import IdempotencyCache
+from payment_scheduler import PaymentScheduler
+from transaction_index import TransactionIndex
+from transaction_journal import TransactionRecord
+from transaction_rules import DailyLimit, NewPayeeLimit, RuleEngine, SlidingWindowCounter, VelocityLimit
+from validation_pipeline import ValidationPipeline
+from write_ahead_log import WriteAheadJournal, read_entries
  
 class TestBankingSystem(unittest.TestCase):
 
@@ -62,5 +84,1035 @@ class TestBankingSystem(unittest.TestCase):
         self.assertEqual(ricky_account.balance, 450)
         self.assertEqual(victor_account.balance, 210.45)
 
+    def test_get_account_by_id(self):
+        print("Unittest: get account by id")
+        ben_account = self.system.get_account("Ben")
+        self.assertIs(self.system.get_account_by_id(ben_account.account_id), ben_account)
+        with self.assertRaises(ValueError):
+            self.system.get_account_by_id(999)
+
+    def test_get_accounts(self):
+        print("Unittest: bulk get accounts")
+        ben_account = self.system.get_account("Ben")
+        ricky_account = self.system.get_account("Ricky")
+        self.assertEqual(self.system.get_accounts(["Ricky", "Linda", "Ben"]), [ricky_account, None, ben_account])
+        self.assertEqual(self.system.get_accounts([ben_account.account_id, ricky_account.account_id], key='account_id'),
+                         [ben_account, ricky_account])
+
+    def test_account_id_restored_after_reload(self):
+        print("Unittest: account id counter restored after reload")
+        self.system.close()
+        reloaded_system = BankingSystem()
+        reloaded_system.create_account("Linda", 100)
+        self.assertEqual(reloaded_system.get_account("Linda").account_id, 4)
+        self.assertEqual(reloaded_system.get_account_by_id(3).user_name, "Victor")
+        reloaded_system.close()
+        self.system = reloaded_system
+
+    def test_load_metrics_after_reload(self):
+        print("Unittest: startup load metrics")
+        self.system.close()
+        progress = []
+        reloaded_system = BankingSystem(account_loader=AccountLoader(use_processes=True, max_workers=2, chunk_size=2,
+                                                                     progress_callback=progress.append))
+        self.assertEqual(reloaded_system.get_account("Victor").balance, 200.25)
+        self.assertEqual(reloaded_system.load_metrics['accounts_loaded'], 3)
+        self.assertEqual(reloaded_system.load_metrics['executor'], 'process')
+        self.assertEqual([metrics['accounts_loaded'] for metrics in progress], [2, 3])
+        reloaded_system.close()
+        self.system = reloaded_system
+
+    def test_transaction_records(self):
+        print("Unittest: transaction records")
+        ben_account = self.system.get_account("Ben")
+        self.assertFalse(hasattr(ben_account, '__dict__'))
+        ben_account.deposit(20, self.system)
+        history = list(self.system._generate_account_transaction(ben_account.account_id))
+        self.assertIsInstance(history[-1], TransactionRecord)
+        self.assertEqual((history[-1].type, history[-1]['amount'], history[-1].balance), ('deposit', '20', '520.0'))
+        self.assertEqual(history[-1]._asdict()['status'], 'Completed')
+
+class TestValidationPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.system = BankingSystem(validation_latency=0.05)
+        self.system.create_account("Ben", 500)
+
+    def tearDown(self):
+        self.system.close()
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def test_commits_in_transaction_id_order(self):
+        print("Unittest: pipeline commits in transaction_id order")
+        committed = []
+        # Later items validate faster, so validation finishes in reverse order
+        pipeline = ValidationPipeline(lambda item: time.sleep(0.05 - item / 1000) or True,
+                                      lambda item, valid: committed.append(item) or item, max_in_flight=10)
+        futures = [pipeline.submit(item, item) for item in range(10)]
+        self.assertEqual([future.result() for future in futures], list(range(10)))
+        self.assertEqual(committed, list(range(10)))
+        pipeline.close()
+
+    def test_submitted_transactions_validate_concurrently(self):
+        print("Unittest: submitted transactions validate concurrently")
+        ben_account = self.system.get_account("Ben")
+        start_time = time.time()
+        futures = [
+            self.system.submit_transaction(ben_account, 'deposit', 1, next(self.system._transaction_id_counter),
+                                           next(self.system._reference_number_counter))
+            for _ in range(20)
+        ]
+        for future in futures:
+            self.assertEqual(future.result()['status'], 'Completed')
+        # Serial validation would take 20 * 0.05 = 1 second
+        self.assertLess(time.time() - start_time, 0.5)
+
+        self.system.flush()
+        with open(self.system._system_transactions_filename) as csvfile:
+            transaction_ids = [int(row['transaction_id']) for row in csv.DictReader(csvfile)]
+        self.assertEqual(transaction_ids, sorted(transaction_ids))
+        self.assertEqual(len(transaction_ids), 21)
+
+    def test_record_transaction_async(self):
+        print("Unittest: record transaction with asyncio")
+        ben_account = self.system.get_account("Ben")
+
+        async def record_many():
+            return await asyncio.gather(*(
+                self.system.record_transaction_async(ben_account, 'deposit', 1, next(self.system._transaction_id_counter),
+                                                     next(self.system._reference_number_counter))
+                for _ in range(5)
+            ))
+
+        transactions = asyncio.run(record_many())
+        self.assertEqual([transaction['status'] for transaction in transactions], ['Completed'] * 5)
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def test_restart_replays_only_rows_after_checkpoint(self):
+        print("Unittest: restart from checkpoint")
+        system = BankingSystem(validation_latency=0, checkpoint_filename='system_checkpoint.json')
+        system.create_account("Ben", 500)
+        system.create_account("Ricky", 300)
+        system.close()
+
+        system = BankingSystem(validation_latency=0, checkpoint_filename='system_checkpoint.json')
+        self.assertEqual(system.load_metrics['replayed_transactions'], 0)
+        system.get_account("Ben").transfer(system.get_account("Ricky"), 100, system)
+        system.create_account("Victor", 200.25)
+        # Simulate a crash: the journal reached disk but no final checkpoint was written
+        system.flush()
+        system._closed = True
+
+        system = BankingSystem(validation_latency=0, checkpoint_filename='system_checkpoint.json')
+        self.assertTrue(system.load_metrics['checkpoint_loaded'])
+        self.assertEqual(system.load_metrics['replayed_transactions'], 3)
+        self.assertEqual(system.get_account("Ben").balance, 400)
+        self.assertEqual(system.get_account("Ricky").balance, 400)
+        self.assertEqual(system.get_account("Victor").balance, 200.25)
+
+        system.create_account("Linda", 100)
+        transaction = system.record_transaction(system.get_account("Linda"), 'deposit', 0, next(system._transaction_id_counter),
+                                                next(system._reference_number_counter))
+        self.assertEqual(system.get_account("Linda").account_id, 4)
+        self.assertEqual(transaction['transaction_id'], 7)
+        system.close()
+
+    def test_checkpoint_interval(self):
+        print("Unittest: automatic checkpoint interval")
+        system = BankingSystem(validation_latency=0, checkpoint_filename='system_checkpoint.json', checkpoint_interval=2)
+        system.create_account("Ben", 500)
+        self.assertFalse(os.path.isfile('system_checkpoint.json'))
+        system.create_account("Ricky", 300)
+        self.assertTrue(os.path.isfile('system_checkpoint.json'))
+        system.close()
+
+class TestApplyBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.system = BankingSystem(validation_latency=0)
+        self.system.create_account("Ben", 500)
+        self.system.create_account("Ricky", 300)
+
+    def tearDown(self):
+        self.system.close()
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def test_apply_batch(self):
+        print("Unittest: apply batch")
+        results = self.system.apply_batch([
+            {'type': 'deposit', 'user_name': 'Ben', 'amount': 100},
+            {'type': 'transfer', 'user_name': 'Ben', 'target_user_name': 'Ricky', 'amount': 550},
+            {'type': 'withdraw', 'account_id': 2, 'amount': 850},
+            {'type': 'withdraw', 'account_id': 2, 'amount': 1},
+            {'type': 'deposit', 'user_name': 'Linda', 'amount': 10},
+        ])
+        self.assertEqual([result['status'] for result in results], ['Completed', 'Completed', 'Completed', 'Rejected', 'Rejected'])
+        self.assertEqual(results[1]['transaction_ids'], [4, 5])
+        self.assertEqual(results[2]['transaction_ids'], [6])
+        self.assertEqual(results[2]['reference_number'], 5)
+        self.assertEqual(self.system.get_account("Ben").balance, 50)
+        self.assertEqual(self.system.get_account("Ricky").balance, 0)
+
+        transfer = self.system.find_transactions_by_reference(4)
+        self.assertEqual([(t['type'], t['balance']) for t in transfer], [('transfer_to', '50.0'), ('receive_from', '850.0')])
+
+        # The counters continue after the allocated ranges
+        self.system.get_account("Ben").deposit(1, self.system)
+        self.assertEqual(self.system.query_transactions(reverse=True, limit=1)[0]['transaction_id'], '7')
+        self.assertEqual(self.system.query_transactions(reverse=True, limit=1)[0]['reference_number'], '6')
+
+class TestConcurrentTransfers(unittest.TestCase):
+
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.system = BankingSystem(validation_latency=0.001)
+        for user_name in ("Ben", "Ricky", "Victor", "Linda"):
+            self.system.create_account(user_name, 1000)
+
+    def tearDown(self):
+        self.system.close()
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def test_total_balance_conserved(self):
+        print("Unittest: concurrent transfers conserve the total balance")
+        accounts = list(self.system.accounts.values())
+
+        def worker(offset):
+            for i in range(30):
+                source = accounts[(offset + i) % len(accounts)]
+                target = accounts[(offset + i + 1 + offset % 3) % len(accounts)]
+                try:
+                    source.transfer(target, 7.5, self.system)
+                except ValueError:
+                    pass
+
+        threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertAlmostEqual(self.system.get_total_balance(), 4000)
+        transactions = self.system.query_transactions()
+        transaction_ids = [int(t['transaction_id']) for t in transactions]
+        self.assertEqual(transaction_ids, list(range(1, len(transactions) + 1)))
+        for account in accounts:
+            self.assertEqual(float(self.system.query_transactions(account.account_id, reverse=True, limit=1)[0]['balance']),
+                             account.balance)
+
+class TestTransactionIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.system = BankingSystem(validation_latency=0)
+        self.system.create_account("Ben", 500)
+        self.system.create_account("Ricky", 300)
+        ben_account = self.system.get_account("Ben")
+        for amount in range(1, 11):
+            ben_account.deposit(amount, self.system)
+        ben_account.transfer(self.system.get_account("Ricky"), 5, self.system)
+
+    def tearDown(self):
+        self.system.close()
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def test_query_by_transaction_id_range(self):
+        print("Unittest: query transactions by id range")
+        transactions = self.system.query_transactions(account_id=1, start_id=5, end_id=7)
+        self.assertEqual([int(t['transaction_id']) for t in transactions], [5, 6, 7])
+        self.assertEqual(transactions[0]['amount'], '3')
+
+    def test_reverse_pagination(self):
+        print("Unittest: newest-first pagination")
+        first_page = self.system.query_transactions(account_id=1, reverse=True, limit=3)
+        self.assertEqual([int(t['transaction_id']) for t in first_page], [13, 12, 11])
+        second_page = self.system.query_transactions(account_id=1, end_id=10, reverse=True, limit=3)
+        self.assertEqual([int(t['transaction_id']) for t in second_page], [10, 9, 8])
+
+    def test_query_since_timestamp(self):
+        print("Unittest: query transactions since timestamp")
+        transactions = self.system.query_transactions(account_id=1)
+        since = transactions[-2]['timestamp_end']
+        self.assertEqual(self.system.query_transactions(account_id=1, since=since), transactions[-2:])
+
+    def test_find_by_reference_and_incremental_refresh(self):
+        print("Unittest: find transactions by reference number")
+        transfer = self.system.find_transactions_by_reference(13)
+        self.assertEqual([t['type'] for t in transfer], ['transfer_to', 'receive_from'])
+        # Both legs of a same-currency transfer record the amount the same way
+        self.assertEqual(transfer[0]['amount'], transfer[1]['amount'])
+
+        self.system.get_account("Ricky").deposit(1, self.system)
+        index = self.system.get_transaction_index()
+        self.assertEqual(len(index), 15)
+        # A fresh index reloads the sidecar file instead of rescanning the CSV
+        reloaded_index = TransactionIndex(self.system._system_transactions_filename)
+        self.assertEqual(reloaded_index.refresh(), 0)
+        self.assertEqual(reloaded_index.query(start_id=15)[0]['user_name'], 'Ricky')
+
+class TestBinaryStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def test_restart_with_binary_journal(self):
+        print("Unittest: restart with the binary journal")
+        system = BankingSystem(journal=BinaryTransactionJournal(), validation_latency=0)
+        system.create_account("Ben", 500)
+        system.create_account("Ricky", 300)
+        system.get_account("Ben").transfer(system.get_account("Ricky"), 120.5, system)
+        system.close()
+        self.assertTrue(os.path.isfile('system_transactions.bin'))
+        self.assertFalse(os.path.isfile('system_transactions.csv'))
+        self.assertTrue(os.path.isfile('system_accounts.csv'))
+
+        system = BankingSystem(journal=BinaryTransactionJournal(), validation_latency=0)
+        self.assertEqual(system.get_account("Ben").balance, 379.5)
+        self.assertEqual(system.get_account("Ricky").balance, 420.5)
+        rows = list(system._generate_account_transaction(2))
+        self.assertEqual([row['type'] for row in rows], ['create_account', 'receive_from'])
+        self.assertEqual(rows[-1]['target_user_name'], 'Ben')
+        system.create_account("Victor", 100)
+        self.assertEqual(system.get_account("Victor").account_id, 3)
+        self.assertEqual(list(system._generate_account_transaction(3))[0]['transaction_id'], '5')
+        with self.assertRaises(ValueError):
+            system.query_transactions()
+        system.close()
+
+    def test_checkpoints_need_csv_journal(self):
+        print("Unittest: checkpoints need a CSV journal")
+        with self.assertRaises(ValueError):
+            BankingSystem(journal=BinaryTransactionJournal(flush_interval=None), checkpoint_filename='system_checkpoint.json')
+
+class TestBalanceAggregates(unittest.TestCase):
+
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.system = BankingSystem(validation_latency=0)
+
+    def tearDown(self):
+        self.system.close()
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def test_aggregates_follow_balance_changes(self):
+        print("Unittest: running balance aggregates")
+        self.system.create_account("Ben", 500)
+        self.system.create_account("Ricky", 50)
+        self.system.create_account("Victor", 2000, 'USD')
+        ben, ricky, victor = (self.system.get_account(name) for name in ("Ben", "Ricky", "Victor"))
+        ben.deposit(100.1, self.system)
+        ricky.withdraw(20, self.system)
+        ben.transfer(ricky, 250.05, self.system)
+        self.system.apply_batch([{'type': 'withdraw', 'user_name': 'Victor', 'amount': 1500}])
+
+        # Totals are consolidated in HKD
+        with open('fx_rates.csv', 'w') as rates_file:
+            rates_file.write('currency,rate\nUSD,7.8\n')
+        hkd_total = ben.balance + ricky.balance + victor.balance * 7.8
+        self.assertAlmostEqual(self.system.get_total_balance(), hkd_total)
+        self.assertAlmostEqual(self.system.get_average_balance(), hkd_total / 3)
+        summary = self.system.get_balance_summary()
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual(summary['min'], (ricky.account_id, ricky.balance))
+        self.assertEqual(summary['max'], (victor.account_id, 500))
+        self.assertAlmostEqual(summary['currencies']['HKD'][0], ben.balance + ricky.balance)
+        self.assertEqual(summary['currencies']['USD'], (500, 1))
+        self.assertEqual(dict(summary['histogram'])[(100, 1_000)], 3)
+
+    def test_paginated_summary_matches_str(self):
+        print("Unittest: paginated account summary")
+        for i in range(5):
+            self.system.create_account(f"user_{i}", 100 * i)
+        pages = list(self.system.iter_account_summaries(page_size=2))
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertTrue(str(self.system).startswith("\n".join(line for page in pages for line in page) + "\n\n"))
+        self.assertIn("Total Balance: HKD $1,000.00\nAverage Account Balance: HKD $200.00", str(self.system))
+
+    def test_interest_and_fees(self):
+        print("Unittest: interest and fees as batches")
+        self.system.create_account("Ben", 1000.01)
+        self.system.create_account("Ricky", 5)
+        self.system.create_account("Victor", 300, 'USD')
+        results = self.system.apply_interest(0.015)
+        self.assertEqual([result['status'] for result in results], ['Completed', 'Completed'])
+        self.assertEqual(self.system.get_account("Ben").balance, 1015.01)
+        self.assertEqual(self.system.get_account("Ricky").balance, 5.08)
+        self.assertEqual(self.system.get_account("Victor").balance, 300)
+
+        results = self.system.apply_fee(10, below=100)
+        self.assertEqual(results, [])
+        results = self.system.apply_fee(2.5)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(self.system.get_account("Ricky").balance, 2.58)
+        rows = list(self.system._generate_account_transaction(2))
+        self.assertEqual([(row['type'], row['amount'], row['balance']) for row in rows[1:]],
+                         [('interest', '0.08', '5.08'), ('fee', '2.5', '2.58')])
+        self.assertEqual(self.system.balance_aggregates.currency_totals_units()['HKD'], (101509, 2))
+
+    def test_exact_balances(self):
+        print("Unittest: exact balances")
+        self.system.create_account("Ben", 0)
+        ben = self.system.get_account("Ben")
+        for _ in range(10):
+            ben.deposit(0.1, self.system)
+        self.assertEqual(ben.balance, 1.0)
+        with self.assertRaises(ValueError):
+            ben.deposit(0.001, self.system)
+
+class TestLogging(unittest.TestCase):
+
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.stream = io.StringIO()
+        self.system = BankingSystem(validation_latency=0)
+
+    def tearDown(self):
+        self.system.close()
+        # Back to the default: no handler and logging off below warnings
+        shutdown_logging()
+        logger = logging.getLogger(banking_logging.ROOT_LOGGER_NAME)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.setLevel(logging.WARNING)
+        logger.propagate = True
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def test_events_are_off_by_default(self):
+        print("Unittest: logging is off by default")
+        self.assertFalse(logging.getLogger('banking.banking_system').isEnabledFor(logging.INFO))
+
+    def test_account_events(self):
+        print("Unittest: account events are logged")
+        configure_logging(logging.INFO, logging.StreamHandler(self.stream))
+        self.system.create_account("Ben", 500)
+        self.system.create_account("Ben", 500)
+        self.system.get_account("Ben").deposit(200, self.system)
+        lines = self.stream.getvalue().splitlines()
+        self.assertEqual(lines, ["Created account with username 'Ben'",
+                                 "Account with username 'Ben' already exists. Skipping creation.",
+                                 "Ben deposited: HKD $200.00"])
+
+    def test_queued_structured_events(self):
+        print("Unittest: queued structured events")
+        configure_logging(logging.DEBUG, logging.StreamHandler(self.stream), queued=True, structured=True)
+        self.system.create_account("Ben", 500)
+        shutdown_logging()
+        events = [json.loads(line) for line in self.stream.getvalue().splitlines()]
+        transaction = next(event for event in events if event.get('event') == 'transaction')
+        self.assertEqual(transaction['level'], 'DEBUG')
+        self.assertEqual(transaction['transaction']['type'], 'create_account')
+        self.assertEqual(transaction['transaction']['status'], 'Completed')
+
+    def test_sampled_tracing(self):
+        print("Unittest: sampled tracing")
+        configure_logging(banking_logging.TRACE, logging.StreamHandler(self.stream), sample_rate=0)
+        self.system.create_account("Ben", 500)
+        self.assertEqual(self.stream.getvalue().splitlines(), ["Created account with username 'Ben'"])
+
+        sampler = SamplingFilter(0.5, rng=random.Random(1))
+        kept = sum(sampler.filter(logging.makeLogRecord({'levelno': logging.DEBUG})) for _ in range(1000))
+        self.assertTrue(400 < kept < 600)
+        self.assertTrue(sampler.filter(logging.makeLogRecord({'levelno': logging.WARNING})))
+        with self.assertRaises(ValueError):
+            SamplingFilter(1.5)
+
+class _StalledWriteAheadJournal(WriteAheadJournal):
+    """
+    A WriteAheadJournal whose applier never runs, as if the process died right after each commit.
+    """
+    def _apply_entries(self):
+        pass
+
+class TestWriteAheadLog(unittest.TestCase):
+
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def test_wal_journal(self):
+        print("Unittest: banking system on a write-ahead log")
+        system = BankingSystem(journal=WriteAheadJournal(), validation_latency=0)
+        system.create_account("Ben", 500)
+        system.create_account("Ricky", 300)
+        system.get_account("Ben").transfer(system.get_account("Ricky"), 100, system)
+        self.assertEqual([row['type'] for row in system._generate_account_transaction(2)], ['create_account', 'receive_from'])
+        system.close()
+
+        system = BankingSystem(validation_latency=0)
+        self.assertEqual(system.get_account("Ben").balance, 400)
+        self.assertEqual(system.get_account("Ricky").balance, 400)
+        system.close()
+
+    def test_recovery_after_crash(self):
+        print("Unittest: committed transactions survive a crash before the CSV files are written")
+        system = BankingSystem(journal=_StalledWriteAheadJournal(), validation_latency=0)
+        system.create_account("Ben", 500)
+        system.create_account("Ricky", 300)
+        system.get_account("Ben").deposit(50, system)
+        system.get_account("Ben").transfer(system.get_account("Ricky"), 100, system)
+        with open('system_wal.log', 'rb') as wal_file:
+            wal = wal_file.read()
+        system._journal._wal.close()
+        system._closed = True
+        self.assertFalse(os.path.isfile('system_transactions.csv'))
+        with open('system_wal.log', 'wb') as wal_file:
+            # A commit torn halfway through its write
+            wal_file.write(wal + wal[:20])
+
+        system = BankingSystem(journal=WriteAheadJournal(), validation_latency=0)
+        self.assertEqual(system._journal.recovery_stats['entries'], 5)
+        self.assertEqual(system.get_account("Ben").balance, 450)
+        self.assertEqual(system.get_account("Ricky").balance, 400)
+        self.assertEqual(len(system.query_transactions()), 5)
+        system.create_account("Victor", 10)
+        self.assertEqual(system.get_account("Victor").account_id, 3)
+        system.close()
+
+    def test_commits_of_other_threads_stay_separate(self):
+        print("Unittest: a commit only takes in the rows of its own thread")
+        journal = _StalledWriteAheadJournal()
+        journal.append('a.csv', ['id'], [1])
+        thread = threading.Thread(target=lambda: (journal.append('b.csv', ['id'], [2]), journal.commit()))
+        thread.start()
+        thread.join()
+        journal.append('a.csv', ['id'], [3])
+        journal.commit()
+        entries, _ = read_entries('system_wal.log')
+        self.assertEqual([writes for _, writes in entries],
+                         [[['b.csv', ['id'], [[2]]]], [['a.csv', ['id'], [[1]]], ['a.csv', ['id'], [[3]]]]])
+        journal._wal.close()
+
+class TestIdempotency(unittest.TestCase):
+
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.system = BankingSystem(validation_latency=0)
+        self.system.create_account("Ben", 500)
+        self.system.create_account("Ricky", 300)
+
+    def tearDown(self):
+        self.system.close()
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def test_retry_returns_first_result(self):
+        print("Unittest: retried requests move money once")
+        ben = self.system.get_account("Ben")
+        ricky = self.system.get_account("Ricky")
+        first = ben.deposit(100, self.system, idempotency_key='deposit-1')
+        self.assertIs(ben.deposit(100, self.system, idempotency_key='deposit-1'), first)
+        transfer = ben.transfer(ricky, 50, self.system, idempotency_key='transfer-1')
+        self.assertEqual(ben.transfer(ricky, 50, self.system, idempotency_key='transfer-1'), transfer)
+        self.assertEqual(transfer.type, 'transfer_to')
+        self.assertEqual((ben.balance, ricky.balance), (550, 350))
+        self.assertEqual(len(list(self.system._generate_account_transaction(ben.account_id))), 3)
+        self.assertEqual(self.system.idempotency_cache.hits, 2)
+
+        # A rejected request moves no money and does not use up its key
+        with self.assertRaises(ValueError):
+            ricky.withdraw(1000, self.system, idempotency_key='withdraw-1')
+        ricky.deposit(700, self.system)
+        self.assertEqual(ricky.withdraw(1000, self.system, idempotency_key='withdraw-1').balance, 50)
+
+    def test_concurrent_retries(self):
+        print("Unittest: concurrent retries with one key")
+        ben = self.system.get_account("Ben")
+        results = []
+        workers = [threading.Thread(target=lambda: results.append(ben.deposit(10, self.system, idempotency_key='storm')))
+                   for _ in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(ben.balance, 510)
+        self.assertEqual(len({result.transaction_id for result in results}), 1)
+
+    def test_keys_survive_restart(self):
+        print("Unittest: idempotency keys rebuilt from the journal")
+        ben = self.system.get_account("Ben")
+        first = ben.deposit(100, self.system, idempotency_key='deposit-1')
+        self.system.close()
+
+        self.system = BankingSystem(validation_latency=0)
+        ben = self.system.get_account("Ben")
+        retried = ben.deposit(100, self.system, idempotency_key='deposit-1')
+        self.assertEqual(retried.transaction_id, str(first.transaction_id))
+        self.assertEqual(retried.balance, '600.0')
+        self.assertEqual(ben.balance, 600)
+
+    def test_cache_bounds(self):
+        print("Unittest: idempotency cache eviction and expiry")
+        cache = IdempotencyCache(max_entries=2, ttl=60)
+        for key in ('a', 'b'):
+            self.assertEqual(cache.begin(key), (True, None))
+            cache.complete(key, key.upper())
+        cache.get('a')
+        cache.begin('c')
+        cache.complete('c', 'C')
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), ('A', None, 'C'))
+        cache.complete('d', 'D', expires_at=time.time() - 1)
+        self.assertIsNone(cache.get('d'))
+
+class TestChangeFeed(unittest.TestCase):
+
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.system = BankingSystem(validation_latency=0)
+        self.system.create_account("Ben", 500)
+        self.system.create_account("Ricky", 300)
+
+    def tearDown(self):
+        self.system.close()
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def test_subscribers_follow_at_own_pace(self):
+        print("Unittest: in-process change feed subscribers")
+        fast = self.system.subscribe()
+        slow = self.system.subscribe()
+        ben = self.system.get_account("Ben")
+        ben.deposit(100, self.system)
+        ben.transfer(self.system.get_account("Ricky"), 50, self.system)
+        self.system.apply_batch([{'type': 'withdraw', 'user_name': 'Ricky', 'amount': 10}])
+
+        self.assertEqual([record.type for record in fast.get_batch()],
+                         ['deposit', 'transfer_to', 'receive_from', 'withdraw'])
+        self.assertEqual(fast.get(timeout=0.01), None)
+        self.assertEqual(slow.lag, 4)
+        self.assertEqual(slow.get().type, 'deposit')
+
+        resumed = self.system.subscribe(after_transaction_id=4)
+        self.assertEqual([record.transaction_id for record in resumed.get_batch()], [5, 6])
+        self.system.close()
+        self.assertEqual([record.type for record in slow], ['transfer_to', 'receive_from', 'withdraw'])
+
+    def test_async_subscription(self):
+        print("Unittest: async iteration of the change feed")
+        subscription = self.system.subscribe()
+
+        async def consume():
+            received = []
+            async for record in subscription:
+                received.append(record.type)
+                if len(received) == 2:
+                    return received
+
+        async def main():
+            consumer = asyncio.create_task(consume())
+            await asyncio.to_thread(self.system.get_account("Ben").deposit, 10, self.system)
+            await asyncio.to_thread(self.system.get_account("Ricky").withdraw, 10, self.system)
+            return await asyncio.wait_for(consumer, 5)
+
+        self.assertEqual(asyncio.run(main()), ['deposit', 'withdraw'])
+
+    def test_lagged_subscriber(self):
+        print("Unittest: subscribers behind the change feed buffer")
+        self.system.close()
+        self.system = BankingSystem(validation_latency=0)
+        with self.assertRaises(SubscriptionLagged):
+            self.system.subscribe(after_transaction_id=0)
+        subscription = self.system.subscribe()
+        self.system.change_feed.capacity = 2
+        for _ in range(4):
+            self.system.get_account("Ben").deposit(1, self.system)
+        with self.assertRaises(SubscriptionLagged):
+            subscription.get_batch()
+
+    def test_file_tail_follower(self):
+        print("Unittest: following system_transactions.csv by offset and transaction_id")
+        ben = self.system.get_account("Ben")
+        ben.deposit(100, self.system)
+        self.system.flush()
+        follower = self.system.follow_transactions(offset_path='follower.json')
+        self.assertEqual([record.type for record in follower.poll()], ['create_account', 'create_account', 'deposit'])
+        self.assertEqual(follower.poll(), [])
+        follower.commit_offset()
+
+        ben.withdraw(20, self.system)
+        self.system.flush()
+        with open('system_transactions.csv', 'a') as transactions_file:
+            transactions_file.write('5,2024-01-01T00:00:00,1,Ben,depo')
+        resumed = self.system.follow_transactions(offset_path='follower.json')
+        records = resumed.poll()
+        self.assertEqual([(record.transaction_id, record.type) for record in records], [('4', 'withdraw')])
+        self.assertEqual(resumed.transaction_id, 4)
+        self.assertEqual(resumed.poll(), [])
+
+        by_id = self.system.follow_transactions(after_transaction_id=2)
+        self.assertEqual([record.transaction_id for record in by_id.poll()], ['3', '4'])
+
+class TestLazyAccounts(unittest.TestCase):
+
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        system = BankingSystem(validation_latency=0)
+        for number in range(6):
+            system.create_account(f"user_{number}", 100 * (number + 1))
+        system.get_account("user_0").deposit(50, system)
+        system.close()
+        self.system = BankingSystem(validation_latency=0, lazy=True, max_resident_accounts=2)
+
+    def tearDown(self):
+        self.system.close()
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def test_startup_reads_only_the_directory(self):
+        print("Unittest: lazy startup loads the account directory")
+        self.assertEqual(len(self.system.accounts), 6)
+        self.assertEqual(self.system.accounts.resident_count, 0)
+        self.assertIn("user_5", self.system.accounts)
+        self.assertEqual(self.system.load_metrics['accounts_loaded'], 6)
+        self.assertEqual(self.system.get_account("user_0").balance, 150)
+        self.assertEqual(self.system.get_account_by_id(6).balance, 600)
+        self.assertEqual(self.system.accounts.hydrations, 2)
+        self.system.create_account("user_6", 10)
+        self.assertEqual(self.system.get_account("user_6").account_id, 7)
+
+    def test_lru_eviction(self):
+        print("Unittest: lazy accounts are evicted least recently used first")
+        accounts = self.system.accounts
+        for name in ("user_0", "user_1", "user_2"):
+            self.system.get_account(name)
+        self.assertEqual(accounts.resident_count, 2)
+        self.assertEqual(accounts.evictions, 1)
+        self.system.get_account("user_1")
+        self.system.get_account("user_3")
+        self.assertEqual(list(accounts._by_id), [2, 4])
+
+        # An evicted account keeps its balance in the BalanceBook and is hydrated without its file
+        user_0 = self.system.get_account("user_0")
+        user_0.transfer(self.system.get_account("user_1"), 25, self.system)
+        self.assertEqual(self.system.get_total_balance(), 150 + 200 + 300 + 400 + 500 + 600)
+        self.assertEqual(len(self.system.get_accounts(["user_4", "user_5", "nobody"])), 3)
+        self.assertEqual(self.system.get_account("user_0").balance, 125)
+
+    def test_totals_cover_accounts_not_resident(self):
+        print("Unittest: totals, summaries and checkpoints of lazy accounts hydrate nothing")
+        self.assertEqual(self.system.get_total_accounts(), 6)
+        self.assertEqual(self.system.get_total_balance(), 2150)
+        self.assertEqual(self.system.get_balance_summary()['count'], 6)
+        self.assertEqual(self.system.get_balance_summary()['max'], (6, 600))
+        user_0 = self.system.get_account("user_0")
+        user_0.transfer(self.system.get_account("user_5"), 50, self.system)
+        self.assertEqual(self.system.get_total_balance(), 2150)
+        self.assertEqual(self.system.get_balance_summary()['count'], 6)
+
+        hydrations = self.system.accounts.hydrations
+        self.assertIn("Account no. 6 - user_5: HKD $650.00", str(self.system))
+        self.assertEqual(sum(len(page) for page in self.system.iter_account_summaries(page_size=4)), 6)
+        self.assertEqual(self.system.accounts.hydrations, hydrations)
+        self.assertEqual(self.system.accounts.resident_count, 2)
+        self.system.close()
+
+        self.system = BankingSystem(validation_latency=0, lazy=True, max_resident_accounts=2,
+                                    checkpoint_filename='system_checkpoint.json')
+        self.system.checkpoint()
+        self.assertEqual(self.system.accounts.hydrations, 0)
+        self.system.get_account("user_1").deposit(1, self.system)
+        self.system.close()
+        self.system = BankingSystem(validation_latency=0, lazy=True, max_resident_accounts=2,
+                                    checkpoint_filename='system_checkpoint.json')
+        self.assertTrue(self.system.load_metrics['checkpoint_loaded'])
+        self.assertEqual(self.system.accounts.resident_count, 0)
+        self.assertEqual((self.system.get_total_accounts(), self.system.get_total_balance()), (6, 2151))
+        self.assertEqual(self.system.get_account("user_1").balance, 201)
+
+    def test_pinned_accounts_stay_resident(self):
+        print("Unittest: accounts with in-flight transactions are not evicted")
+        pipeline_commit = self.system._commit_transaction
+        resident_at_commit = []
+
+        def commit(item, valid):
+            for name in ("user_3", "user_4", "user_5"):
+                self.system.get_account(name)
+            resident_at_commit.append(item[0].account_id in self.system.accounts._by_id)
+            return pipeline_commit(item, valid)
+
+        self.system._validation_pipeline._committer = commit
+        user_0 = self.system.get_account("user_0")
+        user_0.deposit(10, self.system)
+        self.assertEqual(resident_at_commit, [True])
+        self.assertNotIn(1, self.system.accounts._pins)
+        self.assertEqual(self.system.accounts.resident_count, 2)
+
+class TestTransactionRules(unittest.TestCase):
+
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.now = datetime(2026, 1, 5, 9).timestamp()
+
+    def tearDown(self):
+        self.system.close()
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def test_sliding_window_counter(self):
+        print("Unittest: sliding window counter expires old buckets")
+        self.system = BankingSystem(validation_latency=0)
+        counter = SlidingWindowCounter(60, 6, 0)
+        counter.add(1, 100)
+        counter.add(25, 50)
+        self.assertEqual(counter.totals(59), (2, 150))
+        self.assertEqual(counter.totals(65), (1, 50))
+        self.assertEqual(counter.totals(1000), (0, 0))
+
+    def test_velocity_and_daily_limits(self):
+        print("Unittest: velocity and daily limits fail transactions without moving money")
+        engine = RuleEngine([VelocityLimit(2, window=60), DailyLimit(300)], clock=lambda: self.now)
+        self.system = BankingSystem(validation_latency=0, rule_engine=engine)
+        self.system.create_account("Ben", 1000)
+        ben = self.system.get_account("Ben")
+        self.assertEqual(ben.withdraw(100, self.system).status, 'Completed')
+        self.assertEqual(ben.withdraw(100, self.system).status, 'Completed')
+        failed = ben.withdraw(100, self.system)
+        self.assertEqual((failed.status, failed.balance, failed.reference_number), ('Failed', 800, None))
+        self.assertTrue(failed.remarks.startswith("velocity limit"))
+        self.assertEqual(ben.balance, 800)
+
+        self.now += 61
+        self.assertEqual(ben.withdraw(100, self.system).status, 'Completed')
+        failed = ben.withdraw(50, self.system)
+        self.assertTrue(failed.remarks.startswith("daily limit"))
+        self.assertEqual(ben.deposit(50, self.system).status, 'Completed')
+        self.assertEqual(ben.balance, 750)
+        self.assertEqual(engine.rejections, {'VelocityLimit': 1, 'DailyLimit': 1})
+
+        # A restart after a failed last row still continues the reference numbers
+        last_reference_number = ben.deposit(1, self.system).reference_number
+        ben.withdraw(500, self.system)
+        self.system.close()
+        self.system = BankingSystem(validation_latency=0)
+        ben = self.system.get_account("Ben")
+        self.assertEqual(ben.balance, 751)
+        self.assertEqual(ben.deposit(1, self.system).reference_number, last_reference_number + 1)
+
+    def test_new_payee_transfers_and_batches(self):
+        print("Unittest: large transfers to new payees fail in both legs")
+        engine = RuleEngine([NewPayeeLimit(100)], clock=lambda: self.now)
+        self.system = BankingSystem(validation_latency=0, rule_engine=engine)
+        self.system.create_account("Ben", 1000)
+        ben = self.system.get_account("Ben")
+        self.system.create_account("Ricky", 0)
+        ricky = self.system.get_account("Ricky")
+        self.system.create_account("Victor", 0)
+        victor = self.system.get_account("Victor")
+        failed = ben.transfer(ricky, 150, self.system)
+        self.assertEqual((failed.status, ben.balance, ricky.balance), ('Failed', 1000, 0))
+        legs = [record for record in self.system.query_transactions(account_id=ricky.account_id)
+                if record['type'] == 'receive_from']
+        self.assertEqual([(leg['status'], leg['balance']) for leg in legs], [('Failed', '0.0')])
+        self.assertEqual(ben.transfer(ricky, 50, self.system).status, 'Completed')
+        self.assertEqual(ben.transfer(ricky, 150, self.system).status, 'Completed')
+
+        results = self.system.apply_batch([
+            {'type': 'transfer', 'user_name': 'Ben', 'target_user_name': 'Victor', 'amount': 150},
+            {'type': 'transfer', 'user_name': 'Ben', 'target_user_name': 'Ricky', 'amount': 600},
+        ])
+        self.assertEqual([result['status'] for result in results], ['Failed', 'Completed'])
+        self.assertEqual([result['error'] for result in results], ["new payee limit: more than 100 to a new payee", None])
+        self.assertTrue(results[0]['transaction_ids'])
+        self.assertEqual((ben.balance, ricky.balance, victor.balance), (200, 800, 0))
+
+    def test_failed_transactions_release_rule_state(self):
+        print("Unittest: transactions failing validation do not count against the limits")
+        engine = RuleEngine([VelocityLimit(1, window=60), DailyLimit(300)], clock=lambda: self.now)
+        self.system = BankingSystem(validation_latency=0, rule_engine=engine)
+        self.system.create_account("Ben", 1000)
+        ben = self.system.get_account("Ben")
+        self.system.check_transaction_validity = lambda transaction, latency=None: transaction.amount != 200
+        self.assertEqual(ben.withdraw(200, self.system).status, 'Failed')
+        results = self.system.apply_batch([{'type': 'withdraw', 'user_name': 'Ben', 'amount': 200}])
+        self.assertEqual((results[0]['status'], results[0]['error']), ('Failed', 'checked invalid'))
+        self.assertEqual(ben.withdraw(250, self.system).status, 'Completed')
+        self.assertEqual(ben.balance, 750)
+        self.assertEqual(engine.rejections, {})
+
+    def test_failed_validation_reverts_balance(self):
+        print("Unittest: transactions failing validation leave the balances unchanged")
+        self.system = BankingSystem(validation_latency=0)
+        self.system.create_account("Ben", 100)
+        self.system.create_account("Ricky", 0)
+        ben = self.system.get_account("Ben")
+        ricky = self.system.get_account("Ricky")
+        self.system.check_transaction_validity = lambda transaction, latency=None: transaction.type == 'deposit'
+        failed = ben.withdraw(40, self.system)
+        self.assertEqual((failed.status, failed.balance, ben.balance), ('Failed', 100, 100))
+        failed = ben.transfer(ricky, 30, self.system)
+        self.assertEqual((failed.status, ben.balance, ricky.balance), ('Failed', 100, 0))
+        legs = self.system.query_transactions(account_id=ricky.account_id)
+        self.assertEqual([(leg['type'], leg['status'], leg['balance']) for leg in legs][-1:],
+                         [('receive_from', 'Failed', '0.0')])
+        self.assertEqual(ben.deposit(5, self.system).status, 'Completed')
+        self.system.close()
+
+        self.system = BankingSystem(validation_latency=0)
+        self.assertEqual(self.system.get_account("Ben").balance, 105)
+        self.assertEqual(self.system.get_account("Ricky").balance, 0)
+        # The last row of an account may be the failed one
+        self.system.check_transaction_validity = lambda transaction, latency=None: False
+        self.assertEqual(self.system.get_account("Ben").withdraw(5, self.system).status, 'Failed')
+        self.system.close()
+        self.system = BankingSystem(validation_latency=0)
+        self.assertEqual(self.system.get_account("Ben").balance, 105)
+
+    def test_idle_rule_state_is_dropped(self):
+        print("Unittest: rule state of idle accounts is dropped")
+        velocity, daily, new_payee = VelocityLimit(5, window=60), DailyLimit(1000), NewPayeeLimit(100, max_accounts=2)
+        engine = RuleEngine([velocity, daily, new_payee], clock=lambda: self.now)
+        self.system = BankingSystem(validation_latency=0, rule_engine=engine)
+        accounts = []
+        for i in range(4):
+            self.system.create_account(f"user_{i}", 100)
+            accounts.append(self.system.get_account(f"user_{i}"))
+        for i, account in enumerate(accounts):
+            account.withdraw(10, self.system)
+            account.transfer(accounts[i - 1], 10, self.system)
+        self.assertEqual((len(velocity._counters), len(daily._days), len(new_payee._payees)), (4, 4, 2))
+        self.now += 24 * 3600
+        self.assertEqual(accounts[0].withdraw(10, self.system).status, 'Completed')
+        self.assertEqual((len(velocity._counters), len(daily._days)), (1, 1))
+        # A payee forgotten with its account counts as new again
+        self.assertEqual(accounts[0].transfer(accounts[3], 50, self.system).status, 'Completed')
+        self.assertEqual(accounts[3].transfer(accounts[2], 60, self.system).status, 'Completed')
+
+class TestScheduledPayments(unittest.TestCase):
+
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.system = BankingSystem(validation_latency=0)
+        self.system.create_account("Ben", 1000)
+        self.system.create_account("Ricky", 0)
+
+    def tearDown(self):
+        self.system.close()
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def balances(self):
+        return self.system.get_account("Ben").balance, self.system.get_account("Ricky").balance
+
+    def test_standing_orders_survive_restart(self):
+        print("Unittest: standing orders run when due and are recovered after a restart")
+        rent = self.system.schedule_payment({'type': 'transfer', 'user_name': 'Ben', 'target_user_name': 'Ricky',
+                                             'amount': 100}, datetime(2026, 1, 31, 9), 'monthly', max_periods=3)
+        self.system.schedule_payment({'type': 'deposit', 'account_id': 2, 'amount': 5}, '2026-02-01T00:00:00')
+        interest = self.system.schedule_payment({'type': 'interest', 'amount': 0.01}, datetime(2026, 1, 31),
+                                                timedelta(days=1))
+        self.assertEqual(self.system.run_scheduled_payments(datetime(2026, 1, 30)), {})
+
+        results = self.system.run_scheduled_payments(datetime(2026, 1, 31, 12))
+        self.assertEqual(results[rent]['status'], 'Completed')
+        self.assertEqual(results[interest][0]['balance'], 1010)
+        self.assertEqual(self.balances(), (910, 100))
+
+        self.system.close()
+        self.system = BankingSystem(validation_latency=0)
+        self.assertEqual(len(self.system.scheduler), 3)
+        self.assertEqual(self.system.scheduler.get(rent).due_time(), datetime(2026, 2, 28, 9))
+        self.assertTrue(self.system.cancel_scheduled_payment(interest))
+        self.assertFalse(self.system.cancel_scheduled_payment(interest))
+
+        # Missed periods are skipped, and the order ends after max_periods
+        self.system.run_scheduled_payments(datetime(2026, 2, 28, 10))
+        self.assertEqual(self.balances(), (810, 205))
+        self.system.run_scheduled_payments(datetime(2026, 6, 1))
+        self.assertEqual(self.balances(), (710, 305))
+        self.assertEqual(len(self.system.scheduler), 0)
+        self.system.close()
+        self.system = BankingSystem(validation_latency=0)
+        self.assertEqual(len(self.system.scheduler), 0)
+        self.assertEqual(self.system.schedule_payment({'type': 'deposit', 'account_id': 1, 'amount': 1},
+                                                      datetime(2027, 1, 1)), interest + 1)
+
+    def test_due_orders_run_as_coalesced_batches(self):
+        print("Unittest: orders falling due together run as batches")
+        batches = []
+        execute_batch = self.system.scheduler._execute_batch
+        self.system.scheduler._execute_batch = lambda operations: batches.append(len(operations)) or execute_batch(operations)
+        self.system.scheduler.batch_size = 20
+        due_time = datetime(2026, 3, 31)
+        for _ in range(50):
+            self.system.schedule_payment({'type': 'transfer', 'account_id': 1, 'target_id': 2, 'amount': 1}, due_time)
+        self.system.schedule_payment({'type': 'withdraw', 'account_id': 1, 'amount': 5000}, due_time)
+        results = self.system.run_scheduled_payments(due_time)
+        self.assertEqual(batches, [20, 20, 11])
+        self.assertEqual(sum(result['status'] == 'Completed' for result in results.values()), 50)
+        self.assertEqual(results[51]['status'], 'Rejected')
+        self.assertEqual(self.balances(), (950, 50))
+        with self.assertRaises(ValueError):
+            self.system.schedule_payment({'type': 'deposit', 'account_id': 1, 'amount': 1}, due_time, interval=-1)
+
+    def test_missed_periods_policy(self):
+        print("Unittest: missed periods are skipped with a warning or caught up")
+        payment = {'type': 'transfer', 'user_name': 'Ben', 'target_user_name': 'Ricky', 'amount': 10}
+        skipped = self.system.schedule_payment(payment, datetime(2026, 1, 1), timedelta(days=1), max_periods=10)
+        with self.assertLogs('banking.payment_scheduler', level='WARNING') as logs:
+            self.system.run_scheduled_payments(datetime(2026, 1, 4, 12))
+        self.assertIn(f"Scheduled order {skipped} skipped 3 missed periods", logs.output[0])
+        self.assertEqual((self.system.scheduler.skipped, self.balances()), (3, (990, 10)))
+        self.assertEqual(self.system.scheduler.get(skipped).due_time(), datetime(2026, 1, 5))
+        self.system.cancel_scheduled_payment(skipped)
+
+        self.system.scheduler.missed_periods = 'catch_up'
+        caught_up = self.system.schedule_payment(payment, datetime(2026, 2, 1), timedelta(days=1), max_periods=3)
+        results = self.system.run_scheduled_payments(datetime(2026, 2, 10))
+        self.assertEqual(results[caught_up]['status'], 'Completed')
+        self.assertEqual((self.system.scheduler.skipped, self.balances()), (3, (960, 40)))
+        self.assertIsNone(self.system.scheduler.get(caught_up))
+        with self.assertRaises(ValueError):
+            PaymentScheduler(self.system._journal, None, None, missed_periods='later')
+
 if __name__ == "__main__":
     unittest.main()
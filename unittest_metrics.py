@@ -0,0 +1,82 @@
+import unittest
+import os
+import tempfile
+from banking_system import BankingSystem
+from metrics import LatencyHistogram, Metrics
+
+class TestMetrics(unittest.TestCase):
+
+    def test_latency_histogram(self):
+        print("Unittest: latency histogram percentiles")
+        histogram = LatencyHistogram((0.001, 0.01, 0.1))
+        for _ in range(90):
+            histogram.observe(0.0005)
+        for _ in range(10):
+            histogram.observe(0.05)
+        self.assertEqual(histogram.buckets, [90, 0, 10, 0])
+        self.assertLessEqual(histogram.percentile(0.5), 0.001)
+        self.assertGreater(histogram.percentile(0.99), 0.01)
+        self.assertEqual(histogram.percentile(1.0), 0.05)
+        self.assertIsNone(LatencyHistogram().percentile(0.5))
+
+    def test_disabled_metrics(self):
+        print("Unittest: disabled metrics record nothing")
+        metrics = Metrics(enabled=False)
+        metrics.observe('validation', 0.1)
+        metrics.count_operation('deposit', 'Completed')
+        self.assertEqual(metrics.snapshot(), {'stages': {}, 'operations': {}, 'gauges': {}})
+
+    def test_prometheus_export(self):
+        print("Unittest: Prometheus text export")
+        metrics = Metrics(latency_buckets=(0.001, 0.01))
+        metrics.observe('validation', 0.005)
+        metrics.count_operation('deposit', 'Completed', 2)
+        metrics.set_gauge('accounts', 3)
+        lines = metrics.to_prometheus().splitlines()
+        self.assertIn('banking_stage_latency_seconds_bucket{stage="validation",le="0.001"} 0', lines)
+        self.assertIn('banking_stage_latency_seconds_bucket{stage="validation",le="+Inf"} 1', lines)
+        self.assertIn('banking_stage_latency_seconds_count{stage="validation"} 1', lines)
+        self.assertIn('banking_operations_total{type="deposit",status="Completed"} 2', lines)
+        self.assertIn('banking_accounts 3', lines)
+
+class TestSystemMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.system = BankingSystem(validation_latency=0)
+
+    def tearDown(self):
+        self.system.close()
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def test_stages_and_operations(self):
+        print("Unittest: per-stage metrics of a banking system")
+        self.system.create_account("Ben", 500)
+        self.system.create_account("Ricky", 300)
+        ben = self.system.get_account("Ben")
+        ben.deposit(100, self.system)
+        ben.transfer(self.system.get_account("Ricky"), 50, self.system)
+        self.system.apply_batch([{'type': 'withdraw', 'user_name': 'Ricky', 'amount': 10}])
+
+        snapshot = self.system.get_metrics(prometheus_file='banking.prom')
+        self.assertEqual(snapshot['operations'], {
+            'create_account': {'Completed': 2}, 'deposit': {'Completed': 1},
+            'transfer_to': {'Completed': 1}, 'receive_from': {'Completed': 1}, 'withdraw': {'Completed': 1},
+        })
+        stages = snapshot['stages']
+        # A transfer is validated once, on its 'transfer_to' leg
+        self.assertEqual(stages['validation']['count'], 4)
+        self.assertEqual(stages['profile_save']['count'], 2)
+        self.assertEqual(stages['system_journal_write']['count'], 6)
+        self.assertEqual(stages['allocate_ids']['count'], 5)
+        self.assertEqual(stages['batch_validation']['count'], 1)
+        self.assertEqual(stages['account_lock']['count'], 3)
+        self.assertEqual(snapshot['gauges']['accounts'], 2)
+        with open('banking.prom') as prometheus_file:
+            self.assertIn('banking_operations_total{type="deposit",status="Completed"} 1', prometheus_file.read())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,198 @@
+import unittest
+import os
+import tempfile
+from decimal import Decimal
+from unittest import mock
+from balance_book import BalanceBook
+from banking_system import BankAccount, BankingSystem
+from fx_rates import FXRates
+from money import from_minor, minor_to_decimal, round_half_even_div, to_minor
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class TestMoney(unittest.TestCase):
+
+    def test_minor_unit_conversion(self):
+        print("Unittest: minor unit conversion")
+        self.assertEqual(to_minor(339.8, 'HKD'), 33980)
+        self.assertEqual(to_minor('0.1', 'USD'), 10)
+        self.assertEqual(to_minor(1500, 'JPY'), 1500)
+        self.assertEqual(to_minor(Decimal('1.2345'), 'KWD'), 1234)
+        self.assertEqual(to_minor(0.125, 'HKD'), 12)
+        self.assertEqual(from_minor(33980, 'HKD'), 339.8)
+        self.assertEqual(minor_to_decimal(33980, 'HKD'), Decimal('339.80'))
+        with self.assertRaises(ValueError):
+            to_minor(100.555, 'HKD', exact=True)
+        with self.assertRaises(ValueError):
+            to_minor(float('nan'), 'HKD')
+
+    def test_round_half_even_div(self):
+        print("Unittest: round half to even division")
+        self.assertEqual([round_half_even_div(n, 2) for n in (1, 3, 5, -1)], [0, 2, 2, 0])
+        self.assertEqual(round_half_even_div(7, 3), 2)
+
+class TestBalanceBook(unittest.TestCase):
+
+    def setUp(self):
+        self.book = BalanceBook(initial_capacity=2)
+        self.accounts = [BankAccount(1, 'Ben', 100.05), BankAccount(2, 'Ricky', 0.1),
+                         BankAccount(5, 'Victor', 2000, 'USD'), BankAccount(7, 'Linda', 0)]
+        for account in self.accounts:
+            self.book.track(account)
+
+    def test_balances_stored_in_book(self):
+        print("Unittest: balances stored in the balance book")
+        ben, ricky = self.accounts[:2]
+        for _ in range(3):
+            ricky.balance_units += to_minor(0.1, 'HKD')
+        self.assertEqual(ricky.balance, 0.4)
+        self.assertEqual(self.book.get(2), 40)
+        self.assertEqual(self.book.currency_totals(), {'HKD': (10045, 3), 'USD': (200000, 1)})
+        self.assertEqual(self.book.aggregates.currency_totals_units(), self.book.currency_totals())
+
+        self.book.untrack(ben)
+        self.assertEqual(ben.balance, 100.05)
+        self.assertEqual(self.book.currency_totals()['HKD'], (40, 2))
+
+    def test_extremes_rescanned_after_holder_moves_inwards(self):
+        print("Unittest: cached minimum and maximum balances")
+        aggregates = self.book.aggregates
+        self.assertEqual(aggregates.max(), (5, 2000.0))
+        self.assertEqual(aggregates.min(), (7, 0.0))
+        self.accounts[2].balance = 1
+        self.assertEqual(aggregates.max(), (1, 100.05))
+        self.accounts[3].balance = 50
+        self.assertEqual(aggregates.min(), (2, 0.1))
+        self.book.untrack(self.accounts[1])
+        self.assertEqual(aggregates.min(), (5, 1.0))
+
+    def test_interest_and_fee_selection(self):
+        print("Unittest: vectorized interest and fee selection")
+        # 10005 * 0.5% = 50.025 -> 50, 10 * 0.5% = 0.05 -> 0 and is not credited
+        self.assertEqual(self.book.accrue_interest(Decimal('0.005'), 'HKD'), [(1, 50)])
+        self.assertEqual(self.book.accrue_interest(0.001, 'USD'), [(5, 200)])
+        self.assertEqual(self.book.accrue_interest(0.01, 'EUR'), [])
+        self.assertEqual(self.book.fee_targets(10, 'HKD'), [1, 2])
+        self.assertEqual(self.book.fee_targets(10, 'HKD', below_units=100), [2])
+        with self.assertRaises(ValueError):
+            self.book.accrue_interest(0, 'HKD')
+
+    def check_vectorized_operations(self):
+        self.assertEqual(self.book.currency_totals(), {'HKD': (10015, 3), 'USD': (200000, 1)})
+        self.assertEqual(self.book.scan_extremes(), ((7, 0.0), (5, 2000.0)))
+        self.assertEqual(self.book.accrue_interest(Decimal('0.005'), 'HKD'), [(1, 50)])
+        # Products past int64 fall back to exact integers
+        self.assertEqual(self.book.accrue_interest(Decimal('1.0000000000000000001'), 'USD'), [(5, 200000)])
+        self.assertEqual(self.book.fee_targets(10, 'HKD', below_units=100), [2])
+        self.assertEqual(self.book.fee_targets(0, 'HKD'), [1, 2, 7])
+
+    def test_pure_python_operations(self):
+        print("Unittest: balance book operations without numpy")
+        with mock.patch('balance_book.np', None):
+            self.check_vectorized_operations()
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy_operations(self):
+        print("Unittest: balance book operations with numpy")
+        with mock.patch('balance_book.np', numpy):
+            self.check_vectorized_operations()
+
+class TestFXRates(unittest.TestCase):
+
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        self.write_rates({'USD': '7.8', 'JPY': '0.052'})
+        self.now = 0.0
+        self.rates = FXRates(ttl=60, clock=lambda: self.now)
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def write_rates(self, rates, mtime=None):
+        with open('fx_rates.csv', 'w') as rates_file:
+            rates_file.write('currency,rate\n' + ''.join(f'{currency},{rate}\n' for currency, rate in rates.items()))
+        if mtime is not None:
+            os.utime('fx_rates.csv', (mtime, mtime))
+
+    def test_conversion(self):
+        print("Unittest: FX conversion through the base currency")
+        self.assertEqual(self.rates.rate('USD', 'HKD'), Decimal('7.8'))
+        self.assertEqual(self.rates.rate('USD', 'JPY'), Decimal('150'))
+        self.assertEqual(self.rates.convert_units(1001, 'USD', 'HKD'), 7808)
+        self.assertEqual(self.rates.convert_units(100, 'HKD', 'JPY'), 19)
+        self.assertEqual(self.rates.convert(10, 'USD', 'JPY'), 1500)
+        self.assertEqual(self.rates.consolidate({'HKD': (10000, 2), 'USD': (1000, 1)}), 178)
+        with self.assertRaises(ValueError):
+            self.rates.rate('EUR', 'HKD')
+
+    def test_cached_rates_expire(self):
+        print("Unittest: cached FX rates are refreshed after their time to live")
+        self.assertEqual(self.rates.rate('USD', 'HKD'), Decimal('7.8'))
+        self.write_rates({'USD': '7.75', 'EUR': '8.5'}, mtime=os.path.getmtime('fx_rates.csv') + 10)
+        self.assertEqual(self.rates.rate('USD', 'HKD'), Decimal('7.8'))
+        # A currency missing from the table is looked up again at once
+        self.assertEqual(self.rates.rate('EUR', 'HKD'), Decimal('8.5'))
+        self.now = 61
+        self.write_rates({'USD': '7.7'}, mtime=os.path.getmtime('fx_rates.csv') + 10)
+        self.assertEqual(self.rates.rate('USD', 'HKD'), Decimal('7.7'))
+
+    def test_missing_rates_cached(self):
+        print("Unittest: a currency missing from the table is not looked up again until the cache expires")
+        self.assertFalse(self.rates.has_rates(['USD', 'GBP'], 'HKD'))
+        with mock.patch('fx_rates.os.path.getmtime') as getmtime:
+            for _ in range(3):
+                self.assertFalse(self.rates.has_rates(['USD', 'GBP'], 'HKD'))
+            getmtime.assert_not_called()
+        self.write_rates({'USD': '7.8', 'GBP': '10'}, mtime=os.path.getmtime('fx_rates.csv') + 10)
+        self.assertFalse(self.rates.has_rates(['GBP'], 'HKD'))
+        self.now = 61
+        self.assertEqual(self.rates.rate('GBP', 'HKD'), Decimal('10'))
+
+    def test_cross_currency_transfer(self):
+        print("Unittest: cross-currency transfers and consolidated totals")
+        system = BankingSystem(validation_latency=0)
+        try:
+            system.create_account("Ben", 1000)
+            system.create_account("Victor", 100, 'USD')
+            system.create_account("Kenji", 0, 'JPY')
+            ben, victor, kenji = (system.get_account(name) for name in ("Ben", "Victor", "Kenji"))
+            victor.transfer(ben, 10.01, system)
+            self.assertEqual((victor.balance, ben.balance), (89.99, 1078.08))
+            legs = list(system._generate_account_transaction(ben.account_id))[-1:]
+            self.assertEqual([(leg.type, leg.amount, leg.currency) for leg in legs], [('receive_from', '78.08', 'HKD')])
+            results = system.apply_batch([{'type': 'transfer', 'user_name': 'Ben', 'target_user_name': 'Kenji',
+                                           'amount': 15.6}])
+            self.assertEqual(results[0]['status'], 'Completed')
+            self.assertEqual(kenji.balance, 300)
+            self.assertEqual(list(system._generate_account_transaction(kenji.account_id))[-1].amount, '300.0')
+            with self.assertRaises(ValueError):
+                ben.transfer(kenji, 0.01, system)
+            # 1062.48 + 89.99 * 7.8 + 300 * 0.052, rounded to cents
+            self.assertEqual(system.get_total_balance(), 1780.0)
+            self.assertAlmostEqual(system.get_total_balance('USD'), system.get_total_balance() / 7.8, places=2)
+        finally:
+            system.close()
+
+    def test_totals_without_rates(self):
+        print("Unittest: totals are given per currency when a currency has no FX rate")
+        os.remove('fx_rates.csv')
+        system = BankingSystem(validation_latency=0)
+        try:
+            system.create_account("Ben", 1000)
+            system.create_account("Ricky", 500)
+            system.create_account("Victor", 100, 'USD')
+            with self.assertRaises(ValueError):
+                system.get_total_balance()
+            self.assertIn("Total Balance: HKD $1,500.00, USD $100.00\n"
+                          "Average Account Balance: HKD $750.00, USD $100.00", str(system))
+        finally:
+            system.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import unittest
+import csv
+import glob
+import os
+import tempfile
+import threading
+from sharded_banking_system import ShardedBankingSystem
+ 
+class TestShardedBankingSystem(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.system = ShardedBankingSystem(shard_count=2, base_dir=self.temp_dir.name, validation_latency=0)
+        self.system.create_account("Ben", 500)
+        self.system.create_account("Ricky", 300)
+        self.system.create_account("Victor", 200.25)
+
+    def tearDown(self):
+        self.system.close()
+        self.temp_dir.cleanup()
+
+    def read_rows(self, shard_index, account_id):
+        file_path = os.path.join(self.temp_dir.name, f'shard_{shard_index}', f'{account_id}_transactions.csv')
+        with open(file_path) as csvfile:
+            return list(csv.DictReader(csvfile))
+
+    def test_accounts_partitioned_by_account_id(self):
+        print("Unittest: accounts partitioned across shards")
+        self.assertTrue(os.path.isfile(os.path.join(self.temp_dir.name, 'shard_1', '1_transactions.csv')))
+        self.assertTrue(os.path.isfile(os.path.join(self.temp_dir.name, 'shard_0', '2_transactions.csv')))
+        self.assertEqual(self.system.get_total_accounts(), 3)
+
+    def test_cross_shard_transfer(self):
+        print("Unittest: cross-shard transfer")
+        reference_number = self.system.transfer("Ben", "Ricky", 150)
+        self.assertEqual(self.system.get_balance("Ben"), 350)
+        self.assertEqual(self.system.get_balance("Ricky"), 450)
+
+        self.system.close()
+        debit = self.read_rows(1, 1)[-1]
+        credit = self.read_rows(0, 2)[-1]
+        self.assertEqual((debit['type'], credit['type']), ('transfer_to', 'receive_from'))
+        self.assertEqual(debit['reference_number'], str(reference_number))
+        self.assertEqual(credit['reference_number'], str(reference_number))
+
+    def test_overdraft_aborts_transfer(self):
+        print("Unittest: sharded transfer prevents overdraft")
+        with self.assertRaises(ValueError):
+            self.system.transfer("Victor", "Ricky", 1000)
+        with self.assertRaises(ValueError):
+            self.system.transfer("Ben", "Linda", 10)
+        self.assertEqual(self.system.get_balance("Ben"), 500)
+        self.assertAlmostEqual(self.system.get_total_balance(), 1000.25)
+
+    def test_restart_recovers_committed_transfer(self):
+        print("Unittest: sharded restart finishes a committed transfer")
+        self.system.deposit("Victor", 100)
+        # Simulate a crash after the decision was logged and only the debit leg was written
+        (debit_id, credit_id), reference_number = self.system._allocate(2)
+        self.system._call(1, 'prepare_debit', reference_number, 3, 50)
+        self.system._log_decision({'reference_number': reference_number, 'source_id': 3, 'source_user_name': 'Victor',
+                                   'target_id': 2, 'target_user_name': 'Ricky', 'amount': 50, 'target_amount': 50,
+                                   'debit_transaction_id': debit_id, 'credit_transaction_id': credit_id})
+        self.system._call(1, 'commit_debit', reference_number, debit_id, 2, 'Ricky')
+        self.system.close()
+
+        self.system = ShardedBankingSystem(shard_count=2, base_dir=self.temp_dir.name, validation_latency=0)
+        self.assertEqual(self.system.get_balance("Victor"), 250.25)
+        self.assertEqual(self.system.get_balance("Ricky"), 350)
+        self.assertEqual(self.system.create_account("Linda", 10), 4)
+        # The resolved decision is behind the low-water mark and is not checked again
+        self.assertEqual(self.system._read_decision_mark(), 1)
+        self.system.transfer("Ricky", "Ben", 20)
+        self.assertEqual(self.system.recover(), 0)
+        self.assertEqual(self.system._read_decision_mark(), 2)
+
+    def test_amounts_moved_in_minor_units(self):
+        print("Unittest: sharded deposits and withdrawals in exact minor units")
+        for _ in range(3):
+            self.system.deposit("Victor", 0.1)
+        self.assertEqual(self.system.withdraw("Victor", 0.3), 200.25)
+        with self.assertRaises(ValueError):
+            self.system.deposit("Ben", 0.005)
+        with self.assertRaises(ValueError):
+            self.system.withdraw("Ben", 500.01)
+        self.assertEqual(self.system.get_balance("Ben"), 500)
+
+    def test_cross_currency_transfer(self):
+        print("Unittest: sharded transfer credits the target in its own currency")
+        with open(os.path.join(self.temp_dir.name, 'fx_rates.csv'), 'w', newline='') as csvfile:
+            csvfile.write("currency,rate\nUSD,7.8\nJPY,0.05\n")
+        self.system.fx_rates.reload()
+        self.system.create_account("Sam", 0, 'USD')
+        self.system.create_account("Taro", 0, 'JPY')
+        self.system.transfer("Ben", "Sam", 78)
+        self.system.transfer("Ben", "Taro", 10.55)
+        self.assertEqual(self.system.get_balance("Ben"), 411.45)
+        self.assertEqual(self.system.get_balance("Sam"), 10)
+        self.assertEqual(self.system.get_balance("Taro"), 211)
+        self.assertEqual([decision['target_amount'] for decision in self.system._read_decisions()], [10, 211])
+
+        # An amount the source currency cannot hold exactly is rejected before any decision is logged
+        with self.assertRaises(ValueError):
+            self.system.transfer("Taro", "Ben", 0.5)
+        with self.assertRaises(ValueError):
+            self.system.transfer("Ben", "Sam", 0.001)
+        self.assertEqual(len(self.system._read_decisions()), 2)
+        self.assertEqual(self.system.recover(), 0)
+        self.assertEqual(self.system.get_balance("Taro"), 211)
+
+    def test_concurrent_operations_journal_ids_in_order(self):
+        print("Unittest: every shard journals its transaction ids in order under concurrent routing")
+        user_names = ["Ben", "Ricky", "Victor"]
+
+        def run(offset):
+            for step in range(15):
+                user_name = user_names[(offset + step) % 3]
+                if step % 3 == 0:
+                    self.system.deposit(user_name, 1)
+                elif step % 3 == 1:
+                    self.system.withdraw(user_name, 1)
+                else:
+                    self.system.transfer(user_name, user_names[(offset + step + 1) % 3], 1)
+
+        threads = [threading.Thread(target=run, args=(offset,)) for offset in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertAlmostEqual(self.system.get_total_balance(), 1000.25)
+
+        self.system.close()
+        for shard_index in range(2):
+            file_paths = glob.glob(os.path.join(self.temp_dir.name, f'shard_{shard_index}', '*_transactions.csv'))
+            self.assertTrue(file_paths)
+            for file_path in file_paths:
+                with open(file_path) as csvfile:
+                    transaction_ids = [int(row['transaction_id']) for row in csv.DictReader(csvfile)]
+                self.assertEqual(transaction_ids, sorted(transaction_ids), file_path)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import os
+import tempfile
+from system_reader import CSVLastRowExtractor
+
+class TestCSVLastRowExtractor(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_file(self, name, content):
+        file_path = os.path.join(self.temp_dir.name, name)
+        with open(file_path, 'w', newline='') as f:
+            f.write(content)
+        return file_path
+
+    def test_short_file(self):
+        print("Unittest: last row of a file shorter than one read window")
+        file_path = self.write_file('short.csv', "a,b\n1,2\n")
+        self.assertEqual(CSVLastRowExtractor.extract_last_rows(file_path, ['b', 'a']), ['2', '1'])
+        self.assertEqual(CSVLastRowExtractor.get_last_line(file_path), '1,2')
+
+    def test_quoted_field_with_newlines(self):
+        print("Unittest: last row with a quoted multi-line field")
+        file_path = self.write_file('quoted.csv', 'id,remarks,balance\r\n1,plain,10\r\n2,"line one\nline ""two""\nend",20\r\n')
+        self.assertEqual(CSVLastRowExtractor.extract_last_rows(file_path, ['id', 'remarks', 'balance']),
+                         ['2', 'line one\nline "two"\nend', '20'])
+
+    def test_header_only_and_empty_files(self):
+        print("Unittest: files without data rows")
+        for content in ("a,b\n", "a,b", ""):
+            file_path = self.write_file('no_rows.csv', content)
+            with self.assertRaises(ValueError):
+                CSVLastRowExtractor.extract_last_rows(file_path, ['a'])
+
+    def test_missing_column(self):
+        print("Unittest: missing column")
+        file_path = self.write_file('columns.csv', "a,b\n1,2\n")
+        with self.assertRaises(ValueError):
+            CSVLastRowExtractor.extract_last_rows(file_path, ['c'])
+
+    def test_extract_last_rows_many(self):
+        print("Unittest: last rows of several files")
+        paths = [self.write_file(f'{i}.csv', f"id,balance\n{i},{i * 10}\n{i},{i * 100}\n") for i in range(1, 4)]
+        paths.append(self.write_file('4.csv', 'balance,id\n"40\n",4\n'))
+        self.assertEqual(CSVLastRowExtractor.extract_last_rows_many(paths, ['id', 'balance']),
+                         [['1', '100'], ['2', '200'], ['3', '300'], ['4', '40\n']])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,305 @@
+import unittest
+import csv
+import os
+import tempfile
+from banking_system import BankingSystem
+from binary_journal import BinaryTransactionJournal, StringTable, binary_path_for, binary_to_csv, csv_to_binary, read_column
+from system_reader import CSVLastRowExtractor
+from transaction_journal import TransactionJournal, TRANSACTION_FIELDNAMES
+from segmented_journal import SegmentedTransactionJournal, migrate_account_files
+from write_ahead_log import WriteAheadJournal, encode_entry, read_entries
+
+class TestTransactionJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, '1_transactions.csv')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_row(self, transaction_id, balance):
+        return [transaction_id, '2025-04-08T16:37:04.411434', 1, 'Ben', 'deposit', 100, 'HKD', balance,
+                None, None, transaction_id, '2025-04-08T16:37:04.516459', 'Completed', None]
+
+    def test_rows_buffered_until_flush(self):
+        print("Unittest: journal buffers rows until flush")
+        journal = TransactionJournal(max_buffered_rows=10, flush_interval=None)
+        journal.append(self.file_path, TRANSACTION_FIELDNAMES, self.make_row(1, 100))
+        journal.commit()
+        self.assertEqual(os.path.getsize(self.file_path), 0)
+        self.assertEqual(journal.buffered_rows, 1)
+
+        journal.flush()
+        self.assertEqual(CSVLastRowExtractor.extract_last_rows(self.file_path, ['transaction_id', 'balance']), ['1', '100'])
+        journal.close()
+
+    def test_size_threshold_flushes_at_commit(self):
+        print("Unittest: journal flushes at size threshold")
+        journal = TransactionJournal(max_buffered_rows=2, flush_interval=None)
+        journal.append(self.file_path, TRANSACTION_FIELDNAMES, self.make_row(1, 100))
+        journal.append(self.file_path, TRANSACTION_FIELDNAMES, self.make_row(2, 200))
+        journal.commit()
+        self.assertEqual(journal.buffered_rows, 0)
+        self.assertEqual(CSVLastRowExtractor.extract_last_rows(self.file_path, ['transaction_id', 'balance']), ['2', '200'])
+        journal.close()
+
+    def test_header_written_once_across_reopen(self):
+        print("Unittest: journal writes the header once")
+        for transaction_id in (1, 2):
+            journal = TransactionJournal(fsync_policy='transaction', flush_interval=None)
+            journal.append(self.file_path, TRANSACTION_FIELDNAMES, self.make_row(transaction_id, transaction_id * 100))
+            journal.commit()
+            journal.close()
+
+        with open(self.file_path) as csvfile:
+            lines = csvfile.read().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[0], ','.join(TRANSACTION_FIELDNAMES))
+
+    def test_invalid_fsync_policy(self):
+        print("Unittest: journal rejects unknown fsync policy")
+        with self.assertRaises(ValueError):
+            TransactionJournal(fsync_policy='sometimes')
+
+class TestBinaryTransactionJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, '1_transactions.csv')
+        self.strings_path = os.path.join(self.temp_dir.name, 'system_strings.jsonl')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_row(self, transaction_id, balance, remarks=None):
+        return [transaction_id, '2025-04-08T16:37:04.411434', 1, 'Ben', 'deposit', 100, 'HKD', balance,
+                None, None, transaction_id, '2025-04-08T16:37:04.516459', 'Completed', remarks]
+
+    def test_round_trip(self):
+        print("Unittest: binary journal round trip")
+        journal = BinaryTransactionJournal(self.strings_path, flush_interval=None)
+        journal.append(self.file_path, TRANSACTION_FIELDNAMES, self.make_row(1, 100))
+        journal.append(self.file_path, TRANSACTION_FIELDNAMES, self.make_row(2, 200.25, 'Insufficient funds, "retry"'))
+        journal.commit()
+        self.assertTrue(journal.exists(self.file_path))
+        self.assertEqual(journal.read_last_row(self.file_path, ['transaction_id', 'balance', 'remarks']),
+                         ['2', '200.25', 'Insufficient funds, "retry"'])
+        journal.close()
+
+        # A fresh journal decodes the rows with the persisted string table
+        journal = BinaryTransactionJournal(self.strings_path, flush_interval=None)
+        rows = list(journal.iter_rows(self.file_path))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['timestamp_start'], '2025-04-08T16:37:04.411434')
+        self.assertEqual(rows[0]['target_id'], '')
+        self.assertEqual(rows[0]['user_name'], 'Ben')
+        self.assertEqual(read_column(binary_path_for(self.file_path), 'balance'), [100.0, 200.25])
+        journal.close()
+
+    def test_torn_record_ignored(self):
+        print("Unittest: binary journal ignores a torn record")
+        journal = BinaryTransactionJournal(self.strings_path, flush_interval=None)
+        journal.append(self.file_path, TRANSACTION_FIELDNAMES, self.make_row(1, 100))
+        journal.close()
+        with open(binary_path_for(self.file_path), 'ab') as binary_file:
+            binary_file.write(b'\x01' * 10)
+
+        journal = BinaryTransactionJournal(self.strings_path, flush_interval=None)
+        self.assertEqual([row['transaction_id'] for row in journal.iter_rows(self.file_path)], ['1'])
+        self.assertEqual(journal.read_last_row(self.file_path, ['balance']), ['100.0'])
+        journal.close()
+
+    def test_csv_conversion(self):
+        print("Unittest: convert CSV to binary and back")
+        journal = TransactionJournal(flush_interval=None)
+        journal.append(self.file_path, TRANSACTION_FIELDNAMES, self.make_row(1, 100.5))
+        journal.close()
+
+        strings = StringTable(self.strings_path)
+        self.assertEqual(csv_to_binary(self.file_path, strings), 1)
+        csv_copy = os.path.join(self.temp_dir.name, 'copy.csv')
+        self.assertEqual(binary_to_csv(binary_path_for(self.file_path), strings, csv_copy), 1)
+        with open(self.file_path) as original, open(csv_copy) as copy:
+            original_row, copied_row = next(csv.DictReader(original)), next(csv.DictReader(copy))
+        # Amounts and balances come back as floats
+        self.assertEqual(copied_row['amount'], '100.0')
+        copied_row['amount'] = original_row['amount']
+        self.assertEqual(original_row, copied_row)
+
+class TestWriteAheadJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, '1_transactions.csv')
+        self.system_path = os.path.join(self.temp_dir.name, 'system_transactions.csv')
+        self.wal_path = os.path.join(self.temp_dir.name, 'system_wal.log')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_row(self, transaction_id, balance):
+        return [transaction_id, '2025-04-08T16:37:04.411434', 1, 'Ben', 'deposit', 100, 'HKD', balance,
+                None, None, transaction_id, '2025-04-08T16:37:04.516459', 'Completed', None]
+
+    def read_ids(self, file_path):
+        with open(file_path, newline='') as csvfile:
+            return [row['transaction_id'] for row in csv.DictReader(csvfile)]
+
+    def test_commit_is_one_log_entry(self):
+        print("Unittest: WAL commit writes one entry")
+        journal = WriteAheadJournal(self.wal_path, flush_interval=None)
+        journal.append(self.system_path, TRANSACTION_FIELDNAMES, self.make_row(1, 100))
+        journal.append(self.file_path, TRANSACTION_FIELDNAMES, self.make_row(1, 100))
+        journal.commit()
+        entries, _ = read_entries(self.wal_path)
+        self.assertEqual(len(entries), 1)
+        self.assertEqual([write[0] for write in entries[0][1]], [self.system_path, self.file_path])
+
+        self.assertEqual(journal.read_last_row(self.file_path, ['balance']), ['100'])
+        self.assertEqual(os.path.getsize(self.wal_path), 0)
+        journal.close()
+        self.assertEqual(self.read_ids(self.system_path), ['1'])
+
+    def test_recovery_repairs_torn_tails(self):
+        print("Unittest: WAL recovery truncates torn tails and replays once")
+        first_entry = encode_entry(1, [[self.file_path, TRANSACTION_FIELDNAMES, [self.make_row(1, 100)]]])
+        second_entry = encode_entry(2, [[self.file_path, TRANSACTION_FIELDNAMES, [self.make_row(2, 200)]]])
+        torn_entry = encode_entry(3, [[self.file_path, TRANSACTION_FIELDNAMES, [self.make_row(3, 300)]]])[:-5]
+        with open(self.wal_path, 'wb') as wal_file:
+            wal_file.write(first_entry + second_entry + torn_entry)
+        # The first row reached the account file, the second one only partly
+        journal = TransactionJournal(flush_interval=None)
+        journal.append(self.file_path, TRANSACTION_FIELDNAMES, self.make_row(1, 100))
+        journal.close()
+        with open(self.file_path, 'a') as csvfile:
+            csvfile.write('2,2025-04-08T16:37:04.411434,1,Be')
+
+        journal = WriteAheadJournal(self.wal_path, flush_interval=None)
+        self.assertEqual(journal.recovery_stats['entries'], 2)
+        self.assertEqual(journal.recovery_stats['rows_replayed'], 1)
+        self.assertEqual(journal.recovery_stats['torn_log_bytes'], len(torn_entry))
+        self.assertGreater(journal.recovery_stats['torn_file_bytes'], 0)
+        journal.close()
+        self.assertEqual(self.read_ids(self.file_path), ['1', '2'])
+
+        # Replaying the same log again changes nothing
+        with open(self.wal_path, 'wb') as wal_file:
+            wal_file.write(first_entry + second_entry)
+        journal = WriteAheadJournal(self.wal_path, flush_interval=None)
+        self.assertEqual(journal.recovery_stats['rows_replayed'], 0)
+        journal.close()
+        self.assertEqual(self.read_ids(self.file_path), ['1', '2'])
+
+    def test_recovery_closes_replayed_files(self):
+        print("Unittest: WAL recovery leaves no handle open on the files it replayed")
+        with open(self.wal_path, 'wb') as wal_file:
+            wal_file.write(encode_entry(1, [[self.file_path, TRANSACTION_FIELDNAMES, [self.make_row(1, 100)]]]))
+        journal = WriteAheadJournal(self.wal_path, flush_interval=None)
+        self.assertEqual(journal.recovery_stats['rows_replayed'], 1)
+        # A file rewritten after recovery, as the scheduler compacts its orders file at startup
+        temp_path = self.file_path + '.tmp'
+        with open(self.file_path) as source, open(temp_path, 'w') as target:
+            target.write(source.read())
+        os.replace(temp_path, self.file_path)
+        journal.append(self.file_path, TRANSACTION_FIELDNAMES, self.make_row(2, 200))
+        journal.close()
+        self.assertEqual(self.read_ids(self.file_path), ['1', '2'])
+
+class TestSegmentedTransactionJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.segment_dir = os.path.join(self.temp_dir.name, 'segments')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_row(self, transaction_id, account_id, balance, remarks=None):
+        return [transaction_id, '2025-04-08T16:37:04.411434', account_id, f'user_{account_id}', 'deposit', 100, 'HKD',
+                balance, None, None, transaction_id, '2025-04-08T16:37:04.516459', 'Completed', remarks]
+
+    def open_journal(self, **kwargs):
+        return SegmentedTransactionJournal(self.segment_dir, flush_interval=None, max_buffered_rows=1, **kwargs)
+
+    def balances(self, journal, account_id):
+        return [record.balance for record in journal.iter_records(f'{account_id}_transactions.csv')]
+
+    def test_rolls_and_reopens(self):
+        print("Unittest: segmented journal rolls segments and rebuilds its index")
+        journal = self.open_journal(max_segment_bytes=400, compact_threshold=None)
+        for transaction_id in range(1, 13):
+            account_id = transaction_id % 3 + 1
+            remarks = 'line one\nline "two"' if transaction_id == 5 else None
+            journal.append(f'{account_id}_transactions.csv', TRANSACTION_FIELDNAMES,
+                           self.make_row(transaction_id, account_id, transaction_id * 10, remarks))
+            journal.commit()
+        self.assertEqual(self.balances(journal, 1), ['30', '60', '90', '120'])
+        self.assertGreater(journal.segment_count, 2)
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir.name, '1_transactions.csv')))
+        journal.close()
+
+        # A torn last row of the active segment is dropped at startup
+        active = sorted(name for name in os.listdir(self.segment_dir) if name.endswith('.csv'))[-1]
+        with open(os.path.join(self.segment_dir, active), 'ab') as segment_file:
+            segment_file.write(b'2,13,2025-04')
+        journal = self.open_journal(max_segment_bytes=400, compact_threshold=None)
+        self.assertEqual(self.balances(journal, 3), ['20', '50', '80', '110'])
+        self.assertEqual(list(journal.iter_rows('3_transactions.csv'))[1]['remarks'], 'line one\nline "two"')
+        self.assertEqual(journal.read_last_row('2_transactions.csv', ['transaction_id', 'balance']), ['10', '100'])
+        self.assertTrue(journal.exists('1_transactions.csv'))
+        self.assertFalse(journal.exists('4_transactions.csv'))
+        journal.close()
+
+    def test_compaction(self):
+        print("Unittest: segment compaction groups each account's rows")
+        journal = self.open_journal(max_segment_bytes=300, compact_threshold=None)
+        for transaction_id in range(1, 21):
+            account_id = transaction_id % 4 + 1
+            journal.append(f'{account_id}_transactions.csv', TRANSACTION_FIELDNAMES,
+                           self.make_row(transaction_id, account_id, transaction_id))
+            journal.commit()
+        expected = {account_id: self.balances(journal, account_id) for account_id in range(1, 5)}
+        segments_before = journal.segment_count
+        self.assertGreater(journal.compact(), 0)
+        self.assertEqual(journal.segment_count, 2)
+        self.assertLess(journal.segment_count, segments_before)
+        self.assertEqual({account_id: self.balances(journal, account_id) for account_id in range(1, 5)}, expected)
+        journal.append('1_transactions.csv', TRANSACTION_FIELDNAMES, self.make_row(21, 1, 21))
+        journal.close()
+
+        journal = self.open_journal(max_segment_bytes=300)
+        self.assertEqual(self.balances(journal, 1), expected[1] + ['21'])
+        self.assertEqual(self.balances(journal, 2), expected[2])
+        journal.close()
+
+    def test_migration_and_banking_system(self):
+        print("Unittest: migrating per-account files and running a banking system on segments")
+        original_dir = os.getcwd()
+        os.chdir(self.temp_dir.name)
+        try:
+            system = BankingSystem(validation_latency=0)
+            system.create_account("Ben", 500)
+            system.create_account("Ricky", 300)
+            system.get_account("Ben").transfer(system.get_account("Ricky"), 50, system)
+            system.close()
+
+            journal = self.open_journal()
+            self.assertEqual(migrate_account_files(journal), (2, 4))
+            self.assertFalse(os.path.exists('1_transactions.csv'))
+            self.assertEqual(migrate_account_files(journal), (0, 0))
+            journal.close()
+
+            system = BankingSystem(validation_latency=0, journal=self.open_journal())
+            ben = system.get_account("Ben")
+            self.assertEqual((ben.balance, system.get_account("Ricky").balance), (450, 350))
+            ben.deposit(25, system)
+            self.assertEqual([record.type for record in system._generate_account_transaction(ben.account_id)],
+                             ['create_account', 'transfer_to', 'deposit'])
+            system.close()
+            self.assertEqual(sorted(os.listdir('.')), ['segments', 'system_accounts.csv', 'system_transactions.csv'])
+        finally:
+            os.chdir(original_dir)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+import csv
+import os
+import tempfile
+from unittest import mock
+from fx_rates import FXRates
+from transaction_journal import TRANSACTION_FIELDNAMES
+from transaction_reports import TransactionReports
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class TestTransactionReports(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, 'system_transactions.csv')
+        self.transaction_id = 0
+        with open(self.file_path, 'w', newline='') as csvfile:
+            csv.writer(csvfile).writerow(TRANSACTION_FIELDNAMES)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_rows(self, rows):
+        with open(self.file_path, 'a', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            for day, account_id, transaction_type, amount, status, *currency in rows:
+                self.transaction_id += 1
+                writer.writerow([self.transaction_id, f'{day}T09:00:00', account_id, f'user_{account_id}',
+                                 transaction_type, amount, currency[0] if currency else 'HKD', 1000, None, None, self.transaction_id,
+                                 f'{day}T09:00:01', status, None])
+
+    def test_reports(self):
+        print("Unittest: columnar transaction reports")
+        self.write_rows([
+            ('2025-04-08', 1, 'deposit', 100, 'Completed'),
+            ('2025-04-08', 1, 'withdraw', 30, 'Completed'),
+            ('2025-04-08', 2, 'withdraw', 50, 'Failed'),
+            ('2025-04-09', 2, 'transfer_to', 80, 'Completed'),
+            ('2025-04-09', 1, 'receive_from', 80, 'Completed'),
+        ])
+        reports = TransactionReports(self.file_path, chunk_bytes=256)
+        self.assertEqual(reports.refresh(), 5)
+        self.assertGreater(len(reports._chunks), 1)
+        self.assertEqual(reports.daily_volume(until='2025-04-08'), {'2025-04-08': {
+            'deposit': {'HKD': {'count': 1, 'amount': 100.0}}, 'withdraw': {'HKD': {'count': 1, 'amount': 30.0}}}})
+        self.assertEqual(reports.top_outflow(), {'HKD': [(2, 80.0, 1), (1, 30.0, 1)]})
+        self.assertEqual(reports.status_counts()['withdraw'], {'Completed': 1, 'Failed': 1})
+        median = reports.amount_percentiles(percentiles=(0.5,))[0.5]
+        self.assertTrue(60 < median < 110)
+        self.assertIsNone(reports.amount_percentiles('fee')[0.5])
+
+    def test_incremental_refresh(self):
+        print("Unittest: reports only read new rows")
+        self.write_rows([('2025-04-08', 1, 'withdraw', 10, 'Completed')] * 20)
+        reports = TransactionReports(self.file_path, chunk_bytes=512)
+        self.assertEqual(reports.refresh(), 20)
+        self.write_rows([('2025-04-09', 2, 'withdraw', 5, 'Completed')] * 3)
+
+        # A new instance continues from the cached partial aggregates
+        reports = TransactionReports(self.file_path, chunk_bytes=512)
+        self.assertEqual(reports.refresh(), 3)
+        self.assertEqual(reports.row_count, 23)
+        self.assertEqual(reports.top_outflow(), {'HKD': [(1, 200.0, 20), (2, 15.0, 3)]})
+        self.assertEqual(reports.refresh(), 0)
+
+        # A truncated file drops the chunks past the cut and reads them again
+        with open(self.file_path, 'rb+') as data_file:
+            data_file.truncate(reports._chunks[1]['end'] - 1)
+        reports.refresh()
+        self.assertLess(reports.row_count, 23)
+        self.assertEqual(reports.status_counts()['withdraw']['Completed'], reports.row_count)
+
+    def test_top_outflow_per_currency(self):
+        print("Unittest: top outflow ranked per currency or converted")
+        self.write_rows([
+            ('2025-04-08', 1, 'withdraw', 500, 'Completed', 'JPY'),
+            ('2025-04-08', 2, 'withdraw', 100, 'Completed', 'USD'),
+            ('2025-04-08', 3, 'fee', 200, 'Completed'),
+        ])
+        reports = TransactionReports(self.file_path)
+        reports.refresh()
+        self.assertEqual(reports.top_outflow(), {'HKD': [(3, 200.0, 1)], 'JPY': [(1, 500.0, 1)],
+                                                 'USD': [(2, 100.0, 1)]})
+        rates_path = os.path.join(self.temp_dir.name, 'fx_rates.csv')
+        with open(rates_path, 'w') as rates_file:
+            rates_file.write('currency,rate\nUSD,7.8\nJPY,0.052\n')
+        fx_rates = FXRates(rates_path)
+        self.assertEqual(reports.top_outflow(fx_rates=fx_rates), {'HKD': [(2, 780.0, 1), (3, 200.0, 1), (1, 26.0, 1)]})
+        self.assertEqual(reports.top_outflow(1, fx_rates, 'USD'), {'USD': [(2, 100.0, 1)]})
+
+    def check_aggregates(self):
+        self.write_rows([
+            ('2025-04-08', 1, 'deposit', 100, 'Completed'),
+            ('2025-04-08', 1, 'withdraw', 30, 'Completed'),
+            ('2025-04-08', 2, 'withdraw', 50, 'Failed', 'USD'),
+            ('2025-04-09', 2, 'transfer_to', 80, 'Completed', 'USD'),
+            ('2025-04-09', 2, 'transfer_to', 20, 'Completed', 'USD'),
+        ])
+        reports = TransactionReports(self.file_path, chunk_bytes=256)
+        reports.refresh()
+        self.assertEqual(reports.daily_volume(since='2025-04-09'),
+                         {'2025-04-09': {'transfer_to': {'USD': {'count': 2, 'amount': 100.0}}}})
+        self.assertEqual(reports.top_outflow(), {'HKD': [(1, 30.0, 1)], 'USD': [(2, 100.0, 2)]})
+        self.assertEqual(reports.status_counts(), {'deposit': {'Completed': 1},
+                                                   'withdraw': {'Completed': 1, 'Failed': 1},
+                                                   'transfer_to': {'Completed': 2}})
+        self.assertEqual(reports._aggregates()['amounts'], {('deposit', 32): 1, ('withdraw', 28): 1,
+                                                            ('transfer_to', 32): 1, ('transfer_to', 27): 1})
+
+    def test_pure_python_aggregates(self):
+        print("Unittest: transaction report aggregates without numpy")
+        with mock.patch('transaction_reports.np', None):
+            self.check_aggregates()
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy_aggregates(self):
+        print("Unittest: transaction report aggregates with numpy")
+        with mock.patch('transaction_reports.np', numpy):
+            self.check_aggregates()
+
+if __name__ == "__main__":
+    unittest.main()
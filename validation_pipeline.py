@@ -0,0 +1,153 @@
+import heapq
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class _PipelineEntry:
+    __slots__ = ('item', 'future', 'done', 'valid', 'error', 'cancelled', 'group')
+
+    def __init__(self, group):
+        self.item = None
+        self.future = None
+        self.done = False
+        self.valid = False
+        self.error = None
+        self.cancelled = False
+        self.group = group
+
+
+class ValidationPipeline:
+    """
+    A thread-pool-backed pipeline that overlaps transaction validation and commits results in order.
+
+    Items are validated concurrently, but each item is committed only after every
+    item with a smaller sequence id (the transaction_id) has been committed, so the
+    journal is always written in transaction-id order. Sequence ids can be reserved
+    when they are allocated, before their items are ready, which keeps that order
+    when several threads allocate ids at once. The number of reservations in flight
+    is bounded by max_in_flight; reserve() and submit() block once the limit is
+    reached, which gives callers backpressure.
+    """
+    def __init__(self, validator, committer, max_in_flight: int = 64) -> None:
+        """
+        Initialize the ValidationPipeline.
+
+        :param validator: Callable taking an item and returning True if it is valid
+        :param committer: Callable taking an item and its validity, returning the committed result
+        :param max_in_flight: Maximum number of reservations being validated or waiting to commit
+        :raise ValueError: If max_in_flight is not positive
+        """
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1.")
+        self.max_in_flight = max_in_flight
+        self._validator = validator
+        self._committer = committer
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='validator')
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = []  # heap of sequence ids waiting to be committed
+        self._entries = {}  # sequence id -> _PipelineEntry
+
+    def reserve(self, sequence_ids):
+        """
+        Reserve commit positions for sequence ids whose items will be submitted later.
+
+        The reserved ids share one in-flight slot, released once all of them are committed or cancelled.
+
+        :param sequence_ids: Sequence ids to reserve
+        """
+        self._slots.acquire()
+        group = [len(sequence_ids)]
+        with self._lock:
+            for sequence_id in sequence_ids:
+                heapq.heappush(self._pending, sequence_id)
+                self._entries[sequence_id] = _PipelineEntry(group)
+
+    def submit(self, sequence_id: int, item) -> Future:
+        """
+        Submit an item for validation, reserving its sequence id first if needed.
+
+        :param sequence_id: Commit order key, unique per item (the transaction_id)
+        :param item: Item passed to the validator and the committer
+        :return: Future resolved with the committer's result once the item is committed
+        """
+        with self._lock:
+            entry = self._entries.get(sequence_id)
+        if entry is None:
+            self.reserve([sequence_id])
+            with self._lock:
+                entry = self._entries[sequence_id]
+        future = Future()
+        entry.item = item
+        entry.future = future
+        try:
+            validation = self._executor.submit(self._validator, item)
+        except RuntimeError as e:
+            # The executor has been shut down
+            self._on_validated(sequence_id, None, e)
+            return future
+        validation.add_done_callback(lambda done: self._on_validated(sequence_id, done))
+        return future
+
+    def cancel(self, sequence_ids):
+        """
+        Give up reserved sequence ids whose items will never be submitted.
+
+        :param sequence_ids: Reserved sequence ids
+        """
+        with self._lock:
+            for sequence_id in sequence_ids:
+                entry = self._entries.get(sequence_id)
+                if entry is not None and entry.future is None:
+                    entry.cancelled = True
+                    entry.done = True
+            self._commit_ready()
+
+    def _on_validated(self, sequence_id, validation, error=None):
+        with self._lock:
+            entry = self._entries[sequence_id]
+            if error is None:
+                error = validation.exception()
+                if error is None:
+                    entry.valid = bool(validation.result())
+            entry.error = error
+            entry.done = True
+            self._commit_ready()
+
+    def _commit_ready(self):
+        # Commit every item at the head of the queue whose validation has finished
+        while self._pending and self._entries[self._pending[0]].done:
+            entry = self._entries.pop(heapq.heappop(self._pending))
+            try:
+                if entry.cancelled:
+                    continue
+                if entry.error is not None:
+                    raise entry.error
+                entry.future.set_result(self._committer(entry.item, entry.valid))
+            except Exception as e:
+                entry.future.set_exception(e)
+            finally:
+                entry.group[0] -= 1
+                if entry.group[0] == 0:
+                    self._slots.release()
+        if not self._entries:
+            self._idle.notify_all()
+
+    @property
+    def in_flight(self):
+        return len(self._entries)
+
+    def wait_idle(self):
+        """
+        Block until every reserved or submitted item has been committed.
+        """
+        with self._lock:
+            while self._entries:
+                self._idle.wait()
+
+    def close(self):
+        """
+        Wait for in-flight items to be committed and stop the worker threads.
+        """
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,289 @@
+import json
+import os
+import queue
+import struct
+import threading
+import zlib
+from system_reader import CSVLastRowExtractor
+from transaction_journal import TransactionJournal, FSYNC_TRANSACTION
+
+# Every entry is its payload length and CRC-32, followed by the payload: one JSON document per commit
+ENTRY_HEADER = struct.Struct('<II')
+
+
+def encode_entry(sequence, writes):
+    """
+    Encode one committed group of rows as a checksummed WAL entry.
+
+    :param sequence: Commit sequence number
+    :param writes: List of (file_path, header, rows) tuples
+    :return: The entry's bytes
+    """
+    payload = json.dumps([sequence, writes], separators=(',', ':')).encode()
+    return ENTRY_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_entries(wal_path):
+    """
+    Read the complete, intact entries of a WAL file.
+
+    :param wal_path: Path of the WAL file
+    :return: Tuple of the list of (sequence, writes) entries and the byte offset where intact entries end
+    """
+    if not os.path.isfile(wal_path):
+        return [], 0
+    with open(wal_path, 'rb') as wal_file:
+        data = wal_file.read()
+    entries = []
+    offset = 0
+    while offset + ENTRY_HEADER.size <= len(data):
+        length, checksum = ENTRY_HEADER.unpack_from(data, offset)
+        start = offset + ENTRY_HEADER.size
+        payload = data[start:start + length]
+        # A torn or corrupted write ends the log: it was never acknowledged
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            break
+        try:
+            sequence, writes = json.loads(payload)
+        except ValueError:
+            break
+        entries.append((sequence, writes))
+        offset = start + length
+    return entries, offset
+
+
+def repair_torn_tail(file_path):
+    """
+    Cut a partially written last line off a CSV file, so tail readers never see half a row.
+
+    :return: Number of bytes removed
+    """
+    if not os.path.isfile(file_path):
+        return 0
+    with open(file_path, 'rb+') as csv_file:
+        size = csv_file.seek(0, os.SEEK_END)
+        if size == 0:
+            return 0
+        csv_file.seek(size - 1)
+        if csv_file.read(1) == b'\n':
+            return 0
+        # Scan back in blocks for the end of the last complete line
+        position = size
+        keep = 0
+        while position > 0:
+            block_start = max(0, position - 65536)
+            csv_file.seek(block_start)
+            newline = csv_file.read(position - block_start).rfind(b'\n')
+            if newline >= 0:
+                keep = block_start + newline + 1
+                break
+            position = block_start
+        csv_file.truncate(keep)
+        return size - keep
+
+
+def _last_key(file_path):
+    """
+    Return the integer first column of a CSV file's last row, or None for a missing or header-only file.
+    """
+    if not os.path.isfile(file_path):
+        return None
+    try:
+        _, last_row = CSVLastRowExtractor.read_header_and_last_row(file_path)
+        return int(last_row[0])
+    except (ValueError, IndexError, StopIteration):
+        return None
+
+
+def _row_is_applied(row, last_key):
+    try:
+        return int(row[0]) <= last_key
+    except (TypeError, ValueError):
+        # Rows without an integer key cannot be matched, so they are always replayed
+        return False
+
+
+class WriteAheadJournal(TransactionJournal):
+    """
+    A journal whose commit point is one checksummed, append-only write-ahead log.
+
+    Rows appended between two commits are encoded as a single WAL entry at commit(),
+    so a transaction's system_transactions.csv, account file and system_accounts.csv
+    rows become durable together with one sequential write. Each thread has its own
+    group of pending rows, so a commit never takes in rows another thread is still
+    appending, e.g. the scheduler's order rows while the pipeline commits a
+    transaction. The CSV files are derived from the log by a background applier
+    thread, through the TransactionJournal's buffering, and keep their usual format
+    for every reader. Reads and flush() wait for the applier to catch up. Once the
+    CSV files are flushed the log is emptied.
+
+    At startup, recover() truncates a torn last entry and replays the intact entries
+    into the CSV files after cutting off any half-written last line. Replay is
+    idempotent: each CSV file is keyed by the increasing integer in its first column
+    (transaction_id, or account_id for system_accounts.csv), and rows at or below the
+    file's last key are already there. The replayed files are closed again, so a file
+    rewritten at startup, e.g. by the scheduler's compaction, is reopened by its next append.
+
+    Fsync policies:
+        'none'        - the log is written to the OS page cache at every commit (default)
+        'batch'       - the CSV files are fsynced at every flush, before the log is emptied
+        'transaction' - the log is fsynced at every commit()
+    """
+    def __init__(self, wal_path: str = 'system_wal.log', max_wal_bytes: int = 64 * 1024 * 1024,
+                 max_pending_entries: int = 10_000, **kwargs) -> None:
+        """
+        Initialize the WriteAheadJournal and recover the CSV files from an existing log.
+
+        :param wal_path: Path of the write-ahead log (default is 'system_wal.log')
+        :param max_wal_bytes: Log size that triggers a flush of the CSV files and an emptied log (default is 64 MiB)
+        :param max_pending_entries: Number of committed entries the applier may lag behind before commit() blocks
+                                    (default is 10,000)
+        :param kwargs: TransactionJournal settings, used for the derived CSV files
+        """
+        super().__init__(**kwargs)
+        self.wal_path = wal_path
+        self.max_wal_bytes = max_wal_bytes
+        self._wal_lock = threading.RLock()
+        self._pending = {}  # thread id -> writes appended by that thread since its last commit
+        self._sequence = 0
+        self._applied_sequence = 0
+        self._applied = threading.Condition()
+        self._applier_error = None
+        self.recovery_stats = self.recover()
+        self._wal = open(wal_path, 'ab')
+        self._queue = queue.Queue(maxsize=max_pending_entries)
+        self._applier = threading.Thread(target=self._apply_entries, name='wal-applier', daemon=True)
+        self._applier.start()
+
+    def recover(self):
+        """
+        Truncate a torn log tail, replay the intact entries into the CSV files and empty the log.
+
+        :return: Dictionary with the number of entries and rows replayed and of torn bytes removed
+        """
+        entries, intact_end = read_entries(self.wal_path)
+        stats = {'entries': len(entries), 'rows_replayed': 0, 'torn_log_bytes': 0, 'torn_file_bytes': 0}
+        if os.path.isfile(self.wal_path):
+            stats['torn_log_bytes'] = os.path.getsize(self.wal_path) - intact_end
+        last_keys = {}
+        for _, writes in entries:
+            for file_path, header, rows in writes:
+                if file_path not in last_keys:
+                    stats['torn_file_bytes'] += repair_torn_tail(file_path)
+                    last_keys[file_path] = _last_key(file_path)
+                last_key = last_keys[file_path]
+                if last_key is not None:
+                    rows = [row for row in rows if not _row_is_applied(row, last_key)]
+                if rows:
+                    super().append_many(file_path, header, rows)
+                    stats['rows_replayed'] += len(rows)
+        self._close_files()
+        if os.path.isfile(self.wal_path):
+            # Also drops the torn tail
+            os.truncate(self.wal_path, 0)
+        return stats
+
+    def append_many(self, file_path, header, rows):
+        rows = list(rows)
+        if rows:
+            with self._wal_lock:
+                self._pending.setdefault(threading.get_ident(), []).append((file_path, header, rows))
+
+    def commit(self):
+        """
+        Write the rows the calling thread appended since its last commit to the log as one entry
+        and hand them to the applier.
+        """
+        with self._wal_lock:
+            self._raise_applier_error()
+            writes = self._pending.pop(threading.get_ident(), None)
+            if writes:
+                self._commit_locked(writes)
+
+    def _commit_locked(self, writes):
+        self._sequence += 1
+        self._wal.write(encode_entry(self._sequence, writes))
+        self._wal.flush()
+        if self.fsync_policy == FSYNC_TRANSACTION:
+            os.fsync(self._wal.fileno())
+        self._queue.put((self._sequence, writes))
+        if self._wal.tell() >= self.max_wal_bytes:
+            self._checkpoint_locked()
+
+    def _apply_entries(self):
+        while True:
+            entry = self._queue.get()
+            entries = [entry]
+            # Apply every entry already waiting as one group
+            while entry is not None:
+                try:
+                    entry = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                entries.append(entry)
+            stop = entries[-1] is None
+            entries = [entry for entry in entries if entry is not None]
+            if entries:
+                try:
+                    with self._lock:
+                        for _, writes in entries:
+                            for file_path, header, rows in writes:
+                                super().append_many(file_path, header, rows)
+                        super().commit()
+                except BaseException as e:
+                    self._applier_error = e
+                with self._applied:
+                    self._applied_sequence = entries[-1][0]
+                    self._applied.notify_all()
+            if stop:
+                return
+
+    def _raise_applier_error(self):
+        if self._applier_error is not None:
+            raise RuntimeError("The WAL applier failed; the CSV files are behind the log.") from self._applier_error
+
+    def _wait_applied(self):
+        sequence = self._sequence
+        with self._applied:
+            self._applied.wait_for(lambda: self._applied_sequence >= sequence)
+        self._raise_applier_error()
+
+    def _checkpoint_locked(self):
+        """
+        Flush the CSV files once the applier has caught up, then empty the log. Called with the WAL lock held.
+        """
+        self._wait_applied()
+        super().flush()
+        self._wal.truncate(0)
+        self._wal.seek(0)
+
+    def flush(self):
+        """
+        Commit the calling thread's pending rows, wait for the applier and write every CSV row to disk.
+        """
+        with self._wal_lock:
+            self.commit()
+            self._checkpoint_locked()
+
+    def close(self):
+        """
+        Apply every committed entry, close the CSV files, stop the applier and empty the log.
+        """
+        with self._wal_lock:
+            if self._wal.closed:
+                return
+            for writes in self._pending.values():
+                self._commit_locked(writes)
+            self._pending.clear()
+            self._queue.put(None)
+            self._applier.join()
+            super().close()
+            self._wal.truncate(0)
+            self._wal.close()
+        self._raise_applier_error()
+
+    def exists(self, file_path):
+        if self._sequence > self._applied_sequence:
+            self._wait_applied()
+        return super().exists(file_path)
+